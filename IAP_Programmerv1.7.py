@@ -1,18 +1,18 @@
 import tkinter as tk
-from tkinter import filedialog, messagebox
+from tkinter import filedialog, messagebox, simpledialog
 import customtkinter
-from customtkinter import CTk, CTkComboBox, CTkEntry, CTkButton, CTkLabel, CTkProgressBar, CTkToplevel, CTkFrame
+from customtkinter import CTk, CTkComboBox, CTkEntry, CTkButton, CTkLabel, CTkProgressBar, CTkToplevel, CTkFrame, CTkCheckBox
 from tkinterdnd2 import DND_FILES, TkinterDnD
-import serial.tools.list_ports
-import serial
 import threading
-import time
+import queue
 import os
-import struct
-import binascii
-import re
 from ctypes import windll
 
+from iap_programmer import BaudCache, DeltaCache, ImageCache, ProgressQueue, TelemetryLog, flash_port
+from iap_programmer.merge import MergePart, merge_images
+from iap_programmer.profiles import DEFAULT_PROFILE, list_profiles
+from iap_programmer.hotplug import PORT_ADDED, PortMonitor, port_label
+
 # --- 强制开启 Windows 高 DPI 意识，防止系统模糊缩放 ---
 try:
     windll.shcore.SetProcessDpiAwareness(1)
@@ -25,12 +25,22 @@ customtkinter.set_default_color_theme("green")
 # 彻底禁用 customtkinter 的自动缩放影响
 customtkinter.deactivate_automatic_dpi_awareness()
 
+# 界面线程检查热插拔事件的间隔（毫秒）
+PORT_EVENT_POLL_MS = 200
+
+# 进度对话框刷新间隔（毫秒），下载线程的进度事件在此间隔内合并
+PROGRESS_REFRESH_MS = 100
+
+# 不超过该大小的镜像加载后复制到内存并释放文件映射：Windows 下映射期间文件不能被改写，
+# 选中文件时仍要能重新编译覆盖它；更大的文件保持映射，每次下载结束后释放，下次下载前重新加载
+IN_MEMORY_LIMIT = 16 * 1024 * 1024
+
 class ProgressBarDialog(CTkToplevel):
-    """进度条对话框"""
+    """进度条对话框，只能在界面线程中调用"""
     def __init__(self, parent):
         super().__init__(parent)
         self.title("下载进度")
-        self.geometry("350x120")
+        self.geometry("420x150")
         self.resizable(False, False)
         self.attributes('-topmost', True)
         self.protocol("WM_DELETE_WINDOW", lambda: None)
@@ -54,6 +64,10 @@ class ProgressBarDialog(CTkToplevel):
         self.label_percent = CTkLabel(self.frame, text="0%", font=("Verdana", 13))  # 11->13
         self.label_percent.pack()
         
+        # 吞吐率 / 剩余时间 / 重发次数
+        self.label_stats = CTkLabel(self.frame, text="", font=("Verdana", 12))
+        self.label_stats.pack()
+        
     def center_on_parent(self, parent):
         """将窗口居中显示在父窗口上"""
         # 更新窗口以确保获取正确的尺寸
@@ -78,7 +92,6 @@ class ProgressBarDialog(CTkToplevel):
         
     def set_operation_info(self, text: str):
         self.label_operation.configure(text=text)
-        self.update()
         
     def set_progress(self, current: int, total: int):
         """设置进度条 - 修复了参数顺序问题"""
@@ -96,7 +109,16 @@ class ProgressBarDialog(CTkToplevel):
         
         self.progress_bar.set(value)
         self.label_percent.configure(text=f"{percent}%")
-        self.update()
+        
+    def set_event(self, event):
+        """显示一条 iap_programmer.ProgressEvent"""
+        self.set_progress(event.percent, 100)
+        if event.blocks_total:
+            self.label_percent.configure(text=f"{event.percent}%  ({event.blocks_done}/{event.blocks_total} blocks)")
+            eta = event.eta
+            self.label_stats.configure(
+                text=f"{event.bytes_per_sec / 1024:.1f} KB/s   {event.blocks_per_sec:.1f} blocks/s   "
+                     f"ETA {'--' if eta is None else f'{eta:.1f}s'}   Retries {event.retries}")
         
     def close_bar(self):
         self.grab_release()
@@ -106,7 +128,7 @@ class IAPProgrammer:
     def __init__(self):
         self.root = TkinterDnD.Tk()
         self.root.title("IAP_Programmer_V1.7")
-        self.root.geometry("1080x500")
+        self.root.geometry("1080x540")
         self.root.resizable(False, False)
         self.root.configure(bg="#778899")
         
@@ -117,15 +139,18 @@ class IAPProgrammer:
         self.serial_port = None
         self.lock = threading.Lock()
         self.m_InitFlag = True
-        self.m_PortNameSelectUART = 0
-        self.init_thread = None
+        self.port_monitor = None
+        self.port_events = queue.Queue()  # 热插拔事件，由界面线程取出
         self.BinAddr = ""
-        self.file_data_list = []
-        self.file_extension = ""
-        self.file_min_address = 0xFFFFFFFF  # 记录HEX文件的最小地址
-        
-        # 预计算CRC表（提高计算速度）
-        self.crc_table = self._generate_crc32_table()
+        self.image = None  # 已解析的固件镜像（iap_programmer.FirmwareImage）
+        self.merge_parts = []  # 合并模式下的文件列表（MergePart），单文件时为空
+        self.delta_device_id = ""  # 上次差分下载输入的板子ID
+        self.image_cache = ImageCache()  # 解析结果磁盘缓存
+        self.download_error = None  # 最近一次下载的错误信息，由下载线程写入
+        self.telemetry = TelemetryLog()  # 会话性能记录（~/.iap_programmer/telemetry）
+        self.baud_cache = BaudCache()  # 各适配器协商出的波特率
+        self.profiles = list_profiles()  # 目标配置（块大小、命令字节、默认地址）
+        self.profile = self.profiles[DEFAULT_PROFILE]
         
         # 用于存储当前设备列表，用于比较
         self.current_devices = []
@@ -135,32 +160,11 @@ class IAPProgrammer:
         
         self.setup_ui()
         self.setup_drag_and_drop()
-        self.start_init_thread()
+        self.start_port_monitor()
         
         # 绑定窗口关闭事件
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
         
-    def _generate_crc32_table(self):
-        """生成CRC32查表法需要的256个表项"""
-        crc_table = []
-        for i in range(256):
-            crc = i
-            for _ in range(8):
-                if crc & 1:
-                    crc = (crc >> 1) ^ 0xEDB88320
-                else:
-                    crc >>= 1
-            crc_table.append(crc & 0xFFFFFFFF)
-        return crc_table
-        
-    def get_load_file_crc(self, data, initial_crc=0):
-        """使用查表法计算CRC32（速度更快，结果与原来完全一致）"""
-        crc = initial_crc
-        for byte in data:
-            crc = (crc >> 8) ^ self.crc_table[(crc ^ byte) & 0xFF]
-            crc &= 0xFFFFFFFF
-        return crc
-        
     def setup_ui(self):
         """设置UI界面 - 使用第一个文件的布局"""
         # UART Port
@@ -168,8 +172,9 @@ class IAPProgrammer:
                                        fg_color="#778899", text_color="#000000")
         self.label_uart_port.place(x=30, y=90)
         
+        # 可编辑：除本机串口外可直接输入 socket://host:port、rfc2217://host:port
         self.combo_port_name = CTkComboBox(self.main_frame, values=[], font=("Verdana", 14), width=425,  # 12->14
-                                          state="readonly", fg_color="#F0F0F0", text_color="#000000", 
+                                          state="normal", fg_color="#F0F0F0", text_color="#000000", 
                                           dropdown_fg_color="#F0F0F0")
         self.combo_port_name.place(x=160, y=86)
         
@@ -243,6 +248,45 @@ class IAPProgrammer:
                                         command=self.start_download)
         self.button_download.place(x=795, y=188)
         
+        # Pipeline Window（1 = 逐块应答的原有模式）
+        self.label_window = CTkLabel(self.main_frame, text="Pipeline Window", font=("Verdana", 16),
+                                    fg_color="#778899", text_color="#000000")
+        self.label_window.place(x=30, y=430)
+        
+        self.combo_window = CTkComboBox(self.main_frame, values=["1", "2", "4", "8", "16"],
+                                       font=("Verdana", 14), width=100, state="readonly",
+                                       fg_color="#F0F0F0", text_color="#000000", dropdown_fg_color="#F0F0F0")
+        self.combo_window.place(x=210, y=426)
+        self.combo_window.set("1")
+        
+        # Skip Blank Pages（bootloader 需在下载前擦除整个区域）
+        self.check_skip_blank = CTkCheckBox(self.main_frame, text="Skip Blank Pages", font=("Verdana", 16),
+                                           fg_color="#004040", text_color="#000000",
+                                           command=self.on_skip_blank_changed)
+        self.check_skip_blank.place(x=350, y=430)
+        
+        # Delta Reflash（只发送与该端口上次成功下载相比有变化的块）
+        self.check_delta = CTkCheckBox(self.main_frame, text="Delta Reflash", font=("Verdana", 16),
+                                      fg_color="#004040", text_color="#000000")
+        self.check_delta.place(x=580, y=430)
+        
+        # Auto Baud（以所选波特率握手后协商更高的波特率，需 bootloader 支持自动识别波特率）
+        self.check_auto_baud = CTkCheckBox(self.main_frame, text="Auto Baud", font=("Verdana", 16),
+                                          fg_color="#004040", text_color="#000000")
+        self.check_auto_baud.place(x=780, y=430)
+        
+        # Target Profile（块大小、命令字节与默认起始地址，见 python -m iap_programmer profiles）
+        self.label_profile = CTkLabel(self.main_frame, text="Target Profile", font=("Verdana", 16),
+                                     fg_color="#778899", text_color="#000000")
+        self.label_profile.place(x=30, y=480)
+        
+        self.combo_profile = CTkComboBox(self.main_frame, values=sorted(self.profiles),
+                                        font=("Verdana", 14), width=260, state="readonly",
+                                        fg_color="#F0F0F0", text_color="#000000", dropdown_fg_color="#F0F0F0",
+                                        command=self.on_profile_changed)
+        self.combo_profile.place(x=210, y=476)
+        self.combo_profile.set(DEFAULT_PROFILE)
+        
     def setup_drag_and_drop(self):
         """设置拖放功能 - 使用tkinterdnd2"""
         try:
@@ -253,8 +297,15 @@ class IAPProgrammer:
             
     def on_file_drop(self, event):
         """当文件被拖放到窗口时调用"""
+        if self.lock.locked():
+            # 下载中不能换文件：下载线程仍在读取当前镜像（进度对话框的 grab 挡不住拖放）
+            return
         try:
-            # 获取文件路径（处理可能的格式）
+            # 获取文件路径（处理可能的格式），多个文件时合并为一个镜像
+            paths = [p for p in self.root.tk.splitlist(event.data) if os.path.isfile(p)]
+            if len(paths) > 1:
+                self.load_merged(paths)
+                return
             path = event.data.strip('{}').strip('"')
             if os.path.isfile(path):
                 # 更新文件路径显示
@@ -264,34 +315,127 @@ class IAPProgrammer:
         except Exception as e:
             print(f"Error handling file drop: {e}")
             
+    def on_skip_blank_changed(self):
+        """切换空白页跳过后重新加载当前文件"""
+        self.reload_image()
+        
+    def reload_image(self):
+        """按当前选择（单个文件或合并的文件列表）重新加载镜像，下载中不做任何事"""
+        if self.lock.locked():
+            return
+        if self.merge_parts:
+            self.process_merged(self.merge_parts)
+            return
+        path = self.text_file_path.get()
+        if path and os.path.isfile(path):
+            self.process_file(path)
+            
+    def on_profile_changed(self, name: str):
+        """切换目标配置：BIN 文件的起始地址改为配置的默认地址，并按新的块大小重新加载当前文件"""
+        self.profile = self.profiles[name]
+        if not (self.image and self.image.absolute):
+            self.text_start_address.delete(0, tk.END)
+            self.text_start_address.insert(0, f"{self.profile.default_address:08X}")
+        print(f"Target profile {name}: block size {self.profile.block_size}")
+        self.on_skip_blank_changed()
+        
     def on_hex_keypress(self, event):
         char = event.char.upper()
         if char and (char not in "0123456789ABCDEF" and event.keysym != "BackSpace"):
             return "break"
             
     def open_file_dialog(self):
-        file_path = filedialog.askopenfilename(
+        file_paths = filedialog.askopenfilenames(
             filetypes=[
                 ("Supported Files", "*.bin;*.hex"),
                 ("Intel BIN Files", "*.bin"),
                 ("Hex Files", "*.hex"),
                 ("All Files", "*.*")
             ],
-            title="Open File"
+            title="Open File (select several to merge)"
         )
         
-        if file_path:
+        if len(file_paths) > 1:
+            self.load_merged(file_paths)
+        elif file_paths:
             self.text_file_path.delete(0, tk.END)
-            self.text_file_path.insert(0, file_path)
-            self.process_file(file_path)
+            self.text_file_path.insert(0, file_paths[0])
+            self.process_file(file_paths[0])
+            
+    def load_merged(self, paths):
+        """合并模式：逐个询问 BIN 文件的起始地址，再合并为一个镜像"""
+        parts = []
+        for path in paths:
+            base_addr = None
+            if os.path.splitext(path)[1].upper() == ".BIN":
+                text = simpledialog.askstring(
+                    "Base Address", f"Start address (hex) for {os.path.basename(path)}:",
+                    initialvalue=f"{self.profile.default_address:08X}", parent=self.root)
+                if text is None:
+                    return
+                try:
+                    base_addr = int(text, 16)
+                except ValueError:
+                    messagebox.showerror("Error", f"Invalid address: {text}")
+                    return
+            parts.append(MergePart(path, base_addr))
+        self.process_merged(parts)
+        
+    def release_image(self):
+        """释放当前镜像（及其文件映射），下载中（self.lock 被持有）不能调用"""
+        if self.image is not None:
+            self.image.close()
+        self.image = None
+        
+    def process_merged(self, parts):
+        """合并多个文件，在一次会话中下载；重叠等错误弹窗提示"""
+        if self.lock.locked():
+            return
+        self.release_image()
+        self.merge_parts = []
+        try:
+            image = merge_images(parts, block_size=self.profile.block_size,
+                                 skip_blank=bool(self.check_skip_blank.get()))
+        except (OSError, ValueError) as e:
+            print(f"Error merging files: {e}")
+            messagebox.showerror("Error", f"Failed to merge files: {str(e)}")
+            return
+        self.image = image
+        self.merge_parts = image.parts
+        
+        self.text_file_path.delete(0, tk.END)
+        self.text_file_path.insert(0, image.path)
+        if image.blocks:
+            self.text_start_address.delete(0, tk.END)
+            self.text_start_address.insert(0, f"{image.min_address:08X}")
+        for part in image.parts:
+            print(f"  {part.name}: 0x{part.start:08X}-0x{part.end:08X}, {part.length} bytes, CRC: 0x{part.crc:08X}")
+        self.show_image_info(image)
+            
+    def show_image_info(self, image):
+        """显示数据长度与 CRC"""
+        self.text_data_length.configure(state="normal")
+        self.text_data_length.delete(0, tk.END)
+        self.text_data_length.insert(0, f"{image.length} Bytes")
+        self.text_data_length.configure(state="readonly")
+        
+        self.text_data_crc.configure(state="normal")
+        self.text_data_crc.delete(0, tk.END)
+        self.text_data_crc.insert(0, f"0x{image.crc:08X}")
+        self.text_data_crc.configure(state="readonly")
+        
+        print(f"Loaded {len(image.blocks)} blocks, total {image.length} bytes, CRC: 0x{image.crc:08X}")
+        if image.skipped_blocks:
+            baud_rate = int(self.combo_baud_rate.get())
+            print(f"Skipped {image.skipped_blocks} blank blocks: {image.skipped_bytes} bytes, "
+                  f"~{image.skipped_seconds(baud_rate):.2f}s at {baud_rate} baud")
             
     def process_file(self, file_path: str):
-        """处理文件 - 使用第二个文件的CRC计算逻辑"""
+        """处理文件 - 解析由 iap_programmer 引擎完成，这里只负责更新界面"""
+        if self.lock.locked():
+            return
         try:
             ext = os.path.splitext(file_path)[1].upper()
-            self.file_extension = ext
-            self.file_min_address = 0xFFFFFFFF  # 重置最小地址
-            
             if ext not in [".BIN", ".HEX"]:
                 messagebox.showerror("Error", "The download file format error")
                 return
@@ -299,97 +443,23 @@ class IAPProgrammer:
             if not os.path.exists(file_path): 
                 return
                 
-            self.file_data_list = []
-            datalength, crc = 0, 0
+            self.release_image()
+            self.merge_parts = []
             
             try:
-                if ext == ".HEX":
-                    with open(file_path, 'r') as f:
-                        seg, last, p_len = 0, 0, 2048
-                        current_block = None
-                        min_address = 0xFFFFFFFF
-                        
-                        for line in f:
-                            if not line.startswith(':'): 
-                                continue
-                            rt = line[7:9]
-                            if rt == "04": 
-                                seg = int(line[9:13], 16) << 16
-                            elif rt == "00":
-                                l, off = int(line[1:3], 16), int(line[3:7], 16)
-                                addr = seg + off
-                                
-                                # 更新最小地址
-                                if addr < min_address:
-                                    min_address = addr
-                                
-                                datalength += l
-                                
-                                # 检查是否需要新块
-                                if current_block is None or (addr - current_block["addr"]) >= 2048 or p_len >= 2048:
-                                    if current_block is not None:
-                                        self.file_data_list.append(current_block)
-                                    
-                                    current_block = {
-                                        "addr": addr,
-                                        "data": bytearray([0xFF] * 2048)
-                                    }
-                                    p_len = 0
-                                
-                                # 解析数据
-                                data_hex = binascii.unhexlify(line[9:9+l*2])
-                                for b in data_hex:
-                                    if p_len < 2048:  # 确保不超过块大小
-                                        current_block["data"][p_len] = b
-                                        p_len += 1
-                                        crc = self.get_load_file_crc([b], crc)  # 使用查表法CRC
-                                    else:
-                                        # 如果当前块已满，创建新块
-                                        self.file_data_list.append(current_block)
-                                        current_block = {
-                                            "addr": addr,
-                                            "data": bytearray([0xFF] * 2048)
-                                        }
-                                        current_block["data"][0] = b
-                                        p_len = 1
-                                        crc = self.get_load_file_crc([b], crc)  # 使用查表法CRC
-                                
-                                last = addr + l
-                        
-                        # 添加最后一个块
-                        if current_block is not None:
-                            self.file_data_list.append(current_block)
-                        
-                        # 更新起始地址为HEX文件的最小地址
-                        if self.file_data_list and min_address != 0xFFFFFFFF:
-                            self.text_start_address.delete(0, tk.END)
-                            self.text_start_address.insert(0, f"{min_address:08X}")
-                            
-                else:  # BIN文件
-                    with open(file_path, 'rb') as f:
-                        content = f.read()
-                        datalength = len(content)
-                        
-                        for i in range(0, datalength, 2048):
-                            chunk = content[i:i+2048]
-                            block = bytearray(chunk)
-                            if len(block) < 2048: 
-                                block.extend([0xFF]*(2048-len(block)))
-                            self.file_data_list.append({"addr": i, "data": block})
-                            crc = self.get_load_file_crc(chunk, crc)  # 使用查表法CRC
-                            
-                # 更新UI显示
-                self.text_data_length.configure(state="normal")
-                self.text_data_length.delete(0, tk.END)
-                self.text_data_length.insert(0, f"{datalength} Bytes")
-                self.text_data_length.configure(state="readonly")
-                
-                self.text_data_crc.configure(state="normal")
-                self.text_data_crc.delete(0, tk.END)
-                self.text_data_crc.insert(0, f"0x{crc:08X}")
-                self.text_data_crc.configure(state="readonly")
+                image = self.image_cache.load_image(file_path, skip_blank=bool(self.check_skip_blank.get()),
+                                                    block_size=self.profile.block_size)
+                if image.length <= IN_MEMORY_LIMIT:
+                    image.detach()
+                self.image = image
                 
-                print(f"Loaded {len(self.file_data_list)} blocks, total {datalength} bytes, CRC: 0x{crc:08X}")
+                # 更新起始地址为HEX文件的最小地址
+                if image.is_hex and image.blocks and image.min_address != 0xFFFFFFFF:
+                    self.text_start_address.delete(0, tk.END)
+                    self.text_start_address.insert(0, f"{image.min_address:08X}")
+                    
+                # 更新UI显示
+                self.show_image_info(image)
                 
             except Exception as e:
                 print(f"Error processing file: {e}")
@@ -398,171 +468,153 @@ class IAPProgrammer:
         except Exception as e:
             messagebox.showerror("Error", f"Failed to process file: {str(e)}")
             
-    def start_init_thread(self):
-        self.init_thread = threading.Thread(target=self.init_device_thread, daemon=True)
-        self.init_thread.start()
-        
-    def init_device_thread(self):
-        while self.m_InitFlag:
-            self.init_device()
-            time.sleep(1)
+    def start_port_monitor(self):
+        """启动串口热插拔监视，事件经队列交给界面线程处理"""
+        self.port_monitor = PortMonitor(lambda kind, port: self.port_events.put((kind, port)))
+        self.port_monitor.start()
+        self.root.after(PORT_EVENT_POLL_MS, self.process_port_events)
+        
+    def process_port_events(self):
+        """在界面线程中处理热插拔事件并刷新串口列表"""
+        changed = False
+        while True:
+            try:
+                kind, port = self.port_events.get_nowait()
+            except queue.Empty:
+                break
+            print(f"Port {'added' if kind == PORT_ADDED else 'removed'}: {port_label(port)}")
+            changed = True
             
-    def init_device(self):
-        """初始化设备"""
-        with self.lock:
+        if changed:
             self.init_rs232_port_name()
-            
-    def mul_get_hardware_info(self, hard_type: str, prop_key: str) -> list:
-        """获取硬件信息"""
-        device_list = []
-        try:
-            ports = serial.tools.list_ports.comports()
-            for port in ports:
-                if port.description:
-                    device_list.append(f"{port.description} ({port.device})")
-                else:
-                    device_list.append(port.device)
-            return device_list
-        except Exception as e:
-            print(f"Error getting hardware info: {e}")
-            return []
+        if self.m_InitFlag:
+            self.root.after(PORT_EVENT_POLL_MS, self.process_port_events)
             
     def init_rs232_port_name(self):
-        """初始化串口列表"""
-        str_list = self.mul_get_hardware_info("Win32_SerialPort", "Name")
-        
-        # 检查设备列表是否有变化
-        if not self.current_devices or set(str_list) != set(self.current_devices):
-            self.current_devices = str_list
-            
-            # 更新下拉框
-            self.combo_port_name.configure(values=str_list)
-            
-            if str_list:
-                if self.m_PortNameSelectUART < len(str_list):
-                    try:
-                        self.combo_port_name.set(str_list[self.m_PortNameSelectUART])
-                    except:
-                        self.combo_port_name.set(str_list[0])
-                else:
-                    self.combo_port_name.set(str_list[0])
-            else:
-                self.combo_port_name.set("")
+        """按监视器当前的端口列表更新下拉框，保留仍然存在的选择"""
+        str_list = [port_label(port) for port in self.port_monitor.ports()]
+        if str_list == self.current_devices:
+            return
+        self.current_devices = str_list
+        
+        selected = self.combo_port_name.get()
+        self.combo_port_name.configure(values=str_list)
+        # 手动输入的网络端口（socket://、rfc2217://）不随本机端口变化而替换
+        if selected in str_list or "://" in selected:
+            self.combo_port_name.set(selected)
+        elif str_list:
+            self.combo_port_name.set(str_list[0])
+        else:
+            self.combo_port_name.set("")
                 
+    def selected_port(self) -> str:
+        """下拉框中的端口：本机端口取设备名（COMx、/dev/ttyUSBx），其余原样作为 pyserial URL
+        （socket://host:port、rfc2217://host:port 等）"""
+        text = self.combo_port_name.get().strip()
+        for port in self.port_monitor.ports():
+            if port_label(port) == text:
+                return port.device
+        return text
+        
     def start_download(self):
+        if self.lock.locked():
+            return
+            
         if not self.text_file_path.get():
             messagebox.showerror("Error", "Can't open the download file")
             return
             
-        if not self.file_data_list:
+        if self.image is None:
+            # 大文件上次下载后已释放映射，按当前选择重新加载
+            self.reload_image()
+        if not self.image or not self.image.blocks:
             messagebox.showerror("Error", "Please select a valid file first")
             return
             
-        download_thread = threading.Thread(target=self.download_thread_rs232, daemon=True)
+        # 界面控件只在界面线程中读取，参数传给下载线程
+        port_name = self.selected_port()
+        if not port_name:
+            messagebox.showerror("Error", "Download failed: No port selected")
+            return
+        device_id = None
+        if self.check_delta.get():
+            # 差分缓存按板子记录：按端口记录时换上的新板会被当作已下载过，什么都不发送
+            device_id = simpledialog.askstring(
+                "Delta Reflash", "Board ID (e.g. serial number) of the board on this port:",
+                initialvalue=self.delta_device_id, parent=self.root)
+            if not device_id:
+                return
+            self.delta_device_id = device_id
+        try:
+            settings = {
+                "port_name": port_name,
+                "baud_rate": int(self.combo_baud_rate.get()),
+                "window": int(self.combo_window.get()),
+                "base_addr": int(self.text_start_address.get(), 16),
+                "device_id": device_id,
+                "auto_baud": bool(self.check_auto_baud.get()),
+                "profile": self.profile,
+            }
+        except ValueError as e:
+            messagebox.showerror("Error", f"Download failed: {str(e)}")
+            return
+            
+        # 创建进度对话框
+        progress_dialog = ProgressBarDialog(self.root)
+        progress_dialog.set_operation_info("Downloading.......")
+        progress_dialog.set_progress(0, 100)  # 初始0%
+        
+        events = ProgressQueue()
+        self.download_error = None
+        # 在界面线程中加锁，下载线程结束时释放：从启动起换文件的操作就都会被忽略
+        self.lock.acquire()
+        download_thread = threading.Thread(target=self.download_thread_rs232, args=(events,),
+                                           kwargs=settings, daemon=True)
         download_thread.start()
+        self.root.after(PROGRESS_REFRESH_MS, self.poll_download, progress_dialog, events, download_thread)
         
-    def download_thread_rs232(self):
-        """下载线程 - 使用第二个文件的下载逻辑"""
-        with self.lock:
-            # 创建进度对话框
-            progress_dialog = ProgressBarDialog(self.root)
+    def poll_download(self, progress_dialog, events, download_thread):
+        """在界面线程中按固定间隔显示最新进度，下载线程结束后关闭对话框"""
+        event = events.latest()
+        if event is not None:
+            progress_dialog.set_event(event)
             
-            # 在新线程中显示对话框
-            def show_progress_dialog():
-                progress_dialog.set_operation_info("Downloading.......")
-                progress_dialog.set_progress(0, 100)  # 初始0%
+        if download_thread.is_alive():
+            self.root.after(PROGRESS_REFRESH_MS, self.poll_download, progress_dialog, events, download_thread)
+            return
             
-            threading.Thread(target=show_progress_dialog, daemon=True).start()
-            time.sleep(0.1)  # 给对话框显示时间
+        progress_dialog.close_bar()
+        if self.image is not None and self.image.mapping is not None:
+            # 下载期间以外不占用文件映射
+            self.release_image()
+        if self.download_error is None:
+            messagebox.showinfo("Success", "Download succeed!")
+        else:
+            messagebox.showerror("Error", f"Download failed: {self.download_error}")
+            
+    def download_thread_rs232(self, events, port_name, baud_rate, window, base_addr, device_id, auto_baud,
+                              profile):
+        """下载线程：不访问界面控件，进度经 events 交给界面线程；device_id 不为空时差分下载
+
+        self.lock 由 start_download 在界面线程中获得，这里结束时释放。
+        """
+        try:
+            result = flash_port(self.image, port_name, baud_rate, base_addr, window,
+                                on_info=print, on_event=events.put,
+                                delta_cache=DeltaCache() if device_id else None, device_id=device_id,
+                                telemetry=self.telemetry,
+                                auto_baud=auto_baud, baud_cache=self.baud_cache, profile=profile)
+            self.download_error = None if result.ok else result.error
+        finally:
+            self.lock.release()
             
-            ser = None
-            try:
-                # 打开串口
-                port_match = re.search(r'COM\d+', self.combo_port_name.get(), re.IGNORECASE)
-                if not port_match:
-                    raise Exception("Invalid COM port selected")
-                    
-                port_name = port_match.group()
-                baud_rate = int(self.combo_baud_rate.get())
-                
-                ser = serial.Serial(
-                    port=port_name,
-                    baudrate=baud_rate,
-                    bytesize=8,
-                    parity=serial.PARITY_NONE,
-                    stopbits=serial.STOPBITS_ONE,
-                    timeout=1.5
-                )
-                ser.reset_input_buffer()
-                
-                total_blocks = len(self.file_data_list)
-                
-                # 1. 握手
-                progress_dialog.set_progress(5, 100)  # 5%
-                ser.write(b'\x5A\xA5')
-                if ser.read(2) != b'\xCC\xDD': 
-                    raise Exception("Handshake timeout")
-                time.sleep(0.8)
-                
-                # 2. 开始
-                progress_dialog.set_progress(10, 100)  # 10%
-                ser.write(b'\x5A\x01')
-                if ser.read(2) != b'\xCC\xDD': 
-                    raise Exception("Mode entry failed")
-                
-                # 3. 数据发送
-                ui_base_addr = int(self.text_start_address.get(), 16)
-                
-                for i, block in enumerate(self.file_data_list):
-                    # 计算目标地址
-                    if self.file_extension == ".HEX":
-                        # 对于HEX文件，使用块中的绝对地址
-                        target_addr = block["addr"]
-                    else:
-                        # 对于BIN文件，使用基础地址 + 块偏移
-                        target_addr = ui_base_addr + block["addr"]
-                    
-                    # 构建数据包
-                    packet = bytearray([0x31])  # 数据包起始标志
-                    packet.extend(struct.pack(">I", target_addr))  # 大端序地址
-                    packet.extend(block["data"])  # 2048字节数据
-                    
-                    # 计算校验和（包括地址字节和数据）
-                    checksum = sum(packet[1:2053]) & 0xFF
-                    packet.append(checksum)
-                    
-                    # 发送数据包
-                    ser.write(packet)
-                    if ser.read(2) != b'\xCC\xDD':
-                        raise Exception(f"Block {i} address {hex(target_addr)} checksum error")
-                    
-                    # 更新进度 - 从10%到90%
-                    progress = 10 + int((i + 1) * 80 / total_blocks)
-                    progress_dialog.set_progress(progress, 100)
-                
-                # 4. 结束
-                progress_dialog.set_progress(95, 100)  # 95%
-                ser.write(b'\x5A\x02')
-                ser.read(2)  # 读取响应
-                
-                progress_dialog.set_progress(100, 100)  # 100%
-                time.sleep(0.5)
-                progress_dialog.close_bar()
-                
-                messagebox.showinfo("Success", "Download succeed!")
-                
-            except Exception as e:
-                progress_dialog.close_bar()
-                messagebox.showerror("Error", f"Download failed: {str(e)}")
-            finally:
-                if ser and ser.is_open:
-                    ser.close()
-                    
     def on_closing(self):
         self.m_InitFlag = False
         
-        if self.init_thread and self.init_thread.is_alive():
-            time.sleep(0.1)
+        if self.port_monitor:
+            self.port_monitor.stop()
+        if not self.lock.locked():
+            self.release_image()
             
         self.root.destroy()
 
@@ -0,0 +1,117 @@
+"""端到端下载性能测试（基于 bootloader 模拟器，无需硬件）
+
+对每种波特率 × 镜像大小 × 发送窗口组合完整执行一次下载会话，报告端到端吞吐率、
+各阶段耗时和每块往返时间，并校验模拟器收到的数据与镜像一致。
+
+    python benchmarks/bench_download.py [--bauds 115200,921600] [--sizes 64K,256K]
+                                        [--windows 1,4] [--latency 2] [--transport pty|tcp]
+                                        [--profile default-lz4] [--file app.bin]
+
+随机数据无法压缩；比较压缩数据包的效果时用 --file 指定真实固件（BIN/HEX，代替 --sizes）。
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from iap_programmer.image import load_image  # noqa: E402
+from iap_programmer.profiles import get_profile  # noqa: E402
+from iap_programmer.protocol import Downloader, open_serial  # noqa: E402
+from iap_programmer.simulator import BootloaderSimulator  # noqa: E402
+
+BASE_ADDR = 0x08010000
+
+
+def parse_size(text):
+    text = text.strip().upper()
+    scale = {"K": 1024, "M": 1024 * 1024}.get(text[-1:], 1)
+    return int(text.rstrip("KM")) * scale
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def run_once(path, baud, window, latency, transport, profile):
+    """执行一次下载会话，返回结果字典"""
+    image = load_image(path, block_size=profile.block_size)
+    base_addr = image.min_address if image.absolute else BASE_ADDR
+    with BootloaderSimulator(baud_rate=baud, program_latency=latency, profile=profile) as sim:
+        port = sim.start_tcp() if transport == "tcp" else sim.start_pty()
+        ser = open_serial(port, baud)
+        try:
+            downloader = Downloader(ser, window=window, profile=profile)
+            start = time.perf_counter()
+            downloader.download(image, base_addr)
+            total = time.perf_counter() - start
+        finally:
+            ser.close()
+
+        ok = all(sim.memory.get(image.target_address(block, base_addr)) == bytes(block.data)
+                 for block in image.blocks)
+
+    wire = downloader.bytes_sent
+    phases = downloader.phase_times
+    rtts = downloader.block_rtts
+    return {
+        "total": total,
+        "e2e": image.length / total,
+        "phases": phases,
+        "block_rate": wire / phases["blocks"],
+        "link_util": wire * 10 / baud / phases["blocks"],
+        "rtt_p50": percentile(rtts, 0.5),
+        "rtt_p95": percentile(rtts, 0.95),
+        "rtt_mean": statistics.mean(rtts),
+        "ok": ok,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bauds", default="460800,921600")
+    parser.add_argument("--sizes", default="64K,256K")
+    parser.add_argument("--windows", default="1,4")
+    parser.add_argument("--latency", type=float, default=2.0, help="flash program time per block in ms")
+    parser.add_argument("--transport", choices=("pty", "tcp"), default="pty" if os.name == "posix" else "tcp")
+    parser.add_argument("--profile", help="target profile, e.g. default-lz4 for compressed packets")
+    parser.add_argument("--file", help="firmware file to download instead of random images")
+    args = parser.parse_args()
+    profile = get_profile(args.profile)
+
+    print(f"transport={args.transport} program_latency={args.latency}ms profile={profile.name}")
+    print(f"{'baud':>7} {'size':>8} {'win':>3} | {'total':>7} {'e2e B/s':>9} | "
+          f"{'hs ms':>6} {'mode':>6} {'blocks s':>8} {'fin ms':>6} | "
+          f"{'blk B/s':>8} {'link%':>5} | {'rtt p50':>7} {'p95':>7} ms | ok")
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.file:
+            images = [(os.path.getsize(args.file), args.file)]
+        else:
+            images = []
+            for size in (parse_size(s) for s in args.sizes.split(",")):
+                path = os.path.join(tmp, f"image_{size}.bin")
+                with open(path, "wb") as f:
+                    f.write(rng.randbytes(size))
+                images.append((size, path))
+
+        for size, path in images:
+            for baud in (int(b) for b in args.bauds.split(",")):
+                for window in (int(w) for w in args.windows.split(",")):
+                    r = run_once(path, baud, window, args.latency / 1000, args.transport, profile)
+                    ph = r["phases"]
+                    print(f"{baud:>7} {size:>8} {window:>3} | {r['total']:>6.2f}s {r['e2e']:>9.0f} | "
+                          f"{ph['handshake'] * 1000:>6.1f} {ph['mode_entry'] * 1000:>6.1f} {ph['blocks']:>8.3f} {ph['finish'] * 1000:>6.1f} | "
+                          f"{r['block_rate']:>8.0f} {r['link_util'] * 100:>4.0f}% | "
+                          f"{r['rtt_p50'] * 1000:>7.2f} {r['rtt_p95'] * 1000:>7.2f}    | {r['ok']}",
+                          flush=True)
+
+
+if __name__ == "__main__":
+    main()
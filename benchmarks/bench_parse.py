@@ -0,0 +1,129 @@
+"""HEX/BIN 解析耗时与文件大小的关系
+
+与逐字节解析的旧实现对比，同时校验长度、CRC 一致且按页输出的数据与原始数据相同。
+
+    python benchmarks/bench_parse.py [--sizes 64K,256K,1M,2M]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import binascii
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from iap_programmer.image import BLOCK_SIZE, load_image  # noqa: E402
+
+
+def _crc32_table():
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xEDB88320 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+_TABLE = _crc32_table()
+
+
+def _table_crc(data, crc):
+    for byte in data:
+        crc = (crc >> 8) ^ _TABLE[(crc ^ byte) & 0xFF]
+        crc &= 0xFFFFFFFF
+    return crc
+
+
+def legacy_load_hex(path):
+    """旧版逐字节解析（参考实现），返回 (blocks, length, crc)"""
+    blocks, datalength, crc = [], 0, 0
+    with open(path, 'r') as f:
+        seg, p_len = 0, BLOCK_SIZE
+        current_block = None
+        for line in f:
+            if not line.startswith(':'):
+                continue
+            rt = line[7:9]
+            if rt == "04":
+                seg = int(line[9:13], 16) << 16
+            elif rt == "00":
+                l, off = int(line[1:3], 16), int(line[3:7], 16)
+                addr = seg + off
+                datalength += l
+                if current_block is None or (addr - current_block["addr"]) >= BLOCK_SIZE or p_len >= BLOCK_SIZE:
+                    if current_block is not None:
+                        blocks.append(current_block)
+                    current_block = {"addr": addr, "data": bytearray([0xFF] * BLOCK_SIZE)}
+                    p_len = 0
+                for b in binascii.unhexlify(line[9:9+l*2]):
+                    if p_len >= BLOCK_SIZE:
+                        blocks.append(current_block)
+                        current_block = {"addr": addr, "data": bytearray([0xFF] * BLOCK_SIZE)}
+                        p_len = 0
+                    current_block["data"][p_len] = b
+                    p_len += 1
+                    crc = _table_crc([b], crc)
+        if current_block is not None:
+            blocks.append(current_block)
+    return blocks, datalength, crc
+
+
+def write_hex(path, data, base=0x08000000, record_len=16):
+    """按 Intel HEX 格式写出 data（含 04 扩展线性地址记录）"""
+    def record(rtype, addr, payload):
+        raw = bytes([len(payload), (addr >> 8) & 0xFF, addr & 0xFF, rtype]) + payload
+        return ":" + (raw + bytes([(-sum(raw)) & 0xFF])).hex().upper() + "\n"
+
+    upper = None
+    with open(path, "w") as f:
+        for off in range(0, len(data), record_len):
+            addr = base + off
+            if addr >> 16 != upper:
+                upper = addr >> 16
+                f.write(record(0x04, 0, upper.to_bytes(2, "big")))
+            f.write(record(0x00, addr & 0xFFFF, data[off:off + record_len]))
+        f.write(":00000001FF\n")
+
+
+def parse_size(text):
+    text = text.strip().upper()
+    scale = {"K": 1024, "M": 1024 * 1024}.get(text[-1:], 1)
+    return int(text.rstrip("KM")) * scale
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="64K,256K,1M,2M", help="comma separated image sizes")
+    parser.add_argument("--no-legacy", action="store_true", help="skip the per-byte reference parser")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    print(f"{'size':>8} {'hex file':>10} {'load_image':>11} {'legacy':>9} {'speedup':>8}  ok")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in (parse_size(s) for s in args.sizes.split(",")):
+            data = rng.randbytes(size)
+            path = os.path.join(tmp, f"image_{size}.hex")
+            write_hex(path, data)
+
+            start = time.perf_counter()
+            image = load_image(path)
+            t_new = time.perf_counter() - start
+
+            line = f"{size:>8} {os.path.getsize(path):>10} {t_new * 1000:>9.1f}ms"
+            if args.no_legacy:
+                print(line)
+                continue
+
+            start = time.perf_counter()
+            blocks, length, crc = legacy_load_hex(path)
+            t_old = time.perf_counter() - start
+            memory = b"".join(block.data for block in image.blocks)
+            ok = (length == image.length and crc == image.crc and memory[:size] == data)
+            print(f"{line} {t_old * 1000:>7.1f}ms {t_old / t_new:>7.1f}x  {ok}")
+
+
+if __name__ == "__main__":
+    main()
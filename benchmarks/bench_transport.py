@@ -0,0 +1,256 @@
+"""网络串口传输性能测试：经本地 TCP 串口服务器替身下载，测量每块往返时间
+
+模拟远程工位的 串口-TCP 网桥（ser2net 等）：bootloader 模拟器在 TCP 上运行，
+本地网桥把上位机连接转发给它，可选每个方向附加固定延迟模拟网络；
+分别以 socket://（原始 TCP）与 rfc2217://（pyserial PortManager 实现的 RFC2217 服务器）连接网桥，
+并与直连模拟器对比。--nagle 额外测量关闭 TCP_NODELAY（pyserial socket:// 的默认行为）时的结果。
+
+    python benchmarks/bench_transport.py [--size 64K] [--baud 921600] [--windows 1,4]
+                                         [--delay 0.5] [--latency 2] [--nagle]
+
+--baud 0 去掉模拟 UART 的速率限制，只剩网络与网桥的延迟。
+"""
+import os
+import sys
+import time
+import heapq
+import random
+import socket
+import argparse
+import tempfile
+import threading
+import statistics
+
+import serial
+import serial.rfc2217
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from iap_programmer.image import load_image  # noqa: E402
+from iap_programmer.protocol import Downloader, open_serial  # noqa: E402
+from iap_programmer.simulator import BootloaderSimulator  # noqa: E402
+
+BASE_ADDR = 0x08010000
+
+
+def parse_size(text):
+    text = text.strip().upper()
+    scale = {"K": 1024, "M": 1024 * 1024}.get(text[-1:], 1)
+    return int(text.rstrip("KM")) * scale
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+class DelayedPipe:
+    """把 recv 到的数据延迟 delay 秒后写给 send，delay 为 0 时直接转发"""
+    def __init__(self, recv, send, delay: float):
+        self.recv = recv
+        self.send = send
+        self.delay = delay
+        self.pending = []
+        self.cond = threading.Condition()
+        self.closed = False
+
+    def run(self):
+        if self.delay:
+            threading.Thread(target=self._sender, daemon=True).start()
+        seq = 0
+        while True:
+            try:
+                data = self.recv()
+            except OSError:
+                data = b''
+            if not data:
+                break
+            if not self.delay:
+                try:
+                    self.send(data)
+                except OSError:
+                    break
+                continue
+            with self.cond:
+                heapq.heappush(self.pending, (time.perf_counter() + self.delay, seq, data))
+                seq += 1
+                self.cond.notify()
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+
+    def _sender(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.closed:
+                    self.cond.wait()
+                if not self.pending:
+                    return
+                due, _, data = self.pending[0]
+                wait = due - time.perf_counter()
+                if wait > 0:
+                    self.cond.wait(wait)
+                    continue
+                heapq.heappop(self.pending)
+            try:
+                self.send(data)
+            except OSError:
+                return
+
+
+class Bridge:
+    """本地网桥：接受上位机连接，转发到设备端 TCP 地址（模拟器）"""
+    def __init__(self, device_url: str, mode: str, delay: float):
+        self.device_url = device_url
+        self.mode = mode
+        self.delay = delay
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(1)
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"{self.mode}://127.0.0.1:{self.server.getsockname()[1]}"
+
+    def close(self):
+        self.server.close()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            target = self._serve_rfc2217 if self.mode == "rfc2217" else self._serve_socket
+            threading.Thread(target=target, args=(conn,), daemon=True).start()
+
+    def _serve_socket(self, conn):
+        host, port = self.device_url[len("socket://"):].rsplit(":", 1)
+        device = socket.create_connection((host, int(port)))
+        device.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        up = DelayedPipe(lambda: conn.recv(65536), device.sendall, self.delay)
+        down = DelayedPipe(lambda: device.recv(65536), conn.sendall, self.delay)
+        t = threading.Thread(target=down.run, daemon=True)
+        t.start()
+        up.run()
+        device.close()
+        conn.close()
+
+    def _serve_rfc2217(self, conn):
+        # 设备端“串口”即到模拟器的 TCP 连接，RFC2217 的参数设置对其无实际作用
+        device = serial.serial_for_url(self.device_url, timeout=0.05)
+        device._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        lock = threading.Lock()
+
+        class Connection:
+            def write(self, data):
+                with lock:
+                    conn.sendall(data)
+
+        manager = serial.rfc2217.PortManager(device, Connection())
+        running = [True]
+
+        def from_device():
+            while running[0]:
+                try:
+                    data = device.read(device.in_waiting or 1)
+                except serial.SerialException:
+                    break
+                if data:
+                    Connection().write(b"".join(manager.escape(data)))
+
+        def to_device(data):
+            data = b"".join(manager.filter(data))
+            if data:
+                device.write(data)
+
+        down = threading.Thread(target=from_device, daemon=True)
+        down.start()
+        up = DelayedPipe(lambda: conn.recv(65536), to_device, self.delay)
+        up.run()
+        running[0] = False
+        down.join(timeout=1)
+        device.close()
+        conn.close()
+
+
+def run_once(path, baud, window, latency, mode, delay, nagle=False):
+    """执行一次下载会话，返回结果字典"""
+    image = load_image(path)
+    with BootloaderSimulator(baud_rate=baud or None, program_latency=latency) as sim:
+        device_url = sim.start_tcp()
+        bridge = Bridge(device_url, mode, delay) if mode != "direct" else None
+        url = bridge.url if bridge else device_url
+        try:
+            start = time.perf_counter()
+            ser = open_serial(url, baud or 115200)
+            opened = time.perf_counter() - start
+            if nagle:
+                ser._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 0)
+            try:
+                downloader = Downloader(ser, window=window)
+                start = time.perf_counter()
+                downloader.download(image, BASE_ADDR)
+                total = time.perf_counter() - start
+            finally:
+                ser.close()
+        finally:
+            if bridge:
+                bridge.close()
+        ok = all(sim.memory.get(BASE_ADDR + block.addr) == bytes(block.data) for block in image.blocks)
+
+    rtts = downloader.block_rtts
+    phases = downloader.phase_times
+    return {
+        "open": opened,
+        "total": total,
+        "phases": phases,
+        "block_rate": downloader.bytes_sent / phases["blocks"],
+        "rtt_p50": percentile(rtts, 0.5),
+        "rtt_p95": percentile(rtts, 0.95),
+        "rtt_mean": statistics.mean(rtts),
+        "ok": ok,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", default="64K")
+    parser.add_argument("--baud", type=int, default=921600,
+                        help="simulated UART rate behind the bridge; 0 = unlimited, to isolate network latency")
+    parser.add_argument("--windows", default="1,4")
+    parser.add_argument("--delay", type=float, default=0.5, help="one-way bridge delay in ms")
+    parser.add_argument("--latency", type=float, default=2.0, help="flash program time per block in ms")
+    parser.add_argument("--nagle", action="store_true", help="also measure socket:// with TCP_NODELAY off")
+    args = parser.parse_args()
+
+    runs = [("direct", False), ("socket", False)]
+    if args.nagle:
+        runs.append(("socket", True))
+    runs.append(("rfc2217", False))
+
+    print(f"baud={args.baud} bridge_delay={args.delay}ms program_latency={args.latency}ms")
+    print(f"{'transport':<16} {'win':>3} | {'open ms':>7} {'total':>7} | {'hs ms':>6} {'mode':>6} {'blocks s':>8} "
+          f"{'fin ms':>6} | {'blk B/s':>8} | {'rtt p50':>7} {'p95':>7} {'mean':>7} ms | ok")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "image.bin")
+        with open(path, "wb") as f:
+            f.write(random.Random(0).randbytes(parse_size(args.size)))
+
+        for window in (int(w) for w in args.windows.split(",")):
+            for mode, nagle in runs:
+                r = run_once(path, args.baud, window, args.latency / 1000, mode, args.delay / 1000, nagle)
+                ph = r["phases"]
+                name = mode + (" (nagle)" if nagle else "")
+                print(f"{name:<16} {window:>3} | {r['open'] * 1000:>7.1f} {r['total']:>6.2f}s | "
+                      f"{ph['handshake'] * 1000:>6.1f} {ph['mode_entry'] * 1000:>6.1f} {ph['blocks']:>8.3f} "
+                      f"{ph['finish'] * 1000:>6.1f} | {r['block_rate']:>8.0f} | "
+                      f"{r['rtt_p50'] * 1000:>7.2f} {r['rtt_p95'] * 1000:>7.2f} {r['rtt_mean'] * 1000:>7.2f}    | "
+                      f"{r['ok']}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""IAP 下载引擎：固件解析、CRC 与串口下载协议，不依赖 tkinter"""
+from .crc import get_load_file_crc
+from .image import BLOCK_SIZE, FirmwareImage, load_image
+from .image_cache import ImageCache
+from .merge import merge_images
+from .patch import Patch, apply_patches, parse_patch
+from .profiles import TargetProfile, get_profile, list_profiles
+from .progress import ProgressEvent, ProgressQueue, ProgressThrottle
+from .protocol import (IAPError, Downloader, PacketStream, open_serial, build_block_packet,
+                       build_compressed_packet)
+from .gang import GangResult, flash_port, gang_flash
+from .baud import BaudCache, negotiate_baud
+from .delta import DeltaCache, download_delta
+from .hotplug import PortMonitor
+from .telemetry import TelemetryLog
+from .simulator import BootloaderSimulator
+
+__all__ = [
+    "BLOCK_SIZE",
+    "FirmwareImage",
+    "load_image",
+    "ImageCache",
+    "merge_images",
+    "Patch",
+    "apply_patches",
+    "parse_patch",
+    "get_load_file_crc",
+    "TargetProfile",
+    "get_profile",
+    "list_profiles",
+    "ProgressEvent",
+    "ProgressQueue",
+    "ProgressThrottle",
+    "IAPError",
+    "Downloader",
+    "PacketStream",
+    "open_serial",
+    "build_block_packet",
+    "build_compressed_packet",
+    "GangResult",
+    "flash_port",
+    "gang_flash",
+    "BaudCache",
+    "negotiate_baud",
+    "DeltaCache",
+    "download_delta",
+    "PortMonitor",
+    "TelemetryLog",
+    "BootloaderSimulator",
+]
@@ -0,0 +1,184 @@
+"""自动选择波特率
+
+协议中没有切换波特率的命令，只能用于自动识别波特率（或同时监听多个波特率）的 bootloader：
+先以安全波特率握手确认设备在线，再在同一个已打开的端口上用 ser.baudrate 依次切换到更高的
+候选波特率，连续握手 LINK_TEST_PROBES 次全部应答即认为链路可用，取通过的最高波特率进行整个会话。
+固定波特率的 bootloader 在高波特率下不应答，自动退回安全波特率，只多花几十毫秒。
+
+协商结果按适配器（USB VID:PID:序列号，无法识别时为端口名）缓存，
+下次先只测试缓存的波特率；会话在该波特率下失败时删除缓存，由调用方以安全波特率重试。
+"""
+import os
+import json
+import time
+import threading
+
+import serial
+import serial.tools.list_ports
+
+from .profiles import BUILTIN_PROFILES, DEFAULT_PROFILE
+from .protocol import HANDSHAKE_POLL, IAPError, drain_input, set_read_timeout
+
+# 候选波特率，从高到低尝试（均高于安全波特率的才会测试）
+DEFAULT_CANDIDATES = (1382400, 1228800, 921600, 460800, 230400)
+
+# 链路测试：连续握手次数与每次等待应答的时间（秒）
+LINK_TEST_PROBES = 8
+LINK_TEST_TIMEOUT = 0.05
+
+# 安全波特率下确认设备在线的握手超时（秒），设备可能仍在复位
+SAFE_HANDSHAKE_TIMEOUT = 3.0
+
+# 缓存默认有效期：7天
+DEFAULT_MAX_AGE = 7 * 24 * 3600
+
+
+def default_cache_path() -> str:
+    return os.path.join(os.path.expanduser("~"), ".iap_programmer", "baud.json")
+
+
+def adapter_id(port: str) -> str:
+    """串口适配器标识：USB 设备为 VID:PID:序列号，其余为端口名"""
+    try:
+        for info in serial.tools.list_ports.comports():
+            if info.device == port and info.vid is not None:
+                return f"{info.vid:04X}:{info.pid:04X}:{info.serial_number or port}"
+    except Exception:
+        pass
+    return port
+
+
+def wait_handshake(ser, timeout: float = SAFE_HANDSHAKE_TIMEOUT, profile=None):
+    """每隔 HANDSHAKE_POLL 秒重发握手直到收到应答，超时抛出 IAPError"""
+    profile = profile or BUILTIN_PROFILES[DEFAULT_PROFILE]
+    deadline = time.perf_counter() + timeout
+    saved = ser.timeout
+    set_read_timeout(ser, HANDSHAKE_POLL)
+    try:
+        while time.perf_counter() < deadline:
+            ser.write(profile.handshake)
+            if ser.read(len(profile.ack)) == profile.ack:
+                # 丢弃设备对重复握手的应答
+                drain_input(ser)
+                return
+        raise IAPError("Handshake timeout")
+    finally:
+        set_read_timeout(ser, saved)
+
+
+def link_test(ser, baud_rate: int, probes: int = LINK_TEST_PROBES, timeout: float = LINK_TEST_TIMEOUT,
+              profile=None):
+    """把端口切换到 baud_rate 并连续握手，全部应答时返回平均往返时间（秒），否则返回 None"""
+    profile = profile or BUILTIN_PROFILES[DEFAULT_PROFILE]
+    try:
+        ser.baudrate = baud_rate
+    except (ValueError, serial.SerialException):
+        # 适配器不支持该波特率
+        return None
+    ser.reset_input_buffer()
+    saved = ser.timeout
+    set_read_timeout(ser, timeout)
+    try:
+        total = 0.0
+        for _ in range(probes):
+            start = time.perf_counter()
+            ser.write(profile.handshake)
+            if ser.read(len(profile.ack)) != profile.ack:
+                drain_input(ser)
+                return None
+            total += time.perf_counter() - start
+        return total / probes
+    finally:
+        set_read_timeout(ser, saved)
+
+
+class BaudCache:
+    """每个适配器协商出的波特率与链路质量，存放在一个 JSON 文件中
+
+    可在多个下载线程间共享（gang --auto-baud），读-改-写在锁内进行；
+    临时文件按进程与线程命名，同时运行的多个进程也不会互相覆盖写到一半的文件。
+    """
+    def __init__(self, path: str = None, max_age: float = DEFAULT_MAX_AGE):
+        self.path = path or default_cache_path()
+        self.max_age = max_age
+        self._lock = threading.Lock()
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, entries: dict):
+        tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp, 'w') as f:
+                json.dump(entries, f, indent=1)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"Baud cache write failed: {e}")
+
+    def load(self, key: str, safe_baud: int):
+        """缓存的记录，不存在、已过期或安全波特率不同时返回 None"""
+        entry = self._read().get(key)
+        if not entry or entry.get("safe_baud") != safe_baud:
+            return None
+        if time.time() - entry.get("time", 0) > self.max_age:
+            return None
+        return entry
+
+    def store(self, key: str, safe_baud: int, baud_rate: int, rtt):
+        with self._lock:
+            entries = self._read()
+            entries[key] = {"safe_baud": safe_baud, "baud": baud_rate, "rtt": rtt, "time": time.time()}
+            self._write(entries)
+
+    def invalidate(self, key: str):
+        with self._lock:
+            entries = self._read()
+            if entries.pop(key, None) is not None:
+                self._write(entries)
+
+
+def negotiate_baud(ser, safe_baud: int, candidates=DEFAULT_CANDIDATES, cache: BaudCache = None,
+                   key: str = None, on_info=None, profile=None) -> int:
+    """在已打开的端口上选择最高可用波特率，返回时端口已切换到该波特率
+
+    安全波特率下握手失败时抛出 IAPError（与正常下载的握手失败相同）。
+    """
+    def info(text):
+        if on_info:
+            on_info(text)
+
+    ser.baudrate = safe_baud
+    wait_handshake(ser, profile=profile)
+
+    entry = cache.load(key, safe_baud) if cache is not None and key else None
+    if entry is not None:
+        if entry["baud"] == safe_baud:
+            info(f"Baud rate {safe_baud} (cached)")
+            return safe_baud
+        rtt = link_test(ser, entry["baud"], profile=profile)
+        if rtt is not None:
+            info(f"Baud rate {entry['baud']} (cached), link test rtt {rtt * 1000:.2f}ms")
+            return entry["baud"]
+        info(f"Cached baud rate {entry['baud']} failed the link test, probing again")
+
+    chosen, chosen_rtt = safe_baud, None
+    for baud_rate in sorted((b for b in candidates if b > safe_baud), reverse=True):
+        rtt = link_test(ser, baud_rate, profile=profile)
+        if rtt is not None:
+            chosen, chosen_rtt = baud_rate, rtt
+            break
+
+    if chosen == safe_baud:
+        ser.baudrate = safe_baud
+        drain_input(ser)
+        info(f"No faster baud rate passed the link test, staying at {safe_baud}")
+    else:
+        info(f"Baud rate {chosen}, link test rtt {chosen_rtt * 1000:.2f}ms")
+    if cache is not None and key:
+        cache.store(key, safe_baud, chosen, chosen_rtt)
+    return chosen
@@ -0,0 +1,432 @@
+"""命令行入口：python -m iap_programmer flash --port COM3 --baud 115200 app.hex"""
+import sys
+import time
+import argparse
+import threading
+
+from .baud import BaudCache
+from .delta import DeltaCache
+from .gang import flash_port, gang_flash
+from .hotplug import PORT_ADDED, PortMonitor, port_label
+from .image import load_image
+from .image_cache import ImageCache
+from .merge import merge_images
+from .patch import apply_patches, parse_patch
+from .profiles import get_profile, list_profiles, save_profile
+from .progress import ProgressThrottle
+from .telemetry import PHASES, TelemetryLog, aggregate
+from .simulator import BootloaderSimulator
+from .tune import DEFAULT_BLOCK_SIZES, best_result, tune_block_sizes
+
+
+def _print_event(event):
+    # 行尾补空格，覆盖上一行较长的内容
+    print(f"\r{event}    ", end="", flush=True)
+    if event.percent >= 100:
+        print()
+
+
+def _print_info(text: str):
+    # 覆盖当前进度行
+    print(f"\r{text}")
+
+
+def _profile(args):
+    """按 --profile 取目标配置，名称无效时打印错误并返回 None"""
+    try:
+        return get_profile(args.profile)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return None
+
+
+def _load(args, profile):
+    """按目标配置的块大小加载镜像并确定起始地址，镜像为空时返回 (None, 0)
+
+    指定多个文件或 file@address 时合并为一个镜像（见 merge.py），不使用镜像缓存。
+    --patch 的单板数据写入镜像（只改内存中的镜像，不改缓存与文件），仅 flash 命令有此参数。
+    """
+    try:
+        if len(args.file) > 1 or "@" in args.file[0]:
+            image = merge_images(args.file, block_size=profile.block_size, skip_blank=args.skip_blank)
+        elif args.no_image_cache:
+            image = load_image(args.file[0], skip_blank=args.skip_blank, block_size=profile.block_size)
+        else:
+            image = ImageCache().load_image(args.file[0], skip_blank=args.skip_blank,
+                                            block_size=profile.block_size)
+    except (OSError, ValueError) as e:
+        # ValueError 包括格式错误与 HEX 解析错误（binascii.Error）
+        print(f"Error: {e}", file=sys.stderr)
+        return None, 0
+    for part in image.parts:
+        print(f"  {part.name}: 0x{part.start:08X}-0x{part.end:08X}, {part.length} bytes, "
+              f"CRC: 0x{part.crc:08X}")
+    if not image.blocks:
+        print("Error: no data in download file", file=sys.stderr)
+        return None, 0
+    print(f"Loaded {len(image.blocks)} blocks, total {image.length} bytes, CRC: 0x{image.crc:08X}")
+    if image.skipped_blocks:
+        print(f"Skipped {image.skipped_blocks} blank blocks: {image.skipped_bytes} bytes, "
+              f"~{image.skipped_seconds(args.baud):.2f}s at {args.baud} baud")
+
+    if args.address is not None:
+        try:
+            base_addr = int(args.address, 16)
+        except ValueError:
+            print(f"Error: Invalid start address {args.address!r}", file=sys.stderr)
+            image.close()
+            return None, 0
+    elif image.absolute:
+        base_addr = image.min_address
+    else:
+        base_addr = profile.default_address
+
+    if getattr(args, "patch", None):
+        try:
+            patches = [parse_patch(spec) for spec in args.patch]
+            start = time.perf_counter()
+            apply_patches(image, patches, base_addr)
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return None, 0
+        print(f"Patched {len(patches)} fields in {(time.perf_counter() - start) * 1e6:.0f}us, "
+              f"CRC: 0x{image.crc:08X}")
+    return image, base_addr
+
+
+def _session_options(args) -> dict:
+    """flash / gang 共用的会话参数"""
+    return {
+        "settle": args.settle / 1000,
+        "retries": args.retries,
+        "retry_backoff": args.retry_backoff / 1000,
+        "reconnects": args.reconnects,
+        "telemetry": None if args.no_telemetry else TelemetryLog(args.telemetry_dir),
+        "auto_baud": args.auto_baud,
+        "baud_cache": BaudCache() if args.auto_baud else None,
+    }
+
+
+def cmd_flash(args) -> int:
+    profile = _profile(args)
+    if profile is None:
+        return 2
+    if args.delta and not args.device_id:
+        # 以端口为键时换上一块新板会被当作已下载过，什么都不发送
+        print("Error: --delta needs --device-id to identify the board", file=sys.stderr)
+        return 2
+    image, base_addr = _load(args, profile)
+    if image is None:
+        return 1
+
+    result = flash_port(image, args.port, args.baud, base_addr, window=args.window,
+                        on_event=None if args.quiet else ProgressThrottle(_print_event),
+                        on_info=_print_info,
+                        delta_cache=DeltaCache(args.cache_dir) if args.delta else None,
+                        device_id=args.device_id, profile=profile, **_session_options(args))
+    if not result.ok:
+        print(f"\nDownload failed: {result.error}", file=sys.stderr)
+        return 1
+
+    print(f"Download succeed! baud={result.baud} retries={result.retries} reconnects={result.reconnects}")
+    return 0
+
+
+def cmd_gang(args) -> int:
+    profile = _profile(args)
+    if profile is None:
+        return 2
+    image, base_addr = _load(args, profile)
+    if image is None:
+        return 1
+
+    # 各端口进度，整十变化时刷新一行汇总
+    percents = {port: 0 for port in args.port}
+    lock = threading.Lock()
+
+    def on_progress(port, current, total):
+        percent = int(current * 100 / total)
+        with lock:
+            if percent // 10 == percents[port] // 10:
+                return
+            percents[port] = percent
+            if not args.quiet:
+                print("  ".join(f"{p}:{v:3d}%" for p, v in percents.items()), flush=True)
+
+    start = time.perf_counter()
+    results = gang_flash(image, args.port, args.baud, base_addr, window=args.window,
+                         on_progress=on_progress, profile=profile, **_session_options(args))
+    wall = time.perf_counter() - start
+
+    for r in results:
+        if r.ok:
+            print(f"{r.port}: OK   {r.elapsed:7.2f}s  {r.throughput:9.0f} B/s  "
+                  f"baud={r.baud} retries={r.retries} reconnects={r.reconnects}")
+        else:
+            print(f"{r.port}: FAIL {r.elapsed:7.2f}s  {r.error}  "
+                  f"retries={r.retries} reconnects={r.reconnects}")
+
+    ok = sum(1 for r in results if r.ok)
+    total_bytes = sum(r.bytes_sent for r in results)
+    print(f"{ok}/{len(results)} succeeded in {wall:.2f}s, station throughput "
+          f"{total_bytes / wall if wall > 0 else 0:.0f} B/s")
+    return 0 if ok == len(results) else 1
+
+
+def cmd_simulate(args) -> int:
+    profile = _profile(args)
+    if profile is None:
+        return 2
+    sim = BootloaderSimulator(baud_rate=args.baud, program_latency=args.latency / 1000,
+                              nak_rate=args.nak_rate, drop_rate=args.drop_rate,
+                              line_rates=[int(b) for b in args.line_rates.split(",")] if args.line_rates else None,
+                              profile=profile)
+    port = sim.start_tcp(port=args.tcp) if args.tcp is not None else sim.start_pty()
+    print(f"Simulated bootloader on {port} (Ctrl+C to stop)", flush=True)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sim.stop()
+    print(f"handshakes={sim.handshakes} blocks={sim.blocks_received} compressed={sim.compressed_blocks} "
+          f"naks={sim.naks} drops={sim.drops} finishes={sim.finishes}")
+    return 0
+
+
+def cmd_ports(args) -> int:
+    if not args.watch:
+        monitor = PortMonitor(lambda kind, port: None)
+        monitor.rescan()
+        for port in monitor.ports():
+            print(port_label(port))
+        return 0
+
+    def on_event(kind, port):
+        print(f"{'+' if kind == PORT_ADDED else '-'} {port_label(port)}", flush=True)
+
+    with PortMonitor(on_event) as monitor:
+        print(f"Watching serial ports ({monitor.backend}), Ctrl+C to stop", flush=True)
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+def cmd_profiles(args) -> int:
+    for name, profile in sorted(list_profiles().items()):
+        tuned = ""
+        if profile.tuned:
+            tuned = f"  (tuned on {profile.tuned.get('port')} at {profile.tuned.get('baud')} baud)"
+        compression = f"  {profile.compression}" if profile.compression else ""
+        print(f"{name:<16} block {profile.block_size:6d}  address {profile.default_address:08X}  "
+              f"handshake {profile.handshake.hex(' ').upper()}  ack {profile.ack.hex(' ').upper()}{compression}  "
+              f"{profile.description}{tuned}")
+    return 0
+
+
+def cmd_tune(args) -> int:
+    base = _profile(args)
+    if base is None:
+        return 2
+    try:
+        block_sizes = [int(b) for b in args.block_sizes.split(",")]
+    except ValueError:
+        print(f"Error: Invalid block sizes {args.block_sizes!r}", file=sys.stderr)
+        return 1
+    try:
+        base_addr = int(args.address, 16) if args.address is not None else base.default_address
+    except ValueError:
+        print(f"Error: Invalid start address {args.address!r}", file=sys.stderr)
+        return 1
+
+    def flash(image, profile):
+        address = image.min_address if image.absolute else base_addr
+        if not args.simulate:
+            return flash_port(image, args.port, args.baud, address, window=args.window, profile=profile)
+        with BootloaderSimulator(baud_rate=args.baud, program_latency=args.sim_latency / 1000,
+                                 profile=profile) as sim:
+            port = sim.start_pty()
+            return flash_port(image, port, args.baud, address, window=args.window, profile=profile)
+
+    target = "simulator" if args.simulate else args.port
+    print(f"Tuning block size on {target} at {args.baud} baud, window {args.window}, {args.runs} runs each")
+    try:
+        results = tune_block_sizes(args.file, base, flash, block_sizes, args.runs, on_info=print)
+    except (OSError, ValueError) as e:
+        # 文件无法读取或解析、块大小无效
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    best = best_result(results)
+    if best is None:
+        print("No block size was stable", file=sys.stderr)
+        return 1
+    print(f"Fastest stable block size: {best.block_size} ({best.median:.3f}s, {best.throughput:.0f} B/s)")
+
+    if args.save:
+        tuned = {
+            "port": target,
+            "baud": args.baud,
+            "window": args.window,
+            "file": args.file,
+            "time": time.time(),
+            "results": [r.to_dict() for r in results],
+        }
+        save_profile(base.copy(args.save, block_size=best.block_size, tuned=tuned))
+        print(f"Saved target profile {args.save!r}")
+    return 0
+
+
+def _ms(seconds) -> str:
+    if seconds is None:
+        return "-"
+    return f"{seconds * 1000:.1f}"
+
+
+def cmd_report(args) -> int:
+    log = TelemetryLog(args.telemetry_dir)
+    since = time.time() - args.since * 3600 if args.since else None
+    records = log.sessions(since)
+    if not records:
+        print(f"No sessions in {log.log_path}")
+        return 1
+
+    rows = aggregate(records, by=args.by)
+    width = max(len(args.by), *(len(row[args.by]) for row in rows))
+    print(f"{args.by:<{width}}  {'sessions':>8} {'ok':>5}  {'total s':>8}  "
+          + "  ".join(f"{phase + ' ms':>13}" for phase in PHASES)
+          + f"  {'blk B/s':>9}  {'rtt p50':>7} {'rtt p95':>7}  {'retries':>7}  failed in")
+    for row in rows:
+        elapsed = f"{row['elapsed']:.2f}" if row["elapsed"] is not None else "-"
+        rate = f"{row['bytes_per_sec']:.0f}" if row["bytes_per_sec"] is not None else "-"
+        print(f"{row[args.by]:<{width}}  {row['sessions']:>8} {row['ok']:>5}  {elapsed:>8}  "
+              + "  ".join(f"{_ms(row['phases'][phase]):>13}" for phase in PHASES)
+              + f"  {rate:>9}  {_ms(row['rtt_p50']):>7} {_ms(row['rtt_p95']):>7}  {row['retries']:>7}  "
+              + ",".join(row["failed_states"]))
+    print("times are medians over successful sessions; rtt percentiles are estimated from histograms")
+    return 0
+
+
+def _window(text: str) -> int:
+    """--window 参数：至少为 1"""
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError("must be at least 1")
+    return value
+
+
+def _add_download_arguments(p):
+    """flash / gang 共用的参数"""
+    p.add_argument("file", nargs="+",
+                   help="firmware image (.hex or .bin); several files, each BIN written as "
+                        "file.bin@ADDRESS (hex), are merged and sent in one session")
+    p.add_argument("--baud", type=int, default=115200, help="baud rate (default: 115200)")
+    p.add_argument("--profile", help="target profile: block size, command bytes and default address "
+                                     "(default: default; see the profiles command)")
+    p.add_argument("--auto-baud", action="store_true",
+                   help="handshake at --baud, then switch to the fastest rate that passes a link test; "
+                        "only for bootloaders that detect the baud rate (cached per adapter in "
+                        "~/.iap_programmer/baud.json)")
+    p.add_argument("--address", help="start address in hex for BIN files (default: from the profile)")
+    p.add_argument("--window", type=_window, default=1,
+                   help="number of blocks in flight; 1 = stop-and-wait (default: 1)")
+    p.add_argument("--skip-blank", action="store_true",
+                   help="do not send blocks that are all 0xFF (bootloader must erase the region first)")
+    p.add_argument("--settle", type=float, default=0.0,
+                   help="extra wait in ms after the handshake, for bootloaders that drop "
+                        "bytes right after it (default: 0)")
+    p.add_argument("--retries", type=int,
+                   help="resends per block after a bad or missing ack "
+                        "(default: 0 for stop-and-wait, 3 when pipelined)")
+    p.add_argument("--retry-backoff", type=float, default=20.0,
+                   help="initial backoff in ms before a resend, doubled each time (default: 20)")
+    p.add_argument("--reconnects", type=int, default=0,
+                   help="reopen the port up to N times after a failed session and resume from the "
+                        "first unacknowledged block (bootloader must not erase on mode entry)")
+    p.add_argument("--no-image-cache", action="store_true",
+                   help="always parse the file instead of using ~/.iap_programmer/images")
+    p.add_argument("--no-telemetry", action="store_true",
+                   help="do not record session timings")
+    p.add_argument("--telemetry-dir", help="session log directory (default: ~/.iap_programmer/telemetry)")
+    p.add_argument("-q", "--quiet", action="store_true", help="do not print progress")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="iap_programmer", description="IAP serial programmer")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("flash", help="download a HEX/BIN file over a serial port")
+    p.add_argument("--port", required=True, help="serial port, e.g. COM3 or /dev/ttyUSB0")
+    p.add_argument("--device-id", help="identifies the board for --delta (e.g. its serial number)")
+    p.add_argument("--delta", action="store_true",
+                   help="send only blocks that changed since the last successful download to the board "
+                        "named by --device-id; falls back to a full download when the cache is missing "
+                        "or stale")
+    p.add_argument("--cache-dir", help="delta cache directory (default: ~/.iap_programmer/devices)")
+    # 单板数据只对一块板有意义，gang 不提供
+    p.add_argument("--patch", action="append", metavar="ADDRESS=VALUE",
+                   help="write per-unit data (serial number, MAC, calibration) at a hex address; VALUE is "
+                        "hex bytes, u8/u16/u32/u64:NUMBER (little-endian) or str:TEXT; repeatable. "
+                        "The address must lie inside the file data")
+    _add_download_arguments(p)
+    p.set_defaults(func=cmd_flash)
+
+    p = sub.add_parser("gang", help="download the same file to several serial ports concurrently")
+    p.add_argument("--port", required=True, action="append",
+                   help="serial port; repeat for each device")
+    _add_download_arguments(p)
+    p.set_defaults(func=cmd_gang)
+
+    p = sub.add_parser("simulate", help="run a simulated bootloader on a pty or TCP port")
+    p.add_argument("--baud", type=int, help="emulated line rate (default: unlimited)")
+    p.add_argument("--latency", type=float, default=0.0, help="flash program time per block in ms")
+    p.add_argument("--nak-rate", type=float, default=0.0, help="probability of a NAK per block")
+    p.add_argument("--drop-rate", type=float, default=0.0, help="probability of no reply per block")
+    p.add_argument("--line-rates",
+                   help="comma-separated host baud rates the device understands (pty on Linux only; "
+                        "default: any)")
+    p.add_argument("--profile", help="target profile to emulate (default: default)")
+    p.add_argument("--tcp", type=int, metavar="PORT",
+                   help="listen on 127.0.0.1:PORT instead of a pty (0 = any free port)")
+    p.set_defaults(func=cmd_simulate)
+
+    p = sub.add_parser("ports", help="list serial ports")
+    p.add_argument("--watch", action="store_true", help="keep running and print hotplug events")
+    p.set_defaults(func=cmd_ports)
+
+    p = sub.add_parser("profiles", help="list target profiles")
+    p.set_defaults(func=cmd_profiles)
+
+    p = sub.add_parser("tune", help="find the fastest stable block size for a target (flashes the device "
+                                    "several times per candidate)")
+    p.add_argument("file", help="firmware image used for the test downloads")
+    target = p.add_mutually_exclusive_group(required=True)
+    target.add_argument("--port", help="serial port of a bootloader that accepts every candidate size")
+    target.add_argument("--simulate", action="store_true", help="tune against the built-in simulator")
+    p.add_argument("--baud", type=int, default=115200, help="baud rate (default: 115200)")
+    p.add_argument("--window", type=_window, default=1, help="pipeline window (default: 1)")
+    p.add_argument("--profile", help="profile providing command bytes and address (default: default)")
+    p.add_argument("--address", help="start address in hex for BIN files (default: from the profile)")
+    p.add_argument("--block-sizes", default=",".join(str(b) for b in DEFAULT_BLOCK_SIZES),
+                   help="comma-separated candidate block sizes")
+    p.add_argument("--runs", type=int, default=3, help="downloads per candidate (default: 3)")
+    p.add_argument("--sim-latency", type=float, default=2.0,
+                   help="simulated flash program time per block in ms (default: 2)")
+    p.add_argument("--save", metavar="NAME", help="save the result as target profile NAME")
+    p.set_defaults(func=cmd_tune)
+
+    p = sub.add_parser("report", help="summarize recorded download sessions")
+    p.add_argument("--telemetry-dir", help="session log directory (default: ~/.iap_programmer/telemetry)")
+    p.add_argument("--by", default="port", choices=["port", "station", "baud", "window", "block_size", "profile", "compression", "file"],
+                   help="group sessions by this field (default: port)")
+    p.add_argument("--since", type=float, help="only sessions from the last N hours")
+    p.set_defaults(func=cmd_report)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.func(args)
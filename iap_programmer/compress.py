@@ -0,0 +1,134 @@
+"""数据块压缩：LZ4 块格式（无帧头），用于 0x32 压缩数据包
+
+选用 LZ4 块格式是因为设备端解压只需几十行 C、不需要额外内存（直接解压到页缓冲区），
+也可以直接使用 lz4.c 中的 LZ4_decompress_safe。压缩在上位机编译数据包时进行，
+本模块的压缩器为纯 Python 贪心实现，遵守格式的结尾约束（最后 5 字节为字面量、
+最后一次匹配至少在结尾前 12 字节开始），输出可被任何标准 LZ4 块解压器解压。
+decompress_block 为参考解压器，模拟器用它校验数据包。
+"""
+
+COMPRESSION_LZ4 = "lz4"
+COMPRESSIONS = (COMPRESSION_LZ4,)
+
+MIN_MATCH = 4
+MAX_OFFSET = 0xFFFF
+
+# 格式结尾约束
+_LAST_LITERALS = 5
+_MF_LIMIT = 12
+
+# 连续未命中时加大步长（与 lz4 参考实现的 acceleration 相同），不可压缩的数据很快跳过
+_SKIP_TRIGGER = 6
+
+
+def _put_length(out: bytearray, n: int):
+    """写入长度的扩展字节（token 中的 4 位已为 15）"""
+    while n >= 255:
+        out.append(255)
+        n -= 255
+    out.append(n)
+
+
+def _put_sequence(out: bytearray, literals, offset: int = 0, match: int = 0):
+    """写入一个序列：token + 字面量 + 偏移 + 匹配长度；offset 为 0 时为最后一个只有字面量的序列"""
+    lit = len(literals)
+    ml = match - MIN_MATCH
+    out.append((min(lit, 15) << 4) | (min(ml, 15) if offset else 0))
+    if lit >= 15:
+        _put_length(out, lit - 15)
+    out += literals
+    if offset:
+        out.append(offset & 0xFF)
+        out.append(offset >> 8)
+        if ml >= 15:
+            _put_length(out, ml - 15)
+
+
+def compress_block(data) -> bytes:
+    """按 LZ4 块格式压缩一块数据"""
+    src = bytes(data)
+    n = len(src)
+    out = bytearray()
+    anchor = 0
+    if n > _MF_LIMIT:
+        table = {}
+        match_limit = n - _LAST_LITERALS  # 匹配不能覆盖最后 5 字节
+        pos = 0
+        end = n - _MF_LIMIT + 1           # 匹配起点上限
+        misses = 0
+        while pos < end:
+            key = src[pos:pos + MIN_MATCH]
+            cand = table.get(key)
+            table[key] = pos
+            if cand is None or pos - cand > MAX_OFFSET:
+                misses += 1
+                pos += 1 + (misses >> _SKIP_TRIGGER)
+                continue
+
+            # 向后扩展匹配：先按 32 字节比较，再逐字节比较（允许与当前位置重叠）
+            length = MIN_MATCH
+            while (pos + length + 32 <= match_limit
+                   and src[cand + length:cand + length + 32] == src[pos + length:pos + length + 32]):
+                length += 32
+            while pos + length < match_limit and src[cand + length] == src[pos + length]:
+                length += 1
+
+            _put_sequence(out, src[anchor:pos], pos - cand, length)
+            pos += length
+            anchor = pos
+            misses = 0
+    _put_sequence(out, src[anchor:])
+    return bytes(out)
+
+
+def decompress_block(payload, size: int) -> bytes:
+    """参考解压器：解压一个 LZ4 块，结果必须正好为 size 字节，否则抛出 ValueError"""
+    src = bytes(payload)
+    n = len(src)
+    out = bytearray()
+    i = 0
+    try:
+        while True:
+            token = src[i]
+            i += 1
+            lit = token >> 4
+            if lit == 15:
+                while True:
+                    b = src[i]
+                    i += 1
+                    lit += b
+                    if b != 255:
+                        break
+            if i + lit > n:
+                raise ValueError("literal run past end of input")
+            out += src[i:i + lit]
+            i += lit
+            if i == n:
+                break  # 最后一个序列只有字面量
+
+            offset = src[i] | (src[i + 1] << 8)
+            i += 2
+            if offset == 0 or offset > len(out):
+                raise ValueError(f"invalid match offset {offset}")
+            match = (token & 15) + MIN_MATCH
+            if token & 15 == 15:
+                while True:
+                    b = src[i]
+                    i += 1
+                    match += b
+                    if b != 255:
+                        break
+            if len(out) + match > size:
+                raise ValueError("output larger than block size")
+            start = len(out) - offset
+            if offset >= match:
+                out += out[start:start + match]
+            else:
+                # 重叠复制：以 offset 为周期重复
+                pattern = out[start:]
+                out += (pattern * (match // offset + 1))[:match]
+    except IndexError:
+        raise ValueError("truncated input") from None
+    if len(out) != size:
+        raise ValueError(f"decompressed {len(out)} bytes, expected {size}")
+    return bytes(out)
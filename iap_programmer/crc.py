@@ -0,0 +1,64 @@
+"""CRC32 计算（与 IAP 上位机显示的 Data CRC 一致）"""
+import zlib
+import functools
+
+
+def get_load_file_crc(data, initial_crc=0):
+    """计算CRC32（初值0、无结果取反）
+    
+    多项式与 zlib.crc32 相同（0xEDB88320），区别仅在于 zlib 的初值与结果各取反一次，
+    这里抵消掉这两次取反，直接用 C 实现整段计算。data 为 bytes-like 对象。
+    """
+    return zlib.crc32(data, initial_crc ^ 0xFFFFFFFF) ^ 0xFFFFFFFF
+
+
+# 反射表示的多项式，与 zlib 相同
+_POLY = 0xEDB88320
+
+
+def _multmodp(a: int, b: int) -> int:
+    """模多项式乘法 a * b mod P（反射表示，x^0 为最高位）"""
+    m = 1 << 31
+    p = 0
+    while True:
+        if a & m:
+            p ^= b
+            if not a & (m - 1):
+                break
+        m >>= 1
+        b = (b >> 1) ^ _POLY if b & 1 else b >> 1
+    return p
+
+
+def _x2n_table() -> list:
+    # x^(2^n) mod P，n = 0..31
+    table = [1 << 30]  # x^1
+    for _ in range(31):
+        table.append(_multmodp(table[-1], table[-1]))
+    return table
+
+
+_X2N = _x2n_table()
+
+
+@functools.lru_cache(maxsize=256)
+def _x8nmodp(n: int) -> int:
+    """x^(8n) mod P（逐板写入时地址固定，结果缓存）"""
+    p = 1 << 31  # x^0
+    k = 3
+    while n:
+        if n & 1:
+            p = _multmodp(_X2N[k & 31], p)
+        n >>= 1
+        k += 1
+    return p
+
+
+def crc_shift(crc: int, length: int) -> int:
+    """在数据后追加 length 个 0x00 字节后的 CRC，耗时与 length 无关"""
+    return _multmodp(_x8nmodp(length), crc)
+
+
+def crc_combine(crc1: int, crc2: int, length2: int) -> int:
+    """由两段数据各自的 CRC 求首尾相接后的 CRC，length2 为第二段的长度"""
+    return crc_shift(crc1, length2) ^ crc2
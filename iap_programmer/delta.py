@@ -0,0 +1,103 @@
+"""差分下载：按设备缓存上次成功下载的块哈希，只发送内容有变化的块
+
+适用于按页擦写的 bootloader（进入下载模式时不整片擦除应用区）。
+以下情况退回整片下载：
+  * 该设备没有缓存记录；
+  * 缓存已超过 max_age 秒；
+  * 缓存的块大小与当前不一致；
+  * 上次会话未成功结束（会话开始前即删除缓存，成功后才重新写入）。
+"""
+import os
+import re
+import json
+import time
+import hashlib
+
+from .image import BLOCK_SIZE
+
+CACHE_VERSION = 1
+
+# 缓存默认有效期：7天
+DEFAULT_MAX_AGE = 7 * 24 * 3600
+
+
+def default_cache_dir() -> str:
+    return os.path.join(os.path.expanduser("~"), ".iap_programmer", "devices")
+
+
+def block_hash(data) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class DeltaCache:
+    """设备块哈希缓存，每台设备一个 JSON 文件，键为端口名或设备ID"""
+    def __init__(self, cache_dir: str = None, max_age: float = DEFAULT_MAX_AGE):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_age = max_age
+
+    def _path(self, key: str) -> str:
+        name = re.sub(r'[^A-Za-z0-9_.-]', '_', key)
+        return os.path.join(self.cache_dir, f"{name}.json")
+
+    def load(self, key: str, block_size: int = BLOCK_SIZE):
+        """读取设备缓存，不存在、已失效或块大小不同时返回 (None, 原因)"""
+        try:
+            with open(self._path(key), 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None, "no cache"
+        if entry.get("version") != CACHE_VERSION or entry.get("key") != key:
+            return None, "cache format mismatch"
+        if entry.get("block_size") != block_size:
+            return None, "block size changed"
+        if time.time() - entry.get("time", 0) > self.max_age:
+            return None, "cache expired"
+        return entry, ""
+
+    def invalidate(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def plan(self, key: str, image, base_addr: int):
+        """返回 (待发送块列表, 缓存记录或None, 说明)"""
+        entry, reason = self.load(key, image.block_size)
+        if entry is None:
+            return list(image.blocks), None, f"full download ({reason})"
+
+        hashes = entry["blocks"]
+        blocks = [block for block in image.blocks
+                  if hashes.get(f"{image.target_address(block, base_addr):08X}") != block_hash(block.data)]
+        return blocks, entry, f"delta download: {len(blocks)}/{len(image.blocks)} blocks changed"
+
+    def store(self, key: str, image, base_addr: int, previous=None):
+        """记录成功下载后设备上的块内容；未被覆盖的旧块保留"""
+        hashes = dict(previous["blocks"]) if previous else {}
+        for block in image.blocks:
+            hashes[f"{image.target_address(block, base_addr):08X}"] = block_hash(block.data)
+
+        entry = {
+            "version": CACHE_VERSION,
+            "key": key,
+            "block_size": image.block_size,
+            "time": time.time(),
+            "blocks": hashes,
+        }
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key)
+        with open(path + ".tmp", 'w') as f:
+            json.dump(entry, f)
+        os.replace(path + ".tmp", path)
+
+
+def download_delta(downloader, image, base_addr: int, cache: DeltaCache, key: str, on_info=None):
+    """按缓存执行差分下载，成功后更新缓存"""
+    blocks, previous, note = cache.plan(key, image, base_addr)
+    if on_info:
+        on_info(f"{key}: {note}")
+
+    # 会话中断时设备内容未知，先删除缓存，成功后再写入
+    cache.invalidate(key)
+    downloader.download(image, base_addr, blocks=blocks)
+    cache.store(key, image, base_addr, previous)
@@ -0,0 +1,148 @@
+"""多串口并行下载（产线一拖多）"""
+import time
+import threading
+
+from .baud import adapter_id, negotiate_baud
+from .protocol import Downloader, PacketStream, open_serial
+
+
+class GangResult:
+    """单个端口的下载结果"""
+    def __init__(self, port: str):
+        self.port = port
+        self.ok = False
+        self.error = ""
+        self.elapsed = 0.0
+        self.bytes_sent = 0
+        self.retries = 0     # 块重发总次数
+        self.reconnects = 0  # 断线重连次数
+        self.baud = 0        # 实际使用的波特率
+
+    @property
+    def throughput(self) -> float:
+        return self.bytes_sent / self.elapsed if self.elapsed > 0 else 0.0
+
+
+def flash_port(image, port: str, baud_rate: int, base_addr: int, window: int = 1,
+               on_progress=None, on_info=None, delta_cache=None, device_id: str = None,
+               reconnects: int = 0, stream: PacketStream = None, telemetry=None,
+               auto_baud: bool = False, baud_cache=None, profile=None, **options) -> GangResult:
+    """打开端口并完成一次下载，异常记录在结果中而不抛出
+    
+    指定 delta_cache 时执行差分下载，缓存键为 device_id（必须指定：同一端口上换了板子时，
+    按端口记录的缓存不代表当前板上的内容）。
+    reconnects 大于 0 时，会话失败后关闭并重新打开端口，重新握手后从第一个未应答的块继续，
+    要求 bootloader 进入下载模式时不整片擦除。
+    stream 为按 base_addr 预编译的 PacketStream（差分下载时忽略）。
+    telemetry 为 TelemetryLog 时每次会话尝试（含重连）都写入一条性能记录。
+    auto_baud 为 True 时以 baud_rate 握手后协商更高的波特率（见 baud.negotiate_baud，结果按适配器缓存在
+    baud_cache 中）；在协商出的波特率下失败时删除缓存，以 baud_rate 从第一块重新下载，不计入 reconnects。
+    profile 为目标配置（profiles.TargetProfile），镜像须按其块大小解析。
+    其余关键字参数（timeouts、settle、retries、on_event 等）传给 Downloader。
+    """
+    result = GangResult(port)
+    start = time.perf_counter()
+    blocks, previous = None, None
+    start_block = 0
+    try:
+        if delta_cache is not None:
+            if not device_id:
+                raise ValueError("Delta download needs a device ID to identify the board")
+            blocks, previous, note = delta_cache.plan(device_id, image, base_addr)
+            if on_info:
+                on_info(f"{device_id}: {note}")
+            # 会话中断时设备内容未知，先删除缓存，成功后再写入
+            delta_cache.invalidate(device_id)
+            stream = None
+        if stream is None:
+            stream = PacketStream(image, base_addr, blocks,
+                                  compression=profile.compression if profile is not None else None)
+        adapter = adapter_id(port) if auto_baud and baud_cache is not None else None
+
+        while True:
+            ser = None
+            downloader = None
+            attempt_start = time.perf_counter()
+            try:
+                ser = open_serial(port, baud_rate)
+                if auto_baud:
+                    negotiate_baud(ser, baud_rate, cache=baud_cache, key=adapter, on_info=on_info,
+                                   profile=profile)
+                result.baud = ser.baudrate
+                downloader = Downloader(ser, window=window, on_progress=on_progress, on_info=on_info,
+                                        profile=profile, **options)
+                downloader.download(image, base_addr, start_block=start_block, stream=stream)
+                result.bytes_sent += downloader.bytes_sent
+                result.retries += downloader.retry_count
+                if telemetry is not None:
+                    telemetry.record_session(downloader, port, ser.baudrate, image,
+                                             elapsed=time.perf_counter() - attempt_start)
+                break
+            except Exception as e:
+                if downloader is not None:
+                    result.retries += downloader.retry_count
+                    start_block = downloader.resume_block
+                    if telemetry is not None:
+                        telemetry.record_session(downloader, port, ser.baudrate, image, error=str(e),
+                                                 elapsed=time.perf_counter() - attempt_start)
+                if auto_baud and ser is not None and ser.baudrate != baud_rate:
+                    # 协商出的波特率不可靠：退回安全波特率整片重发
+                    auto_baud = False
+                    start_block = 0
+                    if baud_cache is not None:
+                        baud_cache.invalidate(adapter)
+                    if on_info:
+                        on_info(f"{e}; falling back to {baud_rate} baud")
+                    continue
+                if result.reconnects >= reconnects:
+                    raise
+                result.reconnects += 1
+                if on_info:
+                    on_info(f"{e}; reconnecting ({result.reconnects}/{reconnects}), "
+                            f"resuming at block {start_block}")
+            finally:
+                if ser and ser.is_open:
+                    ser.close()
+
+        if delta_cache is not None:
+            delta_cache.store(device_id, image, base_addr, previous)
+        result.ok = True
+    except Exception as e:
+        result.error = str(e)
+    finally:
+        result.elapsed = time.perf_counter() - start
+    return result
+
+
+def gang_flash(image, ports: list, baud_rate: int, base_addr: int, window: int = 1,
+               on_progress=None, on_info=None, on_event=None, **options) -> list:
+    """每个端口一个工作线程，共享同一个只读镜像
+    
+    on_progress(port, current, total) / on_info(port, text) / on_event(port, ProgressEvent)
+    在各工作线程中回调。
+    返回与 ports 顺序一致的 GangResult 列表。
+    不支持差分下载：产线上同一端口接的是一块块新板，按端口缓存的块哈希不代表当前板上的内容。
+    """
+    if options.get("delta_cache") is not None:
+        raise ValueError("Delta download needs a device ID per board and is not supported in gang mode")
+    results = [None] * len(ports)
+    # 所有端口发送相同的数据包，只编译一次
+    profile = options.get("profile")
+    compression = profile.compression if profile is not None else None
+    stream = PacketStream(image, base_addr, compression=compression)
+
+    def worker(index: int, port: str):
+        results[index] = flash_port(
+            image, port, baud_rate, base_addr, window,
+            on_progress=(lambda c, t: on_progress(port, c, t)) if on_progress else None,
+            on_info=(lambda text: on_info(port, text)) if on_info else None,
+            on_event=(lambda event: on_event(port, event)) if on_event else None,
+            stream=stream, **options)
+
+    threads = [threading.Thread(target=worker, args=(i, port), daemon=True)
+               for i, port in enumerate(ports)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
@@ -0,0 +1,197 @@
+"""串口热插拔监视
+
+后台线程维护当前串口列表，只在列表变化时发布 add / remove 事件：
+  * Linux：监听内核 uevent（netlink），收到 tty 子系统事件后才重新枚举；
+  * 其他平台或 netlink 不可用：按 interval 轮询一个廉价的签名
+    （Windows 读注册表 HARDWARE\\DEVICEMAP\\SERIALCOMM，POSIX 列 /dev），
+    签名变化时才调用 comports() 做完整枚举并与上次结果比较。
+
+监视线程有自己的锁，不与下载会话竞争；回调在监视线程中执行，
+GUI 应把事件转交给界面线程处理。
+"""
+import os
+import sys
+import select
+import socket
+import threading
+
+import serial.tools.list_ports
+
+PORT_ADDED = "add"
+PORT_REMOVED = "remove"
+
+# 回退扫描的签名检查间隔（秒）
+DEFAULT_INTERVAL = 1.0
+
+# 收到 uevent 后等待同一批事件到齐再枚举（秒）
+UEVENT_SETTLE = 0.2
+
+# linux/netlink.h
+_NETLINK_KOBJECT_UEVENT = 15
+_UEVENT_KERNEL_GROUP = 1
+
+# comports() 在 POSIX 上查找的设备名前缀
+_POSIX_PREFIXES = ("ttyS", "ttyUSB", "ttyXRUSB", "ttyACM", "ttyAMA", "rfcomm", "ttyAP", "ttyGS",
+                   "cu.", "tty.")
+
+
+def port_label(port) -> str:
+    """下拉框中显示的端口名"""
+    if port.description and port.description != "n/a":
+        return f"{port.description} ({port.device})"
+    return port.device
+
+
+def _port_key(port):
+    return (port.device, port.hwid)
+
+
+def _serial_signature():
+    """廉价的端口列表签名，无法获取时返回 None（每次都完整枚举）"""
+    if sys.platform == "win32":
+        import winreg
+        try:
+            with winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, r"HARDWARE\DEVICEMAP\SERIALCOMM") as key:
+                values = []
+                i = 0
+                while True:
+                    try:
+                        values.append(winreg.EnumValue(key, i)[:2])
+                    except OSError:
+                        break
+                    i += 1
+            return tuple(sorted(values))
+        except OSError:
+            return None
+    try:
+        return tuple(sorted(n for n in os.listdir("/dev") if n.startswith(_POSIX_PREFIXES)))
+    except OSError:
+        return None
+
+
+def _open_uevent_socket():
+    """打开内核 uevent 监听套接字，不可用时返回 None"""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, _NETLINK_KOBJECT_UEVENT)
+        sock.bind((0, _UEVENT_KERNEL_GROUP))
+        return sock
+    except (AttributeError, OSError):
+        return None
+
+
+def _is_tty_uevent(message: bytes) -> bool:
+    return b"\0SUBSYSTEM=tty\0" in message or message.endswith(b"\0SUBSYSTEM=tty")
+
+
+class PortMonitor:
+    """串口热插拔监视器
+
+    on_event(kind, port): kind 为 PORT_ADDED / PORT_REMOVED，port 为 pyserial 的 ListPortInfo。
+    启动后的首次枚举也以 add 事件发布。
+    """
+    def __init__(self, on_event, interval: float = DEFAULT_INTERVAL, use_uevent: bool = True):
+        self.on_event = on_event
+        self.interval = interval
+        self.use_uevent = use_uevent
+        self.backend = None  # "uevent" 或 "scan"
+        self.scans = 0       # 完整枚举次数
+
+        self._lock = threading.Lock()
+        self._ports = {}
+        self._signature = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._sock = None
+
+    def start(self):
+        self._stop.clear()
+        self._sock = _open_uevent_socket() if self.use_uevent else None
+        self.backend = "uevent" if self._sock else "scan"
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+            self._thread = None
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def ports(self) -> list:
+        """当前端口列表（按设备名排序）"""
+        with self._lock:
+            return sorted(self._ports.values(), key=lambda p: p.device)
+
+    def rescan(self):
+        """完整枚举并发布与上次结果的差异"""
+        try:
+            found = {_port_key(p): p for p in serial.tools.list_ports.comports()}
+        except Exception as e:
+            print(f"Error getting hardware info: {e}")
+            return
+        self.scans += 1
+
+        with self._lock:
+            removed = [p for k, p in self._ports.items() if k not in found]
+            added = [p for k, p in found.items() if k not in self._ports]
+            self._ports = found
+
+        for port in removed:
+            self.on_event(PORT_REMOVED, port)
+        for port in added:
+            self.on_event(PORT_ADDED, port)
+
+    # ---- 监视线程 ----
+
+    def _run(self):
+        self._signature = _serial_signature()
+        self.rescan()
+        if self._sock:
+            self._run_uevent()
+        else:
+            self._run_scan()
+
+    def _run_uevent(self):
+        sock = self._sock
+        while not self._stop.is_set():
+            # 超时只用于检查停止标志
+            if not select.select([sock], [], [], 0.5)[0]:
+                continue
+            if not self._drain_uevents(sock):
+                continue
+            # 一次插拔会产生一串事件，等其到齐后只枚举一次
+            while select.select([sock], [], [], UEVENT_SETTLE)[0]:
+                self._drain_uevents(sock)
+            self.rescan()
+
+    def _drain_uevents(self, sock) -> bool:
+        """读出所有待处理的 uevent，返回其中是否有 tty 事件"""
+        tty = False
+        while True:
+            try:
+                message = sock.recv(65536, socket.MSG_DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                return tty
+            except OSError:
+                # 接收缓冲区溢出（ENOBUFS）时可能丢了事件，按有变化处理
+                return True
+            if _is_tty_uevent(message):
+                tty = True
+
+    def _run_scan(self):
+        while not self._stop.wait(self.interval):
+            signature = _serial_signature()
+            if signature is None or signature != self._signature:
+                self._signature = signature
+                self.rescan()
@@ -0,0 +1,312 @@
+"""固件文件（HEX/BIN）解析"""
+import os
+import mmap
+import binascii
+
+from .crc import get_load_file_crc
+
+# 每个数据包默认携带的数据长度（可由目标配置修改，见 profiles.py）
+BLOCK_SIZE = 2048
+
+SUPPORTED_EXTENSIONS = (".BIN", ".HEX")
+
+# 多个文件合并成的镜像（见 merge.py），块地址为绝对地址
+MERGED_EXTENSION = ".MERGED"
+
+# 0x31 数据包中数据以外的字节：命令 + 地址 + 校验和
+PACKET_OVERHEAD = 1 + 4 + 1
+
+# 默认块大小下每个数据包在线路上的字节数
+PACKET_SIZE = PACKET_OVERHEAD + BLOCK_SIZE
+
+
+def packet_size(block_size: int) -> int:
+    return PACKET_OVERHEAD + block_size
+
+# 映射文件按此大小分段计算 CRC
+_MAP_CHUNK = 1024 * 1024
+
+
+def _release_pages(mapping, offset: int, length: int):
+    """读完后归还映射页，使常驻内存不随文件大小增长（不支持 madvise 的平台上不做处理）"""
+    if _MADV_DONTNEED is None:
+        return
+    start = offset - offset % mmap.PAGESIZE
+    mapping.madvise(_MADV_DONTNEED, start, offset + length - start)
+
+
+_MADV_DONTNEED = getattr(mmap, "MADV_DONTNEED", None)
+
+
+class Block:
+    """内存中的数据块"""
+    __slots__ = ("addr", "data")
+
+    def __init__(self, addr: int, data):
+        self.addr = addr
+        self.data = data
+
+
+class MappedBlock:
+    """映射文件中的数据块，访问 data 时才从映射中取出并用 0xFF 补齐到 size 字节
+    
+    addr 默认等于块在映射中的偏移（BIN 文件）。
+    """
+    __slots__ = ("addr", "_mapping", "_offset", "_length", "_size")
+
+    def __init__(self, mapping, offset: int, length: int, addr: int = None, size: int = BLOCK_SIZE):
+        self.addr = offset if addr is None else addr
+        self._mapping = mapping
+        self._offset = offset
+        self._length = length
+        self._size = size
+
+    @property
+    def data(self) -> bytes:
+        offset = self._offset
+        end = offset + self._length
+        data = self._mapping[offset:end]
+        if end % _MAP_CHUNK == 0 or end == len(self._mapping):
+            # 顺序读完一整段后归还该段（缺页时内核会顺带映射相邻页，逐块归还无效）
+            start = offset - offset % _MAP_CHUNK
+            _release_pages(self._mapping, start, end - start)
+        if self._length < self._size:
+            data += b'\xFF' * (self._size - self._length)
+        return data
+
+
+class FirmwareImage:
+    """解析后的固件镜像
+    
+    blocks 为按地址排序、按页对齐的块列表（Block / MappedBlock，均有 addr 与 data）：
+    HEX 文件中 addr 为页的绝对地址，BIN 文件中 addr 为相对起始地址的偏移。
+    BIN 文件以 mmap 方式打开，用完后应调用 close()（Windows 下映射期间文件不能被改写）。
+    block_size 为每块数据长度，与目标 bootloader 的数据包大小一致。
+    segments 记录文件数据在 CRC 计算序列中的位置 [[块地址, 序列偏移, 长度], ...]（地址含义与 blocks 相同），
+    用于写入单板数据后增量更新 CRC（见 patch.py）。
+    """
+    def __init__(self, path: str, extension: str, block_size: int = BLOCK_SIZE):
+        self.path = path
+        self.extension = extension
+        self.block_size = block_size
+        self.blocks = []
+        self.mapping = None
+        self.length = 0
+        self.crc = 0
+        self.min_address = 0xFFFFFFFF  # 记录HEX文件的最小地址
+        self.skipped_blocks = 0  # 因全为 0xFF 而不下载的块数
+        self.parts = []  # 合并镜像的组成文件（merge.MergePart）
+        self.segments = []
+
+    @property
+    def is_hex(self) -> bool:
+        return self.extension == ".HEX"
+
+    @property
+    def absolute(self) -> bool:
+        """块地址为绝对地址（HEX 文件与合并镜像），不需要起始地址"""
+        return self.extension != ".BIN"
+
+    def target_address(self, block, base_addr: int) -> int:
+        """计算块的目标地址"""
+        if self.absolute:
+            # 对于HEX文件与合并镜像，使用块中的绝对地址
+            return block.addr
+        # 对于BIN文件，使用基础地址 + 块偏移
+        return base_addr + block.addr
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def close(self):
+        """释放文件映射，之后不能再访问 MappedBlock 的数据"""
+        if self.mapping is not None:
+            self.mapping.close()
+            self.mapping = None
+
+    def detach(self):
+        """把映射中的块复制到内存并释放映射，之后镜像仍可使用，文件可以被改写"""
+        if self.mapping is None:
+            return
+        self.blocks = [block if isinstance(block, Block) else Block(block.addr, block.data)
+                       for block in self.blocks]
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def packet_size(self) -> int:
+        """每个数据包在线路上的字节数"""
+        return packet_size(self.block_size)
+
+    @property
+    def skipped_bytes(self) -> int:
+        """跳过空白块节省的线路字节数"""
+        return self.skipped_blocks * self.packet_size
+
+    def skipped_seconds(self, baud_rate: int) -> float:
+        """跳过空白块在给定波特率（8N1，每字节10位）下节省的传输时间，不含应答等待"""
+        return self.skipped_bytes * 10 / baud_rate
+
+
+class SparseImage:
+    """按 flash 页组织的稀疏存储镜像
+    
+    pages 以页起始绝对地址为键，未写入的字节保持 0xFF；只有含数据的页才会出现在 pages 中。
+    """
+    def __init__(self, page_size: int = BLOCK_SIZE):
+        self.page_size = page_size
+        self.pages = {}
+        self._blank = b'\xFF' * page_size
+
+    def write(self, addr: int, data):
+        """在绝对地址 addr 处写入 data，可跨页"""
+        size = self.page_size
+        pos, end = 0, len(data)
+        while pos < end:
+            offset = (addr + pos) % size
+            base = addr + pos - offset
+            page = self.pages.get(base)
+            if page is None:
+                page = self.pages[base] = bytearray(self._blank)
+            n = min(end - pos, size - offset)
+            page[offset:offset + n] = data[pos:pos + n]
+            pos += n
+
+    def blocks(self) -> list:
+        """按地址顺序输出 Block 列表"""
+        return [Block(addr, self.pages[addr]) for addr in sorted(self.pages)]
+
+
+def load_image(file_path: str, skip_blank: bool = False, block_size: int = BLOCK_SIZE) -> FirmwareImage:
+    """读取并解析 HEX/BIN 文件，按 block_size 分块
+    
+    skip_blank 为 True 时去掉内容全为 0xFF 的块，适用于下载前先整片擦除的 bootloader。
+    长度与 CRC 仍按完整文件计算。
+    """
+    ext = file_extension(file_path)
+    if ext not in SUPPORTED_EXTENSIONS:
+        raise ValueError("The download file format error")
+    if block_size <= 0:
+        raise ValueError(f"Invalid block size {block_size}")
+
+    image = FirmwareImage(file_path, ext, block_size)
+    if ext == ".HEX":
+        _load_hex(image)
+    else:
+        _load_bin(image)
+
+    if skip_blank:
+        drop_blank_blocks(image)
+    return image
+
+
+def file_extension(file_path: str) -> str:
+    return os.path.splitext(file_path)[1].upper()
+
+
+def drop_blank_blocks(image: FirmwareImage):
+    """去掉内容全为 0xFF 的块，并记录跳过的块数"""
+    blank = b'\xFF' * image.block_size
+    blocks = [block for block in image.blocks if block.data != blank]
+    image.skipped_blocks = len(image.blocks) - len(blocks)
+    image.blocks = blocks
+
+
+def hex_records(path: str):
+    """按文件顺序逐条产生 HEX 文件的数据记录 (绝对地址, 数据)，处理 00/02/04 记录
+
+    记录长度与长度字节不符、校验和错误或含非十六进制字符时抛出 ValueError（注明行号）。
+    """
+    unhexlify = binascii.unhexlify
+    with open(path, 'r') as f:
+        seg = 0
+        for number, line in enumerate(f, 1):
+            if line[:1] != ':':
+                continue
+            # 整条记录一次转换：长度、地址、类型、数据、校验和
+            try:
+                record = unhexlify(line[1:].rstrip())
+            except binascii.Error as e:
+                raise ValueError(f"{os.path.basename(path)} line {number}: {e}") from None
+            if len(record) < 5 or len(record) != record[0] + 5:
+                raise ValueError(f"{os.path.basename(path)} line {number}: record length mismatch")
+            if sum(record) & 0xFF:
+                raise ValueError(f"{os.path.basename(path)} line {number}: record checksum error")
+            rt = record[3]
+            if rt == 0x00:
+                yield seg + ((record[1] << 8) | record[2]), record[4:4 + record[0]]
+            elif rt == 0x04:
+                # 扩展线性地址
+                seg = ((record[4] << 8) | record[5]) << 16
+            elif rt == 0x02:
+                # 扩展段地址
+                seg = ((record[4] << 8) | record[5]) << 4
+            elif rt == 0x01:
+                break
+
+
+def _load_hex(image: FirmwareImage):
+    """按真实绝对地址把数据记录写入稀疏镜像"""
+    datalength = 0
+    memory = SparseImage(image.block_size)
+    records = []  # 按文件顺序保存的记录数据，最后整段计算CRC
+    segments = []
+    min_address = 0xFFFFFFFF
+    for addr, data_hex in hex_records(image.path):
+        # 更新最小地址
+        if addr < min_address:
+            min_address = addr
+        n = len(data_hex)
+        # 地址连续的记录在 CRC 序列中也连续，合并为一段
+        if segments and segments[-1][0] + segments[-1][2] == addr:
+            segments[-1][2] += n
+        else:
+            segments.append([addr, datalength, n])
+        datalength += n
+        records.append(data_hex)
+        memory.write(addr, data_hex)
+
+    image.blocks = memory.blocks()
+    image.segments = segments
+    image.length = datalength
+    image.crc = get_load_file_crc(b"".join(records))
+    image.min_address = min_address
+
+
+def map_file(path: str):
+    """只读映射整个文件，空文件返回 None"""
+    with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return None
+        # 映射建立后可以关闭文件句柄
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def map_bin_blocks(image: FirmwareImage):
+    """映射 BIN 文件并按块大小建立索引"""
+    image.mapping = map_file(image.path)
+    datalength = len(image.mapping) if image.mapping is not None else 0
+    size = image.block_size
+    for i in range(0, datalength, size):
+        image.blocks.append(MappedBlock(image.mapping, i, min(size, datalength - i), size=size))
+    return datalength
+
+
+def _load_bin(image: FirmwareImage):
+    """以只读方式映射 BIN 文件，块索引只记录偏移，数据按需读取"""
+    datalength = map_bin_blocks(image)
+
+    crc = 0
+    for offset in range(0, datalength, _MAP_CHUNK):
+        length = min(_MAP_CHUNK, datalength - offset)
+        crc = get_load_file_crc(image.mapping[offset:offset + length], crc)
+        _release_pages(image.mapping, offset, length)
+
+    image.length = datalength
+    image.crc = crc
+    image.segments = [[0, 0, datalength]] if datalength else []
@@ -0,0 +1,200 @@
+"""解析结果的磁盘缓存
+
+同一批发布镜像在产线上反复加载，缓存 HEX 解析后的稀疏镜像（按页存放的数据 + 块地址表）
+以及长度、CRC；再次加载时直接映射缓存数据文件，无需重新解析。BIN 文件不经过缓存：
+它本身按映射方式加载，唯一可省的整文件 CRC 计算比计算缓存键的内容哈希还快。
+
+缓存条目以文件内容哈希为键，每次加载都重新计算哈希（远快于解析），文件内容变化必定失效，
+内容相同的文件（复制、touch）仍然命中。verify=False 时按 (路径, 大小, mtime) 直接取上次的内容哈希，
+省去读文件，但大小和 mtime 都不变的改写检测不到。总大小超过 max_bytes 时按最近最少使用淘汰。
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+
+from .image import (BLOCK_SIZE, FirmwareImage, MappedBlock, SUPPORTED_EXTENSIONS,
+                    drop_blank_blocks, file_extension, load_image, map_file)
+
+CACHE_VERSION = 4
+
+# 默认缓存上限：256 MB
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+_INDEX = "index.json"
+
+
+def _tmp_path(path: str) -> str:
+    """按进程与线程命名的临时文件，同时加载的多个进程不会互相覆盖"""
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def default_cache_dir() -> str:
+    return os.path.join(os.path.expanduser("~"), ".iap_programmer", "images")
+
+
+def file_hash(path: str) -> str:
+    """文件内容哈希"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ImageCache:
+    """解析结果缓存目录
+
+    index.json 结构：
+      entries: "内容哈希-块大小" → {ext, length, crc, min_address, blocks(块地址表), segments, size, last_used}
+      paths:   绝对路径 → [文件大小, mtime_ns, 内容哈希]
+    条目的页数据按块地址表顺序存放在 <内容哈希-块大小>.img 中。
+    """
+    def __init__(self, cache_dir: str = None, max_bytes: int = DEFAULT_MAX_BYTES, verify: bool = True):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_bytes = max_bytes
+        self.verify = verify
+        self.hits = 0
+        self.misses = 0
+
+    def load_image(self, file_path: str, skip_blank: bool = False, block_size: int = BLOCK_SIZE) -> FirmwareImage:
+        """与 image.load_image 相同，HEX 文件优先使用缓存"""
+        ext = file_extension(file_path)
+        if ext not in SUPPORTED_EXTENSIONS:
+            raise ValueError("The download file format error")
+        if ext != ".HEX":
+            return load_image(file_path, skip_blank=skip_blank, block_size=block_size)
+
+        index = self._read_index()
+        path = os.path.abspath(file_path)
+        st = os.stat(path)
+        known = index["paths"].get(path)
+        if not self.verify and known and known[0] == st.st_size and known[1] == st.st_mtime_ns:
+            content = known[2]
+        else:
+            content = file_hash(path)
+            index["paths"][path] = [st.st_size, st.st_mtime_ns, content]
+        key = f"{content}-{block_size}"
+
+        image = None
+        entry = index["entries"].get(key)
+        if entry is not None and entry["ext"] == ext:
+            image = self._open_entry(file_path, key, entry, block_size)
+
+        if image is None:
+            self.misses += 1
+            image = load_image(file_path, block_size=block_size)
+            entry = self._store(key, image)
+            if entry is not None:
+                index["entries"][key] = entry
+            self._evict(index, keep=key)
+        else:
+            self.hits += 1
+
+        if key in index["entries"]:
+            index["entries"][key]["last_used"] = time.time()
+        self._write_index(index)
+
+        if skip_blank:
+            drop_blank_blocks(image)
+        return image
+
+    def clear(self):
+        index = self._read_index()
+        for key in list(index["entries"]):
+            self._remove(key)
+        self._write_index({"version": CACHE_VERSION, "entries": {}, "paths": {}})
+
+    # ---- 内部实现 ----
+
+    def _data_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.img")
+
+    def _read_index(self) -> dict:
+        try:
+            with open(os.path.join(self.cache_dir, _INDEX), 'r') as f:
+                index = json.load(f)
+            if index.get("version") == CACHE_VERSION:
+                return index
+        except (OSError, ValueError):
+            pass
+        return {"version": CACHE_VERSION, "entries": {}, "paths": {}}
+
+    def _write_index(self, index: dict):
+        # 缓存只是加速，写入失败（目录不可写等）不影响加载
+        path = os.path.join(self.cache_dir, _INDEX)
+        tmp = _tmp_path(path)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp, 'w') as f:
+                json.dump(index, f)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"Image cache write failed: {e}")
+
+    def _open_entry(self, file_path: str, key: str, entry: dict, block_size: int):
+        """由缓存条目构建镜像，缓存数据缺失时返回 None"""
+        image = FirmwareImage(file_path, entry["ext"], block_size)
+        image.length = entry["length"]
+        image.crc = entry["crc"]
+        image.min_address = entry["min_address"]
+        image.segments = entry["segments"]
+
+        try:
+            mapping = map_file(self._data_path(key)) if entry["blocks"] else None
+        except OSError:
+            return None
+        if entry["blocks"] and (mapping is None or len(mapping) != len(entry["blocks"]) * block_size):
+            return None
+        image.mapping = mapping
+        image.blocks = [MappedBlock(mapping, i * block_size, block_size, addr, block_size)
+                        for i, addr in enumerate(entry["blocks"])]
+        return image
+
+    def _store(self, key: str, image: FirmwareImage) -> dict:
+        """写入缓存数据文件，返回索引条目"""
+        entry = {
+            "ext": image.extension,
+            "length": image.length,
+            "crc": image.crc,
+            "min_address": image.min_address,
+            "blocks": [block.addr for block in image.blocks],
+            "segments": image.segments,
+            "size": len(image.blocks) * image.block_size,
+        }
+        path = self._data_path(key)
+        tmp = _tmp_path(path)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp, 'wb') as f:
+                for block in image.blocks:
+                    f.write(block.data)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"Image cache write failed: {e}")
+            return None
+        return entry
+
+    def _remove(self, key: str):
+        try:
+            os.remove(self._data_path(key))
+        except OSError:
+            pass
+
+    def _evict(self, index: dict, keep: str):
+        """按最近最少使用淘汰，直到总大小不超过 max_bytes"""
+        entries = index["entries"]
+        total = sum(e["size"] for e in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k].get("last_used", 0)):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= entries[key]["size"]
+            del entries[key]
+            self._remove(key)
+
+        # 去掉指向已淘汰条目的路径记录
+        contents = {key.rsplit("-", 1)[0] for key in entries}
+        index["paths"] = {p: v for p, v in index["paths"].items() if v[2] in contents}
@@ -0,0 +1,152 @@
+"""多文件合并：把应用 HEX、校准 BIN、配置页等合并成一个稀疏镜像，在一次下载会话中发送
+
+每个 BIN 文件需要各自的起始地址（命令行写作 cal.bin@0800F000），HEX 文件使用其中的绝对地址。
+各文件的数据按字节范围检查重叠（同一页内互不重叠的数据会合并到同一块中），重叠时抛出 ValueError。
+合并镜像的长度为各文件数据长度之和，CRC 为按给定顺序依次计算各文件数据的 CRC
+（等于把各文件单独加载时的数据首尾相接后计算的 CRC）。
+"""
+import os
+
+from .crc import crc_combine, get_load_file_crc
+from .image import (_MAP_CHUNK, BLOCK_SIZE, MERGED_EXTENSION, FirmwareImage, SparseImage,
+                    drop_blank_blocks, file_extension, hex_records, map_file)
+
+
+class MergePart:
+    """合并镜像中的一个文件"""
+    def __init__(self, path: str, base_addr: int = None):
+        self.path = path
+        self.base_addr = base_addr
+        self.ranges = []  # 数据占用的地址范围 [(start, end), ...]，已排序合并
+        self.segments = []  # 数据在本文件 CRC 序列中的位置，见 FirmwareImage.segments
+        self.length = 0
+        self.crc = 0
+
+    @property
+    def name(self) -> str:
+        name = os.path.basename(self.path)
+        if self.base_addr is not None:
+            name += f"@{self.base_addr:08X}"
+        return name
+
+    @property
+    def start(self) -> int:
+        return self.ranges[0][0] if self.ranges else 0
+
+    @property
+    def end(self) -> int:
+        return self.ranges[-1][1] if self.ranges else 0
+
+
+def parse_part(spec: str) -> MergePart:
+    """解析 "file.hex" 或 "file.bin@08010000"（地址为十六进制）"""
+    path, sep, address = spec.rpartition("@")
+    if not sep:
+        return MergePart(spec)
+    try:
+        return MergePart(path, int(address, 16))
+    except ValueError:
+        raise ValueError(f"Invalid base address in {spec!r}") from None
+
+
+def _coalesce(ranges: list) -> list:
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [tuple(r) for r in merged]
+
+
+def _load_part(part: MergePart, memory: SparseImage):
+    """把一个文件的数据写入稀疏镜像，记录其地址范围、长度与 CRC"""
+    part.ranges, part.segments, part.length, part.crc = [], [], 0, 0
+    ext = file_extension(part.path)
+    if ext == ".HEX":
+        if part.base_addr is not None:
+            raise ValueError(f"{part.name}: HEX files carry absolute addresses, remove the @address")
+        ranges = []
+        crc = 0
+        for addr, data in hex_records(part.path):
+            end = addr + len(data)
+            # 连续的记录直接延长上一个范围
+            if ranges and ranges[-1][1] == addr:
+                ranges[-1][1] = end
+            else:
+                ranges.append([addr, end])
+            memory.write(addr, data)
+            crc = get_load_file_crc(data, crc)
+            part.length += len(data)
+        part.crc = crc
+        # 按文件顺序的范围即为 CRC 序列中的各段
+        offset = 0
+        for start, end in ranges:
+            part.segments.append([start, offset, end - start])
+            offset += end - start
+        part.ranges = _coalesce(ranges)
+    elif ext == ".BIN":
+        if part.base_addr is None:
+            raise ValueError(f"{part.name}: BIN files need a base address, e.g. {part.name}@08010000")
+        mapping = map_file(part.path)
+        if mapping is None:
+            return
+        try:
+            length = len(mapping)
+            crc = 0
+            for offset in range(0, length, _MAP_CHUNK):
+                chunk = mapping[offset:offset + _MAP_CHUNK]
+                memory.write(part.base_addr + offset, chunk)
+                crc = get_load_file_crc(chunk, crc)
+        finally:
+            mapping.close()
+        part.crc = crc
+        part.length = length
+        part.ranges = [(part.base_addr, part.base_addr + length)]
+        part.segments = [[part.base_addr, 0, length]]
+    else:
+        raise ValueError(f"{part.name}: The download file format error")
+
+
+def _check_overlaps(parts: list):
+    """不同文件的数据范围不能重叠"""
+    spans = sorted(((start, end, part) for part in parts for start, end in part.ranges),
+                   key=lambda span: span[:2])
+    owner = None
+    reach = 0
+    for start, end, part in spans:
+        if owner is not None and start < reach and part is not owner:
+            raise ValueError(f"{part.name} overlaps {owner.name} at 0x{start:08X}-0x{min(end, reach):08X}")
+        if end > reach:
+            reach, owner = end, part
+
+
+def merge_images(parts: list, block_size: int = BLOCK_SIZE, skip_blank: bool = False) -> FirmwareImage:
+    """合并多个文件（MergePart 或 "file@addr" 字符串）为一个按 block_size 分块的镜像"""
+    parts = [parse_part(p) if isinstance(p, str) else p for p in parts]
+    if not parts:
+        raise ValueError("No files to merge")
+    if block_size <= 0:
+        raise ValueError(f"Invalid block size {block_size}")
+
+    memory = SparseImage(block_size)
+    for part in parts:
+        _load_part(part, memory)
+    _check_overlaps(parts)
+
+    image = FirmwareImage(" + ".join(part.name for part in parts), MERGED_EXTENSION, block_size)
+    image.blocks = memory.blocks()
+    image.parts = parts
+    crc = 0
+    length = 0
+    for part in parts:
+        crc = crc_combine(crc, part.crc, part.length)
+        image.segments.extend([addr, length + offset, n] for addr, offset, n in part.segments)
+        length += part.length
+    image.crc = crc
+    image.length = length
+    image.min_address = min((part.start for part in parts if part.ranges), default=0xFFFFFFFF)
+    if skip_blank:
+        drop_blank_blocks(image)
+    return image
@@ -0,0 +1,145 @@
+"""单板数据写入：序列号、MAC 地址、校准值等按地址写入已解析的镜像
+
+每块板只改几个字节，不必为每块板生成新文件并重新解析：apply_patches 直接改写内存中的镜像
+（缓存映射的只读块先复制为可写块），按 CRC 的线性性质增量更新 image.crc
+（旧 CRC 异或“差值字节在序列中对应位置”的 CRC，移位用 crc_shift，与数据长度无关），
+给定 PacketStream 时只改写受影响的数据包并修正其校验和。
+
+写入范围必须落在文件数据内（image.segments），这样 CRC 才能与“把这些字节写进文件后重新加载”一致；
+要写入文件之外的页（如单独的序列号页），先用一个模板 BIN 文件合并进镜像（见 merge.py）。
+"""
+import struct
+
+from .crc import crc_shift, get_load_file_crc
+from .image import Block
+
+# parse_patch 支持的整数格式（小端序）
+_INT_FORMATS = {"u8": "<B", "u16": "<H", "u32": "<I", "u64": "<Q"}
+
+
+class Patch:
+    """在绝对地址 addr 处写入 data"""
+    __slots__ = ("addr", "data")
+
+    def __init__(self, addr: int, data: bytes):
+        self.addr = addr
+        self.data = bytes(data)
+
+    def __repr__(self):
+        return f"Patch(0x{self.addr:08X}, {self.data.hex(' ').upper()})"
+
+
+def parse_patch(spec: str) -> Patch:
+    """解析 ADDR=VALUE，ADDR 为十六进制地址，VALUE 为：
+
+      0011223344AA     十六进制字节
+      u32:1234         小端序整数（u8/u16/u32/u64，数值可带 0x 前缀）
+      str:SN-000123    ASCII 字符串
+    """
+    address, sep, value = spec.partition("=")
+    if not sep or not value:
+        raise ValueError(f"Invalid patch {spec!r}, expected ADDRESS=VALUE")
+    try:
+        addr = int(address, 16)
+    except ValueError:
+        raise ValueError(f"Invalid patch address in {spec!r}") from None
+
+    kind, sep, text = value.partition(":")
+    try:
+        if sep and kind in _INT_FORMATS:
+            data = struct.pack(_INT_FORMATS[kind], int(text, 0))
+        elif sep and kind == "str":
+            data = text.encode("ascii")
+        else:
+            data = bytes.fromhex(value)
+    except (ValueError, struct.error) as e:
+        raise ValueError(f"Invalid patch value in {spec!r}: {e}") from None
+    if not data:
+        raise ValueError(f"Empty patch {spec!r}")
+    return Patch(addr, data)
+
+
+def _find_block(blocks: list, addr: int):
+    """按地址二分查找块的索引，不存在时返回插入位置的相反数减一"""
+    lo, hi = 0, len(blocks)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if blocks[mid].addr < addr:
+            lo = mid + 1
+        else:
+            hi = mid
+    if lo < len(blocks) and blocks[lo].addr == addr:
+        return lo
+    return -lo - 1
+
+
+def _patch_crc(image, addr: int, old: bytes, patch: Patch) -> int:
+    """镜像内地址 addr 处 old 改为 patch.data 之后的 CRC，未被文件数据完全覆盖时抛出 ValueError"""
+    new = patch.data
+    n = len(new)
+    covered = bytearray(n)
+    crc = image.crc
+    for seg_addr, seg_offset, seg_len in image.segments:
+        lo = max(addr, seg_addr)
+        hi = min(addr + n, seg_addr + seg_len)
+        if lo >= hi:
+            continue
+        covered[lo - addr:hi - addr] = b'\x01' * (hi - lo)
+        delta = bytes(a ^ b for a, b in zip(old[lo - addr:hi - addr], new[lo - addr:hi - addr]))
+        # 差值在 CRC 序列中的位置：之后还有 tail 字节
+        tail = image.length - (seg_offset + lo - seg_addr) - (hi - lo)
+        crc ^= crc_shift(get_load_file_crc(delta), tail)
+    if 0 in covered:
+        raise ValueError(f"Patch at 0x{patch.addr:08X} ({n} bytes) is outside the file data; "
+                         f"merge a template file for that region first")
+    return crc
+
+
+def apply_patches(image, patches: list, base_addr: int = 0, stream=None):
+    """把 patches 写入镜像并增量更新 image.crc
+
+    base_addr 为 BIN 文件的起始地址（HEX 与合并镜像的地址本身是绝对地址）；
+    stream 为已按 base_addr 编译的 PacketStream 时同时更新其中的数据包。
+    任一写入无效时抛出 ValueError，此前的写入保持有效。
+    """
+    size = image.block_size
+    offset = 0 if image.absolute else base_addr
+    for patch in patches:
+        addr = patch.addr - offset
+        end = addr + len(patch.data)
+
+        # 先检查全部范围并读出旧内容计算新 CRC，全部有效后再改写 CRC 与数据
+        pieces = []
+        pos = addr
+        while pos < end:
+            page = pos - pos % size
+            n = min(end - pos, page + size - pos)
+            pieces.append((page, pos - page, pos - addr, n))
+            pos += n
+        old = bytearray(b'\xFF' * len(patch.data))
+        for page, in_page, at, n in pieces:
+            i = _find_block(image.blocks, page)
+            if i >= 0:
+                old[at:at + n] = image.blocks[i].data[in_page:in_page + n]
+            elif stream is not None:
+                raise ValueError(f"Patch at 0x{patch.addr:08X} falls in a skipped blank block; "
+                                 f"rebuild the packet stream after patching")
+        image.crc = _patch_crc(image, addr, bytes(old), patch)
+
+        for page, in_page, at, n in pieces:
+            i = _find_block(image.blocks, page)
+            if i < 0:
+                # 空白块已被 skip_blank 去掉，恢复为可写块
+                i = -i - 1
+                image.blocks.insert(i, Block(page, bytearray(b'\xFF' * size)))
+                image.skipped_blocks -= 1
+            block = image.blocks[i]
+            if not isinstance(block.data, bytearray):
+                # 映射文件中的只读块复制为可写块
+                block = image.blocks[i] = Block(block.addr, bytearray(block.data))
+            data = patch.data[at:at + n]
+            block.data[in_page:in_page + n] = data
+            if stream is not None:
+                index = stream.index(image.target_address(block, base_addr))
+                if index is not None:
+                    stream.patch_block(index, block, in_page, data)
@@ -0,0 +1,141 @@
+"""目标配置：不同 bootloader / MCU 的块大小、命令字节与默认起始地址
+
+内置配置见 BUILTIN_PROFILES；用户配置（包括 tune 命令的结果）保存在 ~/.iap_programmer/profiles.json，
+同名时覆盖内置配置。块大小应等于 bootloader 每个 0x31 数据包接收的数据长度，通常为 flash 页大小：
+页越大每块应答等待的占比越小，但 bootloader 必须按相同长度接收。
+compression 为 "lz4" 时数据块以 0x32 压缩数据包发送（见 protocol.build_compressed_packet），
+需要 bootloader 支持；未设置时协议与原来完全相同。
+"""
+import os
+import json
+
+from .compress import COMPRESSIONS
+from .image import BLOCK_SIZE, packet_size
+
+DEFAULT_PROFILE = "default"
+
+
+def default_profiles_path() -> str:
+    return os.path.join(os.path.expanduser("~"), ".iap_programmer", "profiles.json")
+
+
+class TargetProfile:
+    """一种目标的协议参数"""
+    def __init__(self, name: str, block_size: int = BLOCK_SIZE,
+                 handshake: bytes = b'\x5A\xA5', mode_entry: bytes = b'\x5A\x01',
+                 finish: bytes = b'\x5A\x02', ack: bytes = b'\xCC\xDD',
+                 default_address: int = 0x08010000, description: str = "", tuned: dict = None,
+                 compression: str = None):
+        if compression is not None and compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression {compression!r}")
+        self.name = name
+        self.block_size = block_size
+        self.handshake = handshake
+        self.mode_entry = mode_entry
+        self.finish = finish
+        self.ack = ack
+        self.default_address = default_address
+        self.description = description
+        self.tuned = tuned  # tune 命令记录的测量结果
+        self.compression = compression
+
+    @property
+    def packet_size(self) -> int:
+        return packet_size(self.block_size)
+
+    def copy(self, name: str = None, **changes) -> "TargetProfile":
+        fields = self.to_dict()
+        fields.update(changes)
+        return TargetProfile.from_dict(name or self.name, fields)
+
+    def to_dict(self) -> dict:
+        data = {
+            "block_size": self.block_size,
+            "handshake": self.handshake.hex(" ").upper(),
+            "mode_entry": self.mode_entry.hex(" ").upper(),
+            "finish": self.finish.hex(" ").upper(),
+            "ack": self.ack.hex(" ").upper(),
+            "default_address": f"{self.default_address:08X}",
+            "description": self.description,
+        }
+        if self.compression:
+            data["compression"] = self.compression
+        if self.tuned:
+            data["tuned"] = self.tuned
+        return data
+
+    @classmethod
+    def from_dict(cls, name: str, data: dict) -> "TargetProfile":
+        def raw(key, default):
+            value = data.get(key)
+            if value is None:
+                return default
+            return value if isinstance(value, bytes) else bytes.fromhex(value)
+
+        base = cls(name)
+        address = data.get("default_address", base.default_address)
+        if isinstance(address, str):
+            address = int(address, 16)
+        return cls(
+            name,
+            block_size=int(data.get("block_size", base.block_size)),
+            handshake=raw("handshake", base.handshake),
+            mode_entry=raw("mode_entry", base.mode_entry),
+            finish=raw("finish", base.finish),
+            ack=raw("ack", base.ack),
+            default_address=address,
+            description=data.get("description", ""),
+            tuned=data.get("tuned"),
+            compression=data.get("compression") or None,
+        )
+
+
+BUILTIN_PROFILES = {
+    p.name: p for p in (
+        TargetProfile(DEFAULT_PROFILE, description="2 KB pages (original protocol)"),
+        TargetProfile("page-256", block_size=256, description="256 B flash pages"),
+        TargetProfile("page-1k", block_size=1024, description="1 KB flash pages"),
+        TargetProfile("page-16k", block_size=16 * 1024, description="16 KB flash sectors"),
+        TargetProfile("default-lz4", compression="lz4",
+                      description="2 KB pages, LZ4-compressed blocks (bootloader must support 0x32)"),
+    )
+}
+
+
+def _read_user_profiles(path: str) -> dict:
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def list_profiles(path: str = None) -> dict:
+    """全部配置：名称 → TargetProfile，用户配置覆盖同名内置配置"""
+    profiles = dict(BUILTIN_PROFILES)
+    for name, data in _read_user_profiles(path or default_profiles_path()).items():
+        try:
+            profiles[name] = TargetProfile.from_dict(name, data)
+        except (TypeError, ValueError) as e:
+            print(f"Ignoring invalid profile {name}: {e}")
+    return profiles
+
+
+def get_profile(name: str = None, path: str = None) -> TargetProfile:
+    """按名称取配置，name 为空时返回默认配置"""
+    profiles = list_profiles(path)
+    name = name or DEFAULT_PROFILE
+    if name not in profiles:
+        raise ValueError(f"Unknown target profile {name!r} (available: {', '.join(sorted(profiles))})")
+    return profiles[name]
+
+
+def save_profile(profile: TargetProfile, path: str = None):
+    """写入用户配置文件"""
+    path = path or default_profiles_path()
+    profiles = _read_user_profiles(path)
+    profiles[profile.name] = profile.to_dict()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", 'w') as f:
+        json.dump(profiles, f, indent=1)
+    os.replace(path + ".tmp", path)
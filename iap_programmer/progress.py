@@ -0,0 +1,102 @@
+"""下载进度事件
+
+Downloader 在每个状态开始、每块应答和每次重发时产生 ProgressEvent（on_event 回调，在下载线程中执行）。
+事件频率与块数相同，显示端应合并后按固定刷新率处理：
+  * ProgressThrottle：在回调线程中限频转发，适合命令行等无界面的使用者；
+  * ProgressQueue：跨线程传递，下载线程 put，界面线程定时 latest() 取最新一条。
+"""
+import time
+import queue
+
+# 默认刷新间隔（秒）
+DEFAULT_REFRESH = 0.1
+
+
+class ProgressEvent:
+    """某一时刻的会话进度
+
+    phase 为会话状态名（protocol.STATE_*），percent 为 0~100 的总体进度；
+    blocks_* / bytes_* 只统计本次会话数据阶段需要发送的块（续传时不含已确认的块），
+    bytes 按线路字节（含包头和校验和）计算；elapsed 为数据阶段已用时间（秒）。
+    """
+    __slots__ = ("phase", "percent", "blocks_done", "blocks_total", "bytes_done", "bytes_total",
+                 "elapsed", "retries")
+
+    def __init__(self, phase: str, percent: int, blocks_done: int = 0, blocks_total: int = 0,
+                 bytes_done: int = 0, bytes_total: int = 0, elapsed: float = 0.0, retries: int = 0):
+        self.phase = phase
+        self.percent = percent
+        self.blocks_done = blocks_done
+        self.blocks_total = blocks_total
+        self.bytes_done = bytes_done
+        self.bytes_total = bytes_total
+        self.elapsed = elapsed
+        self.retries = retries
+
+    @property
+    def bytes_per_sec(self) -> float:
+        return self.bytes_done / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def blocks_per_sec(self) -> float:
+        return self.blocks_done / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        """数据阶段剩余时间（秒），尚无速率时为 None"""
+        rate = self.blocks_per_sec
+        if rate <= 0:
+            return None
+        return (self.blocks_total - self.blocks_done) / rate
+
+    def __str__(self):
+        text = f"{self.percent:3d}%"
+        if self.blocks_total:
+            eta = self.eta
+            text += (f"  {self.blocks_done}/{self.blocks_total} blocks  "
+                     f"{self.bytes_per_sec / 1024:7.1f} KB/s  {self.blocks_per_sec:6.1f} blk/s  "
+                     f"ETA {'--' if eta is None else f'{eta:5.1f}s'}")
+        if self.retries:
+            text += f"  retries {self.retries}"
+        return text
+
+
+class ProgressThrottle:
+    """限频转发：每 interval 秒最多转发一次，阶段变化与 100% 时立即转发
+
+    被丢弃的事件不会补发，最后一次转发的总是最新状态。
+    """
+    def __init__(self, callback, interval: float = DEFAULT_REFRESH):
+        self.callback = callback
+        self.interval = interval
+        self._last = 0.0
+        self._phase = None
+
+    def __call__(self, event: ProgressEvent):
+        now = time.perf_counter()
+        if (event.phase == self._phase and event.percent < 100
+                and now - self._last < self.interval):
+            return
+        self._last = now
+        self._phase = event.phase
+        self.callback(event)
+
+
+class ProgressQueue:
+    """线程安全的进度事件队列，put 可直接用作 Downloader 的 on_event"""
+    def __init__(self):
+        self._queue = queue.Queue()
+
+    def put(self, event: ProgressEvent):
+        self._queue.put(event)
+
+    __call__ = put
+
+    def latest(self):
+        """取出全部待处理事件，返回最新一条，没有新事件时返回 None"""
+        event = None
+        while True:
+            try:
+                event = self._queue.get_nowait()
+            except queue.Empty:
+                return event
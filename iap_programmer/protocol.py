@@ -0,0 +1,564 @@
+"""IAP 串口下载协议"""
+import time
+import bisect
+import socket
+import struct
+
+import serial
+import serial.rfc2217
+
+from .compress import COMPRESSION_LZ4, compress_block
+from .profiles import BUILTIN_PROFILES, DEFAULT_PROFILE
+from .progress import ProgressEvent
+
+# 默认目标的协议字节（其他目标见 profiles.TargetProfile）
+HANDSHAKE = b'\x5A\xA5'
+MODE_ENTRY = b'\x5A\x01'
+FINISH = b'\x5A\x02'
+ACK = b'\xCC\xDD'
+CMD_WRITE_BLOCK = 0x31
+CMD_WRITE_BLOCK_LZ4 = 0x32  # 压缩数据包，仅在目标配置启用压缩时使用
+
+# 流水线模式下每块默认的最大重发次数（逐块应答模式默认不重发）
+PIPELINE_MAX_ROLLBACKS = 3
+
+# 流水线模式下每发送这么多块等待窗口排空一次，确认应答与块的对应关系（见 Downloader._send_packets）
+PIPELINE_SYNC_BLOCKS = 64
+
+# 重发前的初始退避时间（秒），每次重发翻倍
+DEFAULT_RETRY_BACKOFF = 0.02
+
+# 会话状态
+STATE_HANDSHAKE = "handshake"
+STATE_MODE_ENTRY = "mode_entry"
+STATE_BLOCKS = "blocks"
+STATE_FINISH = "finish"
+STATE_DONE = "done"
+
+# 各状态默认超时（秒）
+DEFAULT_TIMEOUTS = {
+    STATE_HANDSHAKE: 3.0,   # 握手总超时，期间周期性重发
+    STATE_MODE_ENTRY: 3.0,  # 进入下载模式可能包含擦除
+    STATE_BLOCKS: 1.5,      # 每块等待应答
+    STATE_FINISH: 1.5,
+}
+
+# 握手重发间隔（秒）
+HANDSHAKE_POLL = 0.05
+
+
+class IAPError(Exception):
+    """下载过程中的协议错误"""
+
+
+def open_serial(port: str, baud_rate: int, timeout: float = 1.5):
+    """以 8N1 打开串口，port 也可以是 pyserial URL（如 socket://host:port、rfc2217://host:port）
+
+    网络串口按低延迟设置：关闭 Nagle 算法（pyserial 的 socket:// 不设置 TCP_NODELAY，
+    一个数据包超过一个 TCP 段时尾部会等到对端 ACK 才发出，每块多等一个延迟确认周期）。
+    """
+    ser = serial.serial_for_url(
+        port,
+        baudrate=baud_rate,
+        bytesize=8,
+        parity=serial.PARITY_NONE,
+        stopbits=serial.STOPBITS_ONE,
+        timeout=timeout
+    )
+    sock = getattr(ser, "_socket", None)
+    if isinstance(sock, socket.socket):
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
+            pass
+    return ser
+
+
+def set_read_timeout(ser, timeout: float):
+    """修改读超时，值不变时不做任何事
+
+    RFC2217 端口每次修改 timeout 都会与服务器重新协商全部串口参数（至少 50ms），
+    而读超时只在本地使用，因此直接修改本地值。
+    """
+    if isinstance(ser, serial.rfc2217.Serial):
+        ser._timeout = timeout
+    elif ser.timeout != timeout:
+        ser.timeout = timeout
+
+
+def build_block_packet(target_addr: int, data) -> bytes:
+    """构建 0x31 数据包：起始标志 + 大端序地址 + 一块数据 + 校验和"""
+    packet = bytearray([CMD_WRITE_BLOCK])  # 数据包起始标志
+    packet.extend(struct.pack(">I", target_addr))  # 大端序地址
+    packet.extend(data)  # 一块数据（默认2048字节）
+
+    # 计算校验和（包括地址字节和数据）
+    checksum = sum(packet[1:5 + len(data)]) & 0xFF
+    packet.append(checksum)
+    return bytes(packet)
+
+
+def build_compressed_packet(target_addr: int, payload) -> bytes:
+    """构建 0x32 压缩数据包：起始标志 + 大端序地址 + 大端序压缩长度 + LZ4 块 + 校验和
+
+    设备解压后应正好得到一块数据（块大小由目标配置决定），校验和为地址、长度与压缩数据之和。
+    """
+    packet = bytearray([CMD_WRITE_BLOCK_LZ4])
+    packet.extend(struct.pack(">IH", target_addr, len(payload)))
+    packet.extend(payload)
+    packet.append(sum(packet[1:]) & 0xFF)
+    return bytes(packet)
+
+
+# 超过该大小的数据不整体预编译，发送时按窗口现场组装，内存占用与镜像大小无关
+STREAM_PRECOMPILE_LIMIT = 8 * 1024 * 1024
+
+
+class PacketStream:
+    """预编译的线路格式数据
+    
+    按给定起始地址把全部块一次性编译成首尾相接的 0x31 数据包（含校验和），存放在一个连续缓冲区中。
+    发送时只取 memoryview 切片，不再为每块分配内存；缓冲区只读，可在多个下载线程间共享。
+    总大小超过 STREAM_PRECOMPILE_LIMIT 时（大 BIN 镜像）不预编译，packets() 按需组装请求的数据包。
+
+    compression 为 "lz4" 时每块压缩后以 0x32 数据包发送，压缩后不比原数据短的块仍用 0x31 数据包；
+    数据包长度不再固定，因此总是预编译（缓冲区不超过未压缩时的大小）。
+    """
+    def __init__(self, image, base_addr: int, blocks: list = None, compression: str = None):
+        if blocks is None:
+            blocks = image.blocks
+        self.addresses = [image.target_address(block, base_addr) for block in blocks]
+        self.block_size = image.block_size
+        self.packet_size = image.packet_size
+        self.compression = compression
+        self.compressed_blocks = 0
+        self.buffer = None
+        self.view = None
+        self._blocks = None
+        self._offsets = None  # 变长数据包的起始偏移（len + 1 项），定长时为 None
+
+        if compression is not None:
+            if compression != COMPRESSION_LZ4:
+                raise ValueError(f"Unknown compression {compression!r}")
+            self._compile_compressed(blocks)
+            return
+
+        size = self.packet_size
+        if len(blocks) * size > STREAM_PRECOMPILE_LIMIT:
+            self._blocks = blocks
+            return
+
+        buf = bytearray(len(blocks) * size)
+        for i, block in enumerate(blocks):
+            _encode_packet(buf, i * size, self.addresses[i], block.data)
+        self.buffer = buf
+        self.view = memoryview(buf).toreadonly()
+
+    def _compile_compressed(self, blocks: list):
+        buf = bytearray()
+        offsets = [0]
+        for addr, block in zip(self.addresses, blocks):
+            data = block.data
+            payload = compress_block(data)
+            if len(payload) + 2 < len(data):
+                buf += build_compressed_packet(addr, payload)
+                self.compressed_blocks += 1
+            else:
+                buf += build_block_packet(addr, data)
+            offsets.append(len(buf))
+        self._offsets = offsets
+        self.buffer = buf
+        self.view = memoryview(buf).toreadonly()
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def wire_bytes(self, start: int = 0, end: int = None) -> int:
+        """第 start 到 end-1 个数据包在线路上的总字节数"""
+        if end is None:
+            end = len(self)
+        if self._offsets is not None:
+            return self._offsets[end] - self._offsets[start]
+        return (end - start) * self.packet_size
+
+    def index(self, target_addr: int):
+        """目标地址为 target_addr 的块的索引，不存在时返回 None"""
+        i = bisect.bisect_left(self.addresses, target_addr)
+        if i < len(self.addresses) and self.addresses[i] == target_addr:
+            return i
+        return None
+
+    def patch_block(self, index: int, block, offset: int, data):
+        """块中 offset 处的数据已改为 data（block 为修改后的块），更新第 index 个数据包
+
+        定长数据包就地改写这几个字节并按差值修正该包的校验和；压缩数据包重新压缩这一块，
+        长度变化时移动其后的数据包；未预编译时只替换块，发送时再组装。
+        """
+        if self.view is None:
+            self._blocks[index] = block
+            return
+        if self._offsets is None:
+            start = index * self.packet_size + 5 + offset
+            end = (index + 1) * self.packet_size - 1
+            buf = self.buffer
+            old = sum(buf[start:start + len(data)])
+            buf[start:start + len(data)] = data
+            buf[end] = (buf[end] - old + sum(data)) & 0xFF
+            return
+
+        payload = compress_block(block.data)
+        addr = self.addresses[index]
+        if len(payload) + 2 < len(block.data):
+            packet = build_compressed_packet(addr, payload)
+        else:
+            packet = build_block_packet(addr, block.data)
+        start, end = self._offsets[index], self._offsets[index + 1]
+        was_compressed = self.buffer[start] == CMD_WRITE_BLOCK_LZ4
+        self.compressed_blocks += (packet[0] == CMD_WRITE_BLOCK_LZ4) - was_compressed
+        if len(packet) == end - start:
+            self.buffer[start:end] = packet
+            return
+        # 长度变化：先释放只读视图才能改变缓冲区大小
+        self.view.release()
+        self.buffer[start:end] = packet
+        shift = len(packet) - (end - start)
+        for i in range(index + 1, len(self._offsets)):
+            self._offsets[i] += shift
+        self.view = memoryview(self.buffer).toreadonly()
+
+    def packets(self, start: int, end: int):
+        """第 start 到 end-1 个数据包（连续切片）"""
+        if self._offsets is not None:
+            return self.view[self._offsets[start]:self._offsets[end]]
+        size = self.packet_size
+        if self.view is not None:
+            return self.view[start * size:end * size]
+
+        buf = bytearray((end - start) * size)
+        for i in range(start, end):
+            _encode_packet(buf, (i - start) * size, self.addresses[i], self._blocks[i].data)
+        return buf
+
+
+def _encode_packet(buf: bytearray, off: int, target_addr: int, data):
+    """在 buf[off:] 处就地写入一个 0x31 数据包"""
+    end = off + 5 + len(data)
+    buf[off] = CMD_WRITE_BLOCK
+    struct.pack_into(">I", buf, off + 1, target_addr)
+    buf[off + 5:end] = data
+    # 校验和：地址字节 + 数据
+    buf[end] = sum(buf[off + 1:end]) & 0xFF
+
+
+def drain_input(ser, quiet: float = 0.05):
+    """读空输入缓冲区，直到线路静默 quiet 秒
+
+    只用于丢弃重复命令的应答（设备立即应答）；数据块的应答要等设备写完 flash，
+    静默一段时间不代表已全部到达，流水线重发前按数量读取在途应答（见 Downloader._discard_replies）。
+    """
+    timeout = ser.timeout
+    set_read_timeout(ser, quiet)
+    try:
+        while ser.read(4096):
+            pass
+    finally:
+        set_read_timeout(ser, timeout)
+
+
+class Downloader:
+    """在已打开的串口上执行一次完整的下载会话
+    
+    会话是一个显式状态机：握手 → 进入下载模式 → 发送数据块 → 结束。
+    每个状态只等待设备应答，超时时间见 DEFAULT_TIMEOUTS（可用 timeouts 覆盖部分项），
+    不做固定延时；settle 为握手后可选的等待时间，仅用于握手后短时间内不接收数据的 bootloader。
+    
+    retries 为每块应答错误后的最大重发次数，None 时逐块应答为 0，流水线为 PIPELINE_MAX_ROLLBACKS；
+    重发前按 retry_backoff 指数退避。会话失败后 resume_block 为第一个未应答块的索引，
+    重新连接后可通过 download(..., start_block=resume_block) 从该块继续。
+    
+    on_progress(current, total)、on_info(text) 与 on_event(ProgressEvent) 为可选回调，在调用线程中执行；
+    on_event 在每个状态开始、每块应答和每次重发时调用，附带吞吐率、剩余时间与重发次数。
+    会话结束后 state 为 STATE_DONE 或失败时所在的状态，phase_times 记录各状态耗时（秒），block_rtts 记录每块从发送到收到应答的时间，
+    retry_count / retried_blocks 为重发总次数与重发过的块数，bytes_acked 为已应答数据包的线路字节数。
+    
+    profile 为 profiles.TargetProfile，决定命令与应答字节；镜像须按其 block_size 分块，
+    数据包按其 compression 编译。
+    """
+    def __init__(self, ser, window: int = 1, on_progress=None, on_info=None,
+                 timeouts: dict = None, settle: float = 0.0,
+                 retries: int = None, retry_backoff: float = DEFAULT_RETRY_BACKOFF, on_event=None,
+                 profile=None):
+        if window < 1:
+            raise ValueError(f"Invalid window {window}, must be at least 1")
+        self.ser = ser
+        self.profile = profile or BUILTIN_PROFILES[DEFAULT_PROFILE]
+        self.window = window
+        self.on_progress = on_progress
+        self.on_info = on_info
+        self.on_event = on_event
+        self.timeouts = dict(DEFAULT_TIMEOUTS, **(timeouts or {}))
+        self.settle = settle
+        if retries is None:
+            retries = PIPELINE_MAX_ROLLBACKS if window > 1 else 0
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.retry_count = 0
+        self.retried_blocks = 0
+        self.resume_block = 0
+        self.bytes_sent = 0  # 数据阶段发送的字节数
+        self.bytes_acked = 0
+        self.handshake_attempts = 0
+        self.phase_times = {}
+        self.block_rtts = []
+
+        # 当前状态；会话失败后为失败时所在的状态
+        self.state = None
+
+        # 进度事件的当前状态
+        self._percent = 0
+        self._blocks_done = 0
+        self._blocks_total = 0
+        self._block_start = 0.0
+        self._block_time = None  # 数据阶段结束后固定为其耗时
+        self._bytes_total = 0
+
+    def _progress(self, current: int, total: int = 100):
+        self._percent = current * 100 // total
+        if self.on_progress:
+            self.on_progress(current, total)
+        self._event()
+
+    def _event(self):
+        if not self.on_event:
+            return
+        elapsed = self._block_time
+        if elapsed is None:
+            elapsed = time.perf_counter() - self._block_start if self._blocks_total else 0.0
+        self.on_event(ProgressEvent(
+            self.state, self._percent, self._blocks_done, self._blocks_total,
+            self.bytes_acked, self._bytes_total,
+            elapsed, self.retry_count))
+
+    def _info(self, text: str):
+        if self.on_info:
+            self.on_info(text)
+
+    def _command(self, cmd: bytes, timeout: float, error: str, resend: float = None) -> int:
+        """发送命令并等待 CC DD
+        
+        resend 不为空时每隔 resend 秒重发一次，直到收到应答或超时；
+        重发过则读空输入，丢弃设备对重复命令的应答。返回发送次数。
+        """
+        ser = self.ser
+        ack = self.profile.ack
+        deadline = time.perf_counter() + timeout
+        attempts = 0
+        buf = b""
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                raise IAPError(error)
+            ser.write(cmd)
+            attempts += 1
+            resend_at = min(deadline, now + resend) if resend else deadline
+
+            while True:
+                remaining = resend_at - time.perf_counter()
+                if remaining <= 0:
+                    break
+                set_read_timeout(ser, remaining)
+                # 保留上次末尾不足一个应答的字节，应答可能被拆成两次读到
+                buf = buf[len(buf) - len(ack) + 1:] + ser.read(len(ack))
+                if ack in buf:
+                    if attempts > 1:
+                        drain_input(ser)
+                    return attempts
+
+    def download(self, image, base_addr: int, blocks: list = None, start_block: int = 0,
+                 stream: PacketStream = None):
+        """执行下载会话
+        
+        blocks 为 image.blocks 的子集时只发送这些块（差分下载）；
+        start_block 大于 0 时跳过前面已确认的块（断线续传）；
+        stream 为已按 base_addr 编译好的 PacketStream 时直接发送，不再重新编译。
+        """
+        if stream is None:
+            stream = PacketStream(image, base_addr, blocks, compression=self.profile.compression)
+        if stream.block_size != self.profile.block_size:
+            raise IAPError(f"Image block size {stream.block_size} does not match target profile "
+                           f"{self.profile.name!r} block size {self.profile.block_size}")
+        if stream.compression != self.profile.compression:
+            raise IAPError(f"Packet compression {stream.compression} does not match target profile "
+                           f"{self.profile.name!r} compression {self.profile.compression}")
+        handlers = {
+            STATE_HANDSHAKE: self._state_handshake,
+            STATE_MODE_ENTRY: self._state_mode_entry,
+            STATE_BLOCKS: lambda: self._state_blocks(stream, start_block),
+            STATE_FINISH: self._state_finish,
+        }
+        ser = self.ser
+        ser.reset_input_buffer()
+        self.phase_times = {}
+        self.block_rtts = []
+        self.retry_count = 0
+        self.retried_blocks = 0
+        self.resume_block = start_block
+        self._blocks_done = 0
+        self._blocks_total = 0
+        self._block_time = None
+        self.bytes_acked = 0
+        self._bytes_total = 0
+        timeout = ser.timeout
+
+        state = STATE_HANDSHAKE
+        try:
+            while state != STATE_DONE:
+                self.state = state
+                start = time.perf_counter()
+                try:
+                    next_state = handlers[state]()
+                finally:
+                    # 失败的状态也记录耗时，便于分析超时发生在哪一步
+                    self.phase_times[state] = time.perf_counter() - start
+                state = next_state
+            self.state = STATE_DONE
+        finally:
+            set_read_timeout(ser, timeout)
+
+    def _state_handshake(self) -> str:
+        # 1. 握手：设备可能仍在复位，周期性重发直到收到 CC DD
+        self._progress(5)  # 5%
+        self.handshake_attempts = self._command(
+            self.profile.handshake, self.timeouts[STATE_HANDSHAKE], "Handshake timeout",
+            resend=HANDSHAKE_POLL)
+        if self.settle:
+            time.sleep(self.settle)
+        return STATE_MODE_ENTRY
+
+    def _state_mode_entry(self) -> str:
+        # 2. 开始：可能包含擦除，只发送一次
+        self._progress(10)  # 10%
+        self._command(self.profile.mode_entry, self.timeouts[STATE_MODE_ENTRY], "Mode entry failed")
+        return STATE_BLOCKS
+
+    def _state_blocks(self, stream: PacketStream, start_block: int) -> str:
+        # 3. 数据发送
+        set_read_timeout(self.ser, self.timeouts[STATE_BLOCKS])
+        self.send_blocks(stream, start_block)
+        return STATE_FINISH
+
+    def _state_finish(self) -> str:
+        # 4. 结束
+        self._progress(95)  # 95%
+        set_read_timeout(self.ser, self.timeouts[STATE_FINISH])
+        self.ser.write(self.profile.finish)
+        self.ser.read(len(self.profile.ack))  # 读取响应
+        self._progress(100)  # 100%
+        return STATE_DONE
+
+    def send_blocks(self, stream: PacketStream, start_block: int = 0):
+        """从 start_block 开始发送数据包，并统计数据阶段吞吐率"""
+        total_blocks = len(stream)
+        self.block_rtts = []
+        self.resume_block = start_block
+        block_start = time.perf_counter()
+        self._blocks_done = 0
+        self._blocks_total = total_blocks - start_block
+        self._block_start = block_start
+        self._block_time = None
+        self.bytes_acked = 0
+        self._bytes_total = stream.wire_bytes(start_block, total_blocks)
+
+        self._send_packets(stream, start_block)
+
+        # 统计数据阶段吞吐率，便于与逐块应答模式对比
+        block_time = time.perf_counter() - block_start
+        self._block_time = block_time
+        block_bytes = self._bytes_total
+        self.bytes_sent = block_bytes
+        compressed = ""
+        if stream.compression:
+            raw = (total_blocks - start_block) * stream.packet_size
+            compressed = f", {stream.compression} {block_bytes * 100 // raw if raw else 100}% of {raw} bytes"
+        self._info(f"Block phase: {total_blocks - start_block} blocks, {block_bytes} bytes in {block_time:.3f}s "
+                   f"({block_bytes / block_time if block_time > 0 else 0:.0f} B/s), "
+                   f"window={self.window}, retries={self.retry_count}{compressed}")
+
+    def _send_packets(self, stream: PacketStream, start: int):
+        """按窗口发送数据包
+        
+        window 为 1 时逐块应答；大于 1 时最多保持 window 个未应答的块，应答按发送顺序与块一一对应。
+        应答不带地址，对应关系只能靠计数维持：
+          - 收到错误应答（NAK）：按数量读掉窗口内其余块的在途应答（不按静默时间，
+            写 flash 较慢或波特率较低时应答可能很久之后才到），退避后从该块重发；
+          - 应答超时：某个应答丢失，此前的应答可能都已错位一块，无法确定是哪一块，
+            清空输入后从上次确认对应关系的位置（synced）重发。
+        每发送 PIPELINE_SYNC_BLOCKS 块等待窗口排空一次：全部应答按数量到齐即确认对应关系，
+        应答丢失最迟在这里以超时发现，重发的块数有上限。单块重发超过 retries 次则失败。
+        """
+        ser = self.ser
+        ack = self.profile.ack
+        total = len(stream)
+        next_send = start  # 下一个待发送块
+        acked = start      # 已确认块数，即第一个未应答块的索引
+        synced = start     # 此前的应答与块的对应关系已确认
+        sent_at = [0.0] * total
+        attempts = {}      # 块索引 → 已重发次数
+
+        while acked < total:
+            if acked == next_send:
+                # 窗口已排空且没有超时：应答没有错位
+                synced = acked
+            # 填满发送窗口：窗口内的数据包在缓冲区中相邻，一次写出
+            end = min(total, acked + self.window, synced + PIPELINE_SYNC_BLOCKS)
+            if next_send < end:
+                now = time.perf_counter()
+                for i in range(next_send, end):
+                    sent_at[i] = now
+                ser.write(stream.packets(next_send, end))
+                next_send = end
+
+            reply = ser.read(len(ack))
+            if reply == ack:
+                self.block_rtts.append(time.perf_counter() - sent_at[acked])
+                acked += 1
+                self._acked(stream, start, acked)
+                continue
+
+            failed = acked
+            if len(reply) < len(ack) or not self._discard_replies(next_send - acked - 1):
+                # 应答丢失：自 synced 起的块都不能确认已写入
+                ser.reset_input_buffer()
+                if acked > synced:
+                    self._info(f"Acknowledgement lost, resending from block {synced}")
+                    acked = synced
+                    self._acked(stream, start, acked)
+
+            # 重发第一个未应答块
+            n = attempts.get(failed, 0) + 1
+            if n > self.retries:
+                raise IAPError(f"Block {failed} address {hex(stream.addresses[failed])} checksum error")
+            attempts[failed] = n
+            self.retry_count += 1
+            self.retried_blocks = len(attempts)
+            self._info(f"Block {failed} address {hex(stream.addresses[failed])} not acknowledged, "
+                       f"retry {n}/{self.retries}")
+            self._event()
+            time.sleep(self.retry_backoff * (2 ** (n - 1)))
+            next_send = acked
+
+    def _acked(self, stream: PacketStream, start: int, acked: int):
+        """已确认块数变为 acked，更新续传位置与进度"""
+        self.resume_block = acked
+        self._blocks_done = acked - start
+        self.bytes_acked = stream.wire_bytes(start, acked)
+        # 更新进度 - 从10%到90%
+        self._progress(10 + int(acked * 80 / len(stream)))
+
+    def _discard_replies(self, count: int) -> bool:
+        """读掉 count 个在途应答，每个最多等待一块的超时；有应答超时（丢失）时返回 False"""
+        size = len(self.profile.ack)
+        for _ in range(count):
+            if len(self.ser.read(size)) < size:
+                return False
+        return True
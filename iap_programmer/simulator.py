@@ -0,0 +1,341 @@
+"""IAP bootloader 模拟器：在 pty 或 TCP 上模拟设备端协议，用于无硬件测试与性能测试
+
+模拟的协议与上位机一致（以下为默认目标配置，其他配置按其命令字节与块大小）：
+  5A A5 → CC DD          握手
+  5A 01 → CC DD          进入下载模式
+  31 + 地址(大端) + 数据 + 校验和 → CC DD（校验错误回复 NAK）
+  32 + 地址(大端) + 长度(大端) + LZ4 块 + 校验和 → CC DD
+                         仅目标配置启用压缩时识别，解压失败或长度不等于块大小时回复 NAK
+  5A 02 → CC DD          结束
+
+时序模型：接收线程按模拟波特率（8N1，每字节10位）给每个字节打上到达时间，
+处理线程等到数据包最后一个字节到达后才处理，再花 program_latency 秒写 flash，
+写 flash 期间接收不停止（相当于 DMA 接收），应答同样按波特率计入发送时间。
+"""
+import os
+import sys
+import time
+import queue
+import random
+import socket
+import threading
+from collections import deque
+
+from .compress import decompress_block
+from .profiles import BUILTIN_PROFILES, DEFAULT_PROFILE
+from .protocol import (CMD_WRITE_BLOCK, CMD_WRITE_BLOCK_LZ4, STATE_FINISH, STATE_HANDSHAKE,
+                       STATE_MODE_ENTRY)
+
+# 模拟器对校验失败的数据包的回复
+NAK = b'\xEE\xEE'
+
+
+class BootloaderSimulator:
+    """bootloader 模拟器
+
+    baud_rate: 模拟的线路速率，None 表示不限速
+    program_latency: 每块写 flash 的耗时（秒）
+    nak_rate / drop_rate: 每块随机回复 NAK / 不回复的概率
+    fail_blocks: 按接收顺序编号（从0开始）必定回复 NAK 的块
+    boot_delay: 启动后多少秒内不响应握手（模拟设备复位）
+    erase_latency: 进入下载模式时擦除 flash 的耗时（秒）
+    profile: 目标配置（profiles.TargetProfile），决定块大小与命令、应答字节，默认为原协议
+    line_rates: 设备能识别的上位机波特率（仅 pty，Linux），上位机端口设为其他波特率时收到的数据按乱码丢弃，
+                用于测试自动波特率协商；None 表示任何波特率都能通信
+    """
+    def __init__(self, baud_rate: int = None, program_latency: float = 0.0,
+                 nak_rate: float = 0.0, drop_rate: float = 0.0, fail_blocks=(), seed: int = None,
+                 boot_delay: float = 0.0, erase_latency: float = 0.0, line_rates=None, profile=None):
+        self.byte_time = 10.0 / baud_rate if baud_rate else 0.0
+        self.program_latency = program_latency
+        self.boot_delay = boot_delay
+        self.erase_latency = erase_latency
+        self.nak_rate = nak_rate
+        self.drop_rate = drop_rate
+        self.fail_blocks = set(fail_blocks)
+        self.line_rates = set(line_rates) if line_rates else None
+        self.profile = profile or BUILTIN_PROFILES[DEFAULT_PROFILE]
+        self.random = random.Random(seed)
+
+        # 设备 flash 内容：块地址 → 数据
+        self.memory = {}
+
+        # 统计
+        self.handshakes = 0
+        self.mode_entries = 0
+        self.blocks_received = 0
+        self.compressed_blocks = 0
+        self.naks = 0
+        self.drops = 0
+        self.finishes = 0
+
+        self._running = False
+        self._started = 0.0
+        self._fds = []
+        self._server = None
+        self._threads = []
+
+    # ---- 传输层 ----
+
+    def start_pty(self) -> str:
+        """在 pty 上运行（仅 POSIX），返回上位机应打开的设备路径"""
+        import pty
+        import tty
+
+        master, slave = pty.openpty()
+        tty.setraw(master)
+        tty.setraw(slave)
+        # 模拟器自己保持 slave 打开，上位机反复开关端口时 master 端不会读到 EIO
+        self._fds = [master, slave]
+        self._running = True
+        self._started = time.perf_counter()
+
+        def read():
+            try:
+                data = os.read(master, 65536)
+            except OSError:
+                return b''
+            if self.line_rates and _pty_line_rate(master) not in self.line_rates:
+                # 波特率不匹配，设备收到的是乱码
+                return bytes(len(data))
+            return data
+
+        def write(data):
+            # stop() 关闭了 master 时由 _serve_link 结束连接
+            os.write(master, data)
+
+        self._spawn(self._serve_link, read, write)
+        return os.ttyname(slave)
+
+    def start_tcp(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """在 TCP 上运行（依次接受连接），返回 pyserial URL socket://host:port"""
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((host, port))
+        server.listen(1)
+        self._server = server
+        self._running = True
+        self._started = time.perf_counter()
+
+        def accept_loop():
+            while self._running:
+                try:
+                    conn, _ = server.accept()
+                except OSError:
+                    return
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+                def read():
+                    try:
+                        return conn.recv(65536)
+                    except OSError:
+                        return b''
+
+                with conn:
+                    self._serve_link(read, conn.sendall)
+
+        self._spawn(accept_loop)
+        return f"socket://{host}:{server.getsockname()[1]}"
+
+    def stop(self):
+        self._running = False
+        if self._server:
+            # 只 close 不会唤醒另一线程中阻塞的 accept（Linux），先 shutdown
+            try:
+                self._server.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._server.close()
+        for fd in self._fds:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self._fds = []
+        for t in self._threads:
+            t.join(timeout=1)
+        self._threads = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _spawn(self, target, *args):
+        t = threading.Thread(target=target, args=args, daemon=True)
+        t.start()
+        self._threads.append(t)
+
+    # ---- 设备逻辑 ----
+
+    def _serve_link(self, read, write):
+        """服务一条连接直到对端关闭"""
+        chunks = queue.Queue()
+        rx_state = {"free_at": 0.0}
+
+        def receiver():
+            # 按模拟波特率计算每段数据最后一个字节的到达时间
+            while self._running:
+                data = read()
+                if not data:
+                    break
+                start = max(time.perf_counter(), rx_state["free_at"])
+                rx_state["free_at"] = start + len(data) * self.byte_time
+                chunks.put((data, start))
+            chunks.put(None)
+
+        threading.Thread(target=receiver, daemon=True).start()
+
+        buf = bytearray()
+        base = 0          # buf[0] 在整个接收流中的偏移
+        marks = deque()   # (流偏移, 长度, 首字节开始时间)
+        closed = False
+
+        def arrival(offset: int) -> float:
+            """流中第 offset 个字节接收完成的时间"""
+            for start, length, t in marks:
+                if start <= offset < start + length:
+                    return t + (offset - start + 1) * self.byte_time
+            return 0.0
+
+        def need(n: int) -> bool:
+            """等待缓冲区中至少有 n 字节，连接关闭时返回 False"""
+            nonlocal closed
+            while len(buf) < n:
+                if closed:
+                    return False
+                try:
+                    item = chunks.get(timeout=0.2)
+                except queue.Empty:
+                    if not self._running:
+                        return False
+                    continue
+                if item is None:
+                    closed = True
+                    return False
+                data, t = item
+                marks.append((base + len(buf), len(data), t))
+                buf.extend(data)
+            return True
+
+        def consume(n: int) -> bytes:
+            nonlocal base
+            # 等到最后一个字节按模拟波特率真正到达
+            _sleep_until(arrival(base + n - 1))
+            data = bytes(buf[:n])
+            del buf[:n]
+            base += n
+            while marks and marks[0][0] + marks[0][1] <= base:
+                marks.popleft()
+            return data
+
+        def reply(data: bytes):
+            nonlocal closed
+            time.sleep(len(data) * self.byte_time)
+            if closed:
+                return
+            try:
+                write(data)
+            except OSError:
+                # 对端已关闭或模拟器已停止：结束这条连接
+                closed = True
+
+        profile = self.profile
+        commands = ((profile.handshake, STATE_HANDSHAKE), (profile.mode_entry, STATE_MODE_ENTRY),
+                    (profile.finish, STATE_FINISH))
+        while self._running:
+            if not need(1):
+                return
+            if buf[0] == CMD_WRITE_BLOCK:
+                if not need(profile.packet_size):
+                    return
+                packet = consume(profile.packet_size)
+                self._write_block(packet, reply)
+                continue
+            if buf[0] == CMD_WRITE_BLOCK_LZ4 and profile.compression:
+                # 命令 + 地址 + 长度，之后是压缩数据与校验和
+                if not need(7):
+                    return
+                length = int.from_bytes(buf[5:7], "big")
+                if not need(7 + length + 1):
+                    return
+                packet = consume(7 + length + 1)
+                self._write_block(packet, reply)
+                continue
+
+            for seq, command in commands:
+                if buf[0] != seq[0]:
+                    continue
+                if not need(len(seq)):
+                    return
+                if buf[:len(seq)] == seq:
+                    break
+            else:
+                # 无法识别的字节，丢弃以重新同步
+                consume(1)
+                continue
+
+            consume(len(seq))
+            if command == STATE_HANDSHAKE:
+                if time.perf_counter() < self._started + self.boot_delay:
+                    continue
+                self.handshakes += 1
+            elif command == STATE_MODE_ENTRY:
+                self.mode_entries += 1
+                if self.erase_latency:
+                    time.sleep(self.erase_latency)
+            else:
+                self.finishes += 1
+            reply(profile.ack)
+
+    def _write_block(self, packet: bytes, reply):
+        index = self.blocks_received
+        self.blocks_received += 1
+
+        if self.drop_rate and self.random.random() < self.drop_rate:
+            self.drops += 1
+            return
+
+        checksum_ok = sum(packet[1:-1]) & 0xFF == packet[-1]
+        if (not checksum_ok or index in self.fail_blocks
+                or (self.nak_rate and self.random.random() < self.nak_rate)):
+            self.naks += 1
+            reply(NAK)
+            return
+
+        addr = int.from_bytes(packet[1:5], "big")
+        data = packet[5:-1]
+        if packet[0] == CMD_WRITE_BLOCK_LZ4:
+            try:
+                data = decompress_block(packet[7:-1], self.profile.block_size)
+            except ValueError:
+                self.naks += 1
+                reply(NAK)
+                return
+            self.compressed_blocks += 1
+        if self.program_latency:
+            time.sleep(self.program_latency)
+        self.memory[addr] = data
+        reply(self.profile.ack)
+
+
+def _pty_line_rate(fd: int):
+    """上位机为 pty 设置的波特率（Linux TCGETS2），无法获取时返回 None"""
+    if not sys.platform.startswith("linux"):
+        return None
+    import array
+    import fcntl
+    # struct termios2：4个标志字 + c_line + c_cc[19] 共9个 int，之后为 c_ispeed、c_ospeed
+    buf = array.array('i', [0] * 64)
+    try:
+        fcntl.ioctl(fd, 0x802C542A, buf)  # TCGETS2
+    except OSError:
+        return None
+    return buf[10]
+
+
+def _sleep_until(deadline: float):
+    delay = deadline - time.perf_counter()
+    if delay > 0:
+        time.sleep(delay)
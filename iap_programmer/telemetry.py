@@ -0,0 +1,252 @@
+"""下载会话性能记录
+
+每次会话（包括失败和断线重连的每一次尝试）记录一条：各状态耗时、握手次数、
+数据阶段吞吐率、重发次数与每块“发送→应答”往返时间的分布，用于区分串口适配器、
+波特率与 bootloader 写 flash 时间造成的变慢。
+
+TelemetryLog 把记录追加到 sessions.jsonl（超过 max_bytes 时轮换为 sessions.jsonl.1），
+并为每个端口写一个 Prometheus 文本格式文件 <端口>.prom（最近一次会话，
+可由 node_exporter 的 textfile collector 采集）。aggregate() 按端口等字段汇总多次会话。
+"""
+import os
+import re
+import json
+import time
+import socket
+import threading
+
+from .protocol import STATE_BLOCKS, STATE_FINISH, STATE_HANDSHAKE, STATE_MODE_ENTRY
+
+RECORD_VERSION = 1
+
+# 往返时间直方图的桶上界（秒），最后一个桶为 +Inf
+RTT_BUCKETS = (0.001, 0.002, 0.003, 0.005, 0.0075, 0.01, 0.015, 0.02, 0.03, 0.05, 0.075,
+               0.1, 0.15, 0.2, 0.3, 0.5, 1.0, 2.0)
+
+PHASES = (STATE_HANDSHAKE, STATE_MODE_ENTRY, STATE_BLOCKS, STATE_FINISH)
+
+# 会话日志轮换大小：16 MB
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+
+_LOG = "sessions.jsonl"
+
+
+def default_telemetry_dir() -> str:
+    return os.path.join(os.path.expanduser("~"), ".iap_programmer", "telemetry")
+
+
+def rtt_histogram(rtts) -> list:
+    """各桶计数（非累计），长度为 len(RTT_BUCKETS) + 1"""
+    counts = [0] * (len(RTT_BUCKETS) + 1)
+    for rtt in rtts:
+        for i, bound in enumerate(RTT_BUCKETS):
+            if rtt <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+    return counts
+
+
+def _percentile(values: list, q: float):
+    """已排序列表的分位数，空列表返回 None"""
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def histogram_percentile(counts: list, q: float):
+    """由直方图估计分位数（桶内线性插值，与 Prometheus histogram_quantile 相同），无数据返回 None"""
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for i, n in enumerate(counts):
+        if n and seen + n >= rank:
+            if i == len(RTT_BUCKETS):
+                # 落在 +Inf 桶，只能给出最大的有限上界
+                return RTT_BUCKETS[-1]
+            lower = RTT_BUCKETS[i - 1] if i else 0.0
+            return lower + (RTT_BUCKETS[i] - lower) * (rank - seen) / n
+        seen += n
+    return RTT_BUCKETS[-1]
+
+
+def session_record(downloader, port: str, baud_rate: int, image=None, error: str = None,
+                   elapsed: float = None) -> dict:
+    """由一次 Downloader 会话生成记录"""
+    rtts = sorted(downloader.block_rtts)
+    phases = {phase: round(downloader.phase_times[phase], 6)
+              for phase in PHASES if phase in downloader.phase_times}
+    block_time = downloader.phase_times.get(STATE_BLOCKS, 0.0)
+    block_bytes = downloader.bytes_acked
+    return {
+        "version": RECORD_VERSION,
+        "time": time.time(),
+        "station": socket.gethostname(),
+        "port": port,
+        "baud": baud_rate,
+        "window": downloader.window,
+        "profile": downloader.profile.name,
+        "block_size": downloader.profile.block_size,
+        "compression": downloader.profile.compression,
+        "file": os.path.basename(image.path) if image is not None else None,
+        "crc": image.crc if image is not None else None,
+        "ok": error is None,
+        "error": error,
+        "failed_state": downloader.state if error is not None else None,
+        "elapsed": round(elapsed if elapsed is not None else sum(downloader.phase_times.values()), 6),
+        "phases": phases,
+        "handshake_attempts": downloader.handshake_attempts,
+        "blocks": len(rtts),
+        "bytes": block_bytes,
+        "bytes_per_sec": round(block_bytes / block_time, 1) if block_time > 0 else 0.0,
+        "retries": downloader.retry_count,
+        "rtt": {
+            "min": rtts[0] if rtts else None,
+            "p50": _percentile(rtts, 0.50),
+            "p95": _percentile(rtts, 0.95),
+            "p99": _percentile(rtts, 0.99),
+            "max": rtts[-1] if rtts else None,
+            "sum": sum(rtts),
+            "histogram": rtt_histogram(rtts),
+        },
+    }
+
+
+def _label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def prometheus_text(record: dict) -> str:
+    """一条会话记录的 Prometheus 文本格式"""
+    labels = f'port="{_label(record["port"])}",station="{_label(record["station"])}"'
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for extra, value in samples:
+            lines.append(f"{name}{{{labels}{extra}}} {value}")
+
+    metric("iap_session_timestamp_seconds", "gauge", "End time of the last download session.",
+           [("", f"{record['time']:.3f}")])
+    metric("iap_session_success", "gauge", "1 if the last download session succeeded.",
+           [("", int(record["ok"]))])
+    metric("iap_session_duration_seconds", "gauge", "Total duration of the last session.",
+           [("", record["elapsed"])])
+    metric("iap_session_phase_seconds", "gauge", "Duration of each session phase.",
+           [(f',phase="{phase}"', t) for phase, t in record["phases"].items()])
+    metric("iap_session_handshake_attempts", "gauge", "Handshake commands sent before the first ack.",
+           [("", record["handshake_attempts"])])
+    metric("iap_session_bytes_per_second", "gauge", "Block phase throughput in wire bytes per second.",
+           [("", record["bytes_per_sec"])])
+    metric("iap_session_bytes", "gauge", "Wire bytes acknowledged in the block phase.",
+           [("", record["bytes"])])
+    metric("iap_session_retries", "gauge", "Block resends in the last session.",
+           [("", record["retries"])])
+
+    rtt = record["rtt"]
+    samples = []
+    cumulative = 0
+    for bound, n in zip(RTT_BUCKETS + ("+Inf",), rtt["histogram"]):
+        cumulative += n
+        samples.append((f',le="{bound}"', cumulative))
+    lines.append("# HELP iap_block_rtt_seconds Time from writing a block to receiving its ack.")
+    lines.append("# TYPE iap_block_rtt_seconds histogram")
+    for extra, value in samples:
+        lines.append(f"iap_block_rtt_seconds_bucket{{{labels}{extra}}} {value}")
+    lines.append(f"iap_block_rtt_seconds_sum{{{labels}}} {rtt['sum']:.6f}")
+    lines.append(f"iap_block_rtt_seconds_count{{{labels}}} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+class TelemetryLog:
+    """会话记录目录，可在多个下载线程间共享"""
+    def __init__(self, directory: str = None, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = directory or default_telemetry_dir()
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    @property
+    def log_path(self) -> str:
+        return os.path.join(self.directory, _LOG)
+
+    def record_session(self, downloader, port: str, baud_rate: int, image=None, error: str = None,
+                       elapsed: float = None) -> dict:
+        record = session_record(downloader, port, baud_rate, image, error, elapsed)
+        self.write(record)
+        return record
+
+    def write(self, record: dict):
+        """追加 JSON 行并更新该端口的 .prom 文件，写入失败只打印不抛出"""
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        name = re.sub(r'[^A-Za-z0-9_.-]', '_', record["port"])
+        prom = os.path.join(self.directory, f"{name}.prom")
+        try:
+            with self._lock:
+                os.makedirs(self.directory, exist_ok=True)
+                path = self.log_path
+                if os.path.exists(path) and os.path.getsize(path) > self.max_bytes:
+                    os.replace(path, path + ".1")
+                with open(path, 'a') as f:
+                    f.write(line)
+                with open(prom + ".tmp", 'w') as f:
+                    f.write(prometheus_text(record))
+                os.replace(prom + ".tmp", prom)
+        except OSError as e:
+            print(f"Telemetry write failed: {e}")
+
+    def sessions(self, since: float = None) -> list:
+        """读取全部会话记录（含轮换出的旧文件），since 为最早的时间戳"""
+        records = []
+        for path in (self.log_path + ".1", self.log_path):
+            try:
+                with open(path, 'r') as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            continue
+                        if record.get("version") != RECORD_VERSION:
+                            continue
+                        if since is None or record["time"] >= since:
+                            records.append(record)
+            except OSError:
+                pass
+        return records
+
+
+def _median(values: list):
+    values = sorted(v for v in values if v is not None)
+    return _percentile(values, 0.5)
+
+
+def aggregate(records: list, by: str = "port") -> list:
+    """按 by 字段分组汇总，返回每组一个 dict（按组名排序）"""
+    groups = {}
+    for record in records:
+        groups.setdefault(str(record.get(by)), []).append(record)
+
+    rows = []
+    for key in sorted(groups):
+        group = groups[key]
+        ok = [r for r in group if r["ok"]]
+        histogram = [0] * (len(RTT_BUCKETS) + 1)
+        for r in group:
+            for i, n in enumerate(r["rtt"]["histogram"]):
+                histogram[i] += n
+        rows.append({
+            by: key,
+            "sessions": len(group),
+            "ok": len(ok),
+            "elapsed": _median([r["elapsed"] for r in ok]),
+            "phases": {phase: _median([r["phases"].get(phase) for r in ok]) for phase in PHASES},
+            "bytes_per_sec": _median([r["bytes_per_sec"] for r in ok]),
+            "retries": sum(r["retries"] for r in group),
+            "rtt_p50": histogram_percentile(histogram, 0.50),
+            "rtt_p95": histogram_percentile(histogram, 0.95),
+            "failed_states": sorted({r["failed_state"] for r in group if not r["ok"] and r["failed_state"]}),
+        })
+    return rows
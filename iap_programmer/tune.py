@@ -0,0 +1,85 @@
+"""块大小调优：用候选块大小重复下载同一镜像，选出最快且稳定的设置
+
+每个候选块大小下载 runs 次，全部成功且没有重发才算稳定，稳定的候选中取会话耗时中位数最小的。
+下载由调用方提供的 flash(image, profile) 执行（真实端口或模拟器），返回 GangResult。
+"""
+import statistics
+
+from .image import load_image
+
+DEFAULT_BLOCK_SIZES = (256, 512, 1024, 2048, 4096, 8192, 16384)
+
+
+class TuneResult:
+    """一个候选块大小的测量结果"""
+    def __init__(self, block_size: int, length: int):
+        self.block_size = block_size
+        self.length = length  # 镜像数据长度
+        self.elapsed = []     # 成功会话的耗时（秒）
+        self.failures = 0
+        self.retries = 0
+        self.error = ""
+
+    @property
+    def stable(self) -> bool:
+        return bool(self.elapsed) and not self.failures and not self.retries
+
+    @property
+    def median(self):
+        return statistics.median(self.elapsed) if self.elapsed else None
+
+    @property
+    def throughput(self) -> float:
+        """有效数据吞吐率（镜像字节/秒）"""
+        median = self.median
+        return self.length / median if median else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "block_size": self.block_size,
+            "runs": len(self.elapsed) + self.failures,
+            "failures": self.failures,
+            "retries": self.retries,
+            "median": self.median,
+            "throughput": round(self.throughput, 1),
+        }
+
+
+def tune_block_sizes(file_path: str, base_profile, flash, block_sizes=DEFAULT_BLOCK_SIZES,
+                     runs: int = 3, on_info=None) -> list:
+    """依次测量各候选块大小，返回 TuneResult 列表
+
+    候选块大小的一次下载失败后不再重复（bootloader 多半不支持该块大小）。
+    """
+    results = []
+    for block_size in block_sizes:
+        profile = base_profile.copy(f"{base_profile.name}@{block_size}", block_size=block_size)
+        image = load_image(file_path, block_size=block_size)
+        result = TuneResult(block_size, image.length)
+        try:
+            for _ in range(runs):
+                r = flash(image, profile)
+                result.retries += r.retries
+                if not r.ok:
+                    result.failures += 1
+                    result.error = r.error
+                    break
+                result.elapsed.append(r.elapsed)
+        finally:
+            image.close()
+        if on_info:
+            if result.elapsed and not result.failures:
+                on_info(f"block size {block_size:6d}: median {result.median:.3f}s, "
+                        f"{result.throughput:.0f} B/s, retries {result.retries}")
+            else:
+                on_info(f"block size {block_size:6d}: failed ({result.error})")
+        results.append(result)
+    return results
+
+
+def best_result(results: list):
+    """稳定候选中最快的一个，没有稳定候选时返回 None"""
+    stable = [r for r in results if r.stable]
+    if not stable:
+        return None
+    return min(stable, key=lambda r: r.median)
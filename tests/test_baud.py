@@ -0,0 +1,18 @@
+"""波特率缓存的测试"""
+import threading
+
+from iap_programmer.baud import BaudCache
+
+
+def test_concurrent_store(tmp_path):
+    # gang --auto-baud 的各工作线程共享同一个缓存
+    cache = BaudCache(str(tmp_path / "baud.json"))
+    threads = [threading.Thread(target=cache.store, args=(f"port{i}", 115200, 921600, 0.001))
+               for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for i in range(8):
+        assert cache.load(f"port{i}", 115200)["baud"] == 921600
+    assert [p.name for p in tmp_path.iterdir()] == ["baud.json"]
@@ -0,0 +1,52 @@
+"""命令行参数的测试"""
+import pytest
+
+from iap_programmer.cli import build_parser, main
+
+
+def test_gang_rejects_patch():
+    # 同一个序列号不能写进并行下载的每一块板
+    with pytest.raises(SystemExit):
+        build_parser().parse_args(["gang", "--port", "COM3", "--port", "COM4",
+                                   "--patch", "0800F800=str:SN-1", "app.hex"])
+    args = build_parser().parse_args(["flash", "--port", "COM3", "--patch", "0800F800=str:SN-1", "app.hex"])
+    assert args.patch == ["0800F800=str:SN-1"]
+
+
+def test_delta_needs_device_id(capsys):
+    # 按端口缓存时换上的新板会被当作已下载过
+    with pytest.raises(SystemExit):
+        build_parser().parse_args(["gang", "--port", "COM3", "--delta", "app.hex"])
+    assert main(["flash", "--port", "COM3", "--delta", "app.hex"]) == 2
+    assert "--device-id" in capsys.readouterr().err
+
+
+def test_load_errors_are_reported(tmp_path, capsys):
+    bad_hex = tmp_path / "bad.hex"
+    bad_hex.write_text(":10000000ZZ\n")
+    short_hex = tmp_path / "short.hex"
+    short_hex.write_text(":\n")
+    truncated_hex = tmp_path / "truncated.hex"
+    truncated_hex.write_text(":10000000000102FD\n")  # 长度字节为 16，只有 3 字节数据
+    app = tmp_path / "app.bin"
+    app.write_bytes(bytes(16))
+    for argv in ([str(tmp_path / "missing.hex")], [str(tmp_path / "app.txt")],
+                 ["--no-image-cache", str(bad_hex)], ["--no-image-cache", str(short_hex)],
+                 ["--no-image-cache", str(truncated_hex)], ["--address", "08G0", str(app)]):
+        assert main(["flash", "--port", "COM3", "--no-telemetry"] + argv) == 1
+        assert capsys.readouterr().err.startswith("Error: ")
+
+
+def test_tune_errors_are_reported(tmp_path, capsys):
+    app = tmp_path / "app.bin"
+    app.write_bytes(bytes(16))
+    for argv in (["--address", "08G0", str(app)], [str(tmp_path / "missing.hex")],
+                 ["--block-sizes", "1K", str(app)], ["--block-sizes", "0", str(app)]):
+        assert main(["tune", "--simulate"] + argv) == 1
+        assert "Error: " in capsys.readouterr().err
+
+
+def test_window_must_be_positive():
+    for command in (["flash", "--port", "COM3"], ["tune", "--simulate"]):
+        with pytest.raises(SystemExit):
+            build_parser().parse_args(command + ["--window", "0", "app.hex"])
@@ -0,0 +1,92 @@
+"""LZ4 块压缩的测试"""
+import random
+
+import pytest
+
+from iap_programmer.compress import MIN_MATCH, compress_block, decompress_block
+
+
+def samples():
+    rng = random.Random(0)
+    yield b""
+    yield b"\x00"
+    yield bytes(12)
+    yield bytes(13)
+    yield b"\xFF" * 2048
+    yield rng.randbytes(2048)
+    yield bytes(range(256)) * 8
+    yield b"abcd" * 5 + rng.randbytes(100) + b"abcd" * 300
+    # 类似固件：指令片段重复、常量表、末尾填充
+    code = b"".join(rng.choice([b"\x00\xBF", b"\x70\x47", b"\x08\xB5", rng.randbytes(4)]) for _ in range(700))
+    yield code[:1800] + b"\xFF" * 248
+    for size in (16, 255, 270, 4096, 65536 + 300):
+        yield bytes(rng.choice(b"ab") for _ in range(size))
+
+
+def sequences(payload: bytes):
+    """把 LZ4 块拆成 (字面量开始, 字面量长度, 匹配开始, 匹配长度) 序列，输出位置为解压后的偏移"""
+    i, pos = 0, 0
+    while True:
+        token = payload[i]
+        i += 1
+        lit = token >> 4
+        if lit == 15:
+            while True:
+                lit += payload[i]
+                i += 1
+                if payload[i - 1] != 255:
+                    break
+        i += lit
+        if i == len(payload):
+            yield pos, lit, None, 0
+            return
+        i += 2
+        match = (token & 15) + MIN_MATCH
+        if token & 15 == 15:
+            while True:
+                match += payload[i]
+                i += 1
+                if payload[i - 1] != 255:
+                    break
+        yield pos, lit, pos + lit, match
+        pos += lit + match
+
+
+@pytest.mark.parametrize("data", list(samples()), ids=lambda d: str(len(d)))
+def test_round_trip(data):
+    payload = compress_block(data)
+    assert decompress_block(payload, len(data)) == data
+
+
+@pytest.mark.parametrize("data", list(samples()), ids=lambda d: str(len(d)))
+def test_end_of_block_rules(data):
+    # 最后 5 字节必须是字面量，最后一次匹配至少在结尾前 12 字节开始
+    n = len(data)
+    for _, _, match_start, match in sequences(compress_block(data)):
+        if match_start is not None:
+            assert match_start + match <= n - 5
+            assert match_start <= n - 12
+
+
+def test_compresses_repetitive_data():
+    assert len(compress_block(b"\xFF" * 2048)) < 20
+
+
+def test_matches_reference_decoder():
+    lz4_block = pytest.importorskip("lz4.block")
+    for data in samples():
+        if data:
+            assert lz4_block.decompress(compress_block(data), uncompressed_size=len(data)) == data
+
+
+@pytest.mark.parametrize("payload, size", [
+    (b"", 0),                          # 没有 token
+    (b"\x40ab", 4),                    # 字面量超出输入
+    (b"\x10a\x05\x00", 10),            # 偏移超出已解压数据
+    (b"\x10a\x00\x00", 10),            # 偏移为 0
+    (b"\x30abc", 4),                   # 长度不等于块大小
+    (b"\x1Fa\x01\x00\xFF\xFF\x10", 64),  # 匹配超出块大小
+])
+def test_decompress_rejects_bad_input(payload, size):
+    with pytest.raises(ValueError):
+        decompress_block(payload, size)
@@ -0,0 +1,34 @@
+"""CRC 计算与移位、拼接的测试"""
+import random
+
+import pytest
+
+from iap_programmer.crc import crc_combine, crc_shift, get_load_file_crc
+
+rng = random.Random(0)
+
+
+@pytest.mark.parametrize("length", [0, 1, 3, 8, 255, 2048, 100003])
+def test_shift_equals_appending_zeros(length):
+    data = rng.randbytes(64)
+    crc = get_load_file_crc(data)
+    assert crc_shift(crc, length) == get_load_file_crc(data + bytes(length))
+
+
+@pytest.mark.parametrize("len1, len2", [(0, 0), (0, 5), (5, 0), (1, 1), (100, 2048), (4096, 77777)])
+def test_combine_equals_concatenation(len1, len2):
+    a, b = rng.randbytes(len1), rng.randbytes(len2)
+    assert crc_combine(get_load_file_crc(a), get_load_file_crc(b), len2) == get_load_file_crc(a + b)
+
+
+def test_incremental_crc_matches_initial_value():
+    # 分段计算（上一段 CRC 作为初值）与整段计算一致
+    data = rng.randbytes(10000)
+    assert get_load_file_crc(data[5000:], get_load_file_crc(data[:5000])) == get_load_file_crc(data)
+
+
+def test_xor_delta_is_linear():
+    # 写入单板数据后的增量更新依赖的性质：CRC(a ^ b) = CRC(a) ^ CRC(b)（长度相同、初值为 0）
+    a, b = rng.randbytes(300), rng.randbytes(300)
+    delta = bytes(x ^ y for x, y in zip(a, b))
+    assert get_load_file_crc(a) ^ get_load_file_crc(b) == get_load_file_crc(delta)
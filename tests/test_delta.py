@@ -0,0 +1,74 @@
+"""差分下载的测试"""
+import json
+import random
+
+import pytest
+
+from iap_programmer.delta import DeltaCache
+from iap_programmer.gang import flash_port
+from iap_programmer.image import load_image
+from iap_programmer.profiles import BUILTIN_PROFILES, DEFAULT_PROFILE
+from iap_programmer.simulator import BootloaderSimulator
+
+BASE_ADDR = 0x08000000
+BOARD = "SN-0001"
+
+
+@pytest.fixture
+def firmware(tmp_path):
+    data = bytearray(random.Random(0).randbytes(8 * 2048))
+    path = tmp_path / "app.bin"
+    path.write_bytes(data)
+    return path, data
+
+
+def flash(path, cache, device_id=BOARD, block_size=2048):
+    profile = BUILTIN_PROFILES[DEFAULT_PROFILE].copy(block_size=block_size)
+    image = load_image(str(path), block_size=block_size)
+    try:
+        with BootloaderSimulator(profile=profile) as sim:
+            result = flash_port(image, sim.start_tcp(), 921600, BASE_ADDR, delta_cache=cache,
+                                device_id=device_id, profile=profile)
+    finally:
+        image.close()
+    assert result.ok, result.error
+    return sim
+
+
+def test_second_run_sends_changed_blocks(tmp_path, firmware):
+    path, data = firmware
+    cache = DeltaCache(str(tmp_path / "devices"))
+    assert flash(path, cache).blocks_received == 8  # 没有缓存：整片下载
+
+    data[3 * 2048 + 10] ^= 0xFF
+    data[6 * 2048] ^= 0xFF
+    path.write_bytes(data)
+    sim = flash(path, cache)
+    assert sim.blocks_received == 2
+    assert sorted(sim.memory) == [BASE_ADDR + 3 * 2048, BASE_ADDR + 6 * 2048]
+    assert flash(path, cache).blocks_received == 0
+
+
+def test_stale_cache_sends_everything(tmp_path, firmware):
+    path, _ = firmware
+    cache = DeltaCache(str(tmp_path / "devices"))
+    flash(path, cache)
+
+    # 另一块板没有记录
+    assert flash(path, cache, device_id="SN-0002").blocks_received == 8
+    # 块大小变了
+    assert flash(path, cache, block_size=1024).blocks_received == 16
+    # 缓存过期
+    cache_file = tmp_path / "devices" / f"{BOARD}.json"
+    entry = json.loads(cache_file.read_text())
+    entry["time"] -= cache.max_age + 1
+    cache_file.write_text(json.dumps(entry))
+    assert flash(path, cache).blocks_received == 8
+
+
+def test_delta_needs_device_id(firmware, tmp_path):
+    path, _ = firmware
+    image = load_image(str(path))
+    result = flash_port(image, "unused", 921600, BASE_ADDR, delta_cache=DeltaCache(str(tmp_path)))
+    image.close()
+    assert not result.ok and "device ID" in result.error
@@ -0,0 +1,93 @@
+"""固件文件解析的测试"""
+from iap_programmer.crc import get_load_file_crc
+from iap_programmer.image import load_image
+
+PAGE = 2048
+
+
+def record(rtype: int, addr: int, data: bytes) -> str:
+    raw = bytes([len(data), (addr >> 8) & 0xFF, addr & 0xFF, rtype]) + data
+    return f":{raw.hex().upper()}{-sum(raw) & 0xFF:02X}\n"
+
+
+def linear(upper: int) -> str:
+    """04 扩展线性地址记录"""
+    return record(0x04, 0, upper.to_bytes(2, "big"))
+
+
+def write_hex(path, lines):
+    path.write_text("".join(lines) + record(0x01, 0, b""))
+    return str(path)
+
+
+def flash_bytes(image) -> dict:
+    """镜像中每个块：块地址 → 数据"""
+    return {block.addr: bytes(block.data) for block in image.blocks}
+
+
+def expected_page(page_addr: int, *writes) -> bytes:
+    page = bytearray(b'\xFF' * PAGE)
+    for addr, data in writes:
+        page[addr - page_addr:addr - page_addr + len(data)] = data
+    return bytes(page)
+
+
+def test_gap_inside_page(tmp_path):
+    # 页内有空隙的记录写在各自的真实偏移处，空隙为 0xFF
+    a, b = bytes(range(16)), bytes(range(16, 32))
+    image = load_image(write_hex(tmp_path / "a.hex", [
+        linear(0x0800), record(0, 0x0000, a), record(0, 0x0100, b)]))
+    assert flash_bytes(image) == {0x08000000: expected_page(0x08000000, (0x08000000, a), (0x08000100, b))}
+    assert image.length == 32
+    assert image.crc == get_load_file_crc(a + b)
+
+
+def test_records_out_of_order(tmp_path):
+    a, b = b'\x11' * 16, b'\x22' * 8
+    image = load_image(write_hex(tmp_path / "a.hex", [
+        linear(0x0800), record(0, 0x0810, a), record(0, 0x0004, b)]))
+    assert flash_bytes(image) == {
+        0x08000000: expected_page(0x08000000, (0x08000004, b)),
+        0x08000800: expected_page(0x08000800, (0x08000810, a)),
+    }
+    assert image.min_address == 0x08000004
+    # CRC 按文件中的记录顺序计算
+    assert image.crc == get_load_file_crc(a + b)
+
+
+def test_segment_address_record(tmp_path):
+    # 02 扩展段地址：段值 * 16
+    data = bytes(range(8))
+    image = load_image(write_hex(tmp_path / "a.hex", [
+        record(0x02, 0, (0x1000).to_bytes(2, "big")), record(0, 0x0020, data)]))
+    assert flash_bytes(image) == {0x10000: expected_page(0x10000, (0x10020, data))}
+
+
+def test_record_crossing_page_boundary(tmp_path):
+    data = bytes(range(16))
+    image = load_image(write_hex(tmp_path / "a.hex", [linear(0x0800), record(0, 0x07F8, data)]))
+    assert flash_bytes(image) == {
+        0x08000000: expected_page(0x08000000, (0x080007F8, data[:8])),
+        0x08000800: expected_page(0x08000800, (0x08000800, data[8:])),
+    }
+
+
+def test_only_pages_with_data(tmp_path):
+    # 相距很远的两条记录只产生两个块，中间的页不发送
+    a, b = b'\xAA' * 4, b'\xBB' * 4
+    image = load_image(write_hex(tmp_path / "a.hex", [
+        linear(0x0800), record(0, 0x0000, a), linear(0x0801), record(0, 0x0000, b)]))
+    assert sorted(flash_bytes(image)) == [0x08000000, 0x08010000]
+    assert image.skipped_blocks == 0
+
+
+def test_detach_releases_mapping(tmp_path):
+    path = tmp_path / "app.bin"
+    data = bytes(range(256)) * 9
+    path.write_bytes(data)
+    image = load_image(str(path))
+    image.detach()
+    assert image.mapping is None
+    # 映射已释放，文件可以被改写，镜像内容不变
+    path.write_bytes(b'\x00' * len(data))
+    assert b"".join(bytes(b.data) for b in image.blocks) == data + b'\xFF' * (4096 - len(data))
@@ -0,0 +1,48 @@
+"""解析结果缓存的测试"""
+from iap_programmer.image import load_image
+from iap_programmer.image_cache import ImageCache
+
+
+def write_hex(path, data: bytes):
+    with open(path, 'w') as f:
+        for addr in range(0, len(data), 16):
+            record = bytes([16, addr >> 8, addr & 0xFF, 0]) + data[addr:addr + 16]
+            f.write(f":{record.hex().upper()}{-sum(record) & 0xFF:02X}\n")
+        f.write(":00000001FF\n")
+
+
+def test_hex_hit(tmp_path):
+    path = str(tmp_path / "app.hex")
+    write_hex(path, bytes(range(256)) * 16)
+    cache = ImageCache(str(tmp_path / "cache"))
+    first = cache.load_image(path)
+    second = cache.load_image(path)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert second.crc == first.crc == load_image(path).crc
+    assert [bytes(b.data) for b in second.blocks] == [bytes(b.data) for b in first.blocks]
+    first.close()
+    second.close()
+
+
+def test_bin_bypasses_cache(tmp_path):
+    # BIN 文件直接映射加载，内容哈希比省下的 CRC 计算还慢
+    path = tmp_path / "app.bin"
+    path.write_bytes(bytes(range(256)) * 40)
+    cache = ImageCache(str(tmp_path / "cache"))
+    image = cache.load_image(str(path))
+    assert image.crc == load_image(str(path)).crc
+    assert (cache.hits, cache.misses) == (0, 0)
+    assert not (tmp_path / "cache").exists()
+    image.close()
+
+
+def test_unwritable_cache_still_loads(tmp_path, capsys):
+    # 缓存目录不可用时照常解析
+    path = str(tmp_path / "app.hex")
+    write_hex(path, bytes(range(256)))
+    (tmp_path / "notadir").write_bytes(b"")
+    cache = ImageCache(str(tmp_path / "notadir" / "cache"))
+    image = cache.load_image(path)
+    assert image.crc == load_image(path).crc
+    assert "Image cache write failed" in capsys.readouterr().out
+    image.close()
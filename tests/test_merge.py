@@ -0,0 +1,80 @@
+"""多文件合并的测试"""
+import random
+
+import pytest
+
+from iap_programmer.crc import get_load_file_crc
+from iap_programmer.merge import merge_images, parse_part
+
+rng = random.Random(0)
+
+
+def write_hex(path, addr: int, data: bytes) -> str:
+    """从 addr 开始连续写入 data（每条记录 16 字节，不跨 64K）"""
+    lines = []
+    upper = (addr >> 16).to_bytes(2, "big")
+    raw = bytes([2, 0, 0, 4]) + upper
+    lines.append(f":{raw.hex().upper()}{-sum(raw) & 0xFF:02X}\n")
+    for pos in range(0, len(data), 16):
+        a = (addr + pos) & 0xFFFF
+        raw = bytes([len(data[pos:pos + 16]), a >> 8, a & 0xFF, 0]) + data[pos:pos + 16]
+        lines.append(f":{raw.hex().upper()}{-sum(raw) & 0xFF:02X}\n")
+    path.write_text("".join(lines) + ":00000001FF\n")
+    return str(path)
+
+
+def write_bin(path, data: bytes) -> str:
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_combined_crc_is_crc_of_concatenated_data(tmp_path):
+    app, cal, cfg = rng.randbytes(5000), rng.randbytes(300), rng.randbytes(64)
+    parts = [write_hex(tmp_path / "app.hex", 0x08000000, app),
+             write_bin(tmp_path / "cal.bin", cal) + "@0800F000",
+             write_bin(tmp_path / "cfg.bin", cfg) + "@0800F800"]
+    image = merge_images(parts)
+    assert image.length == len(app) + len(cal) + len(cfg)
+    assert image.crc == get_load_file_crc(app + cal + cfg)
+    assert [part.crc for part in image.parts] == [get_load_file_crc(d) for d in (app, cal, cfg)]
+    # 块地址为绝对地址
+    assert image.absolute
+    assert image.blocks[0].addr == 0x08000000 and image.blocks[-1].addr == 0x0800F800
+
+
+def test_hex_and_bin_share_a_page(tmp_path):
+    # 同一页内互不重叠的数据合并到同一块
+    code, tail = rng.randbytes(100), rng.randbytes(28)
+    image = merge_images([write_hex(tmp_path / "app.hex", 0x08000000, code),
+                          write_bin(tmp_path / "tail.bin", tail) + "@080007E4"])
+    assert len(image.blocks) == 1
+    page = bytearray(b'\xFF' * 2048)
+    page[0:100] = code
+    page[0x7E4:0x800] = tail
+    assert bytes(image.blocks[0].data) == bytes(page)
+
+
+@pytest.mark.parametrize("bin_addr", ["08000040", "07FFFFF0"])
+def test_overlap_is_rejected(tmp_path, bin_addr):
+    parts = [write_hex(tmp_path / "app.hex", 0x08000000, rng.randbytes(128)),
+             write_bin(tmp_path / "cal.bin", rng.randbytes(32)) + "@" + bin_addr]
+    with pytest.raises(ValueError, match="overlaps"):
+        merge_images(parts)
+
+
+def test_adjacent_parts_do_not_overlap(tmp_path):
+    a = write_bin(tmp_path / "a.bin", rng.randbytes(64))
+    b = write_bin(tmp_path / "b.bin", rng.randbytes(64))
+    image = merge_images([a + "@08000000", b + "@08000040"])
+    assert image.length == 128
+
+
+def test_part_address_rules(tmp_path):
+    hex_path = write_hex(tmp_path / "app.hex", 0x08000000, bytes(16))
+    bin_path = write_bin(tmp_path / "cal.bin", bytes(16))
+    with pytest.raises(ValueError, match="absolute addresses"):
+        merge_images([hex_path + "@08000000"])
+    with pytest.raises(ValueError, match="need a base address"):
+        merge_images([bin_path])
+    with pytest.raises(ValueError, match="Invalid base address"):
+        parse_part(bin_path + "@XYZ")
@@ -0,0 +1,120 @@
+"""单板数据写入的测试"""
+import random
+
+import pytest
+
+from iap_programmer.image import load_image
+from iap_programmer.merge import merge_images
+from iap_programmer.patch import Patch, apply_patches, parse_patch
+from iap_programmer.protocol import PacketStream
+
+BASE_ADDR = 0x08000000
+
+
+def write_hex(path, chunks):
+    """chunks 为按文件顺序的 (绝对地址, 数据)，每条记录 16 字节"""
+    with open(path, 'w') as f:
+        for addr, data in chunks:
+            for pos in range(0, len(data), 16):
+                a = addr + pos
+                ela = bytes([2, 0, 0, 4, a >> 24, (a >> 16) & 0xFF])
+                f.write(f":{ela.hex().upper()}{-sum(ela) & 0xFF:02X}\n")
+                record = bytes([len(data[pos:pos + 16]), (a >> 8) & 0xFF, a & 0xFF, 0]) + data[pos:pos + 16]
+                f.write(f":{record.hex().upper()}{-sum(record) & 0xFF:02X}\n")
+        f.write(":00000001FF\n")
+
+
+def patched_bytes(data: bytes, offset: int, patch: Patch) -> bytes:
+    return data[:offset] + patch.data + data[offset + len(patch.data):]
+
+
+def assert_same_image(image, expected):
+    assert image.crc == expected.crc
+    assert [(b.addr, bytes(b.data)) for b in image.blocks] == [(b.addr, bytes(b.data)) for b in expected.blocks]
+
+
+@pytest.fixture
+def blank_bin(tmp_path):
+    # 第二块全为 0xFF，skip_blank 时被去掉
+    path = tmp_path / "app.bin"
+    path.write_bytes(bytes(range(256)) * 8 + b'\xFF' * 2048 + bytes(2048))
+    return str(path)
+
+
+def test_rejected_patch_keeps_crc(blank_bin):
+    image = load_image(blank_bin, skip_blank=True)
+    stream = PacketStream(image, BASE_ADDR)
+    crc = image.crc
+    with pytest.raises(ValueError, match="skipped blank block"):
+        apply_patches(image, [Patch(BASE_ADDR + 2048, b'\x01')], BASE_ADDR, stream)
+    assert image.crc == crc
+    image.close()
+
+
+def test_patch_below_base_reports_absolute_address(blank_bin):
+    image = load_image(blank_bin)
+    with pytest.raises(ValueError, match="0x07FFFFF0"):
+        apply_patches(image, [Patch(BASE_ADDR - 0x10, b'\x01')], BASE_ADDR)
+    image.close()
+
+
+@pytest.mark.parametrize("compression", [None, "lz4"])
+def test_bin_patch_equals_reload(tmp_path, compression):
+    # 跨块边界写入，结果与把数据写进文件后重新加载一致，数据包与重新编译的一致
+    data = random.Random(1).randbytes(3 * 2048 + 100)
+    path = tmp_path / "app.bin"
+    path.write_bytes(data)
+    patches = [parse_patch("080007FC=str:SN-00123"), parse_patch("08001810=u32:0xDEADBEEF")]
+    image = load_image(str(path))
+    stream = PacketStream(image, BASE_ADDR, compression=compression)
+    apply_patches(image, patches, BASE_ADDR, stream)
+
+    for patch in patches:
+        data = patched_bytes(data, patch.addr - BASE_ADDR, patch)
+    path.write_bytes(data)
+    expected = load_image(str(path))
+    assert_same_image(image, expected)
+    fresh = PacketStream(expected, BASE_ADDR, compression=compression)
+    assert bytes(stream.packets(0, len(stream))) == bytes(fresh.packets(0, len(fresh)))
+    image.close()
+    expected.close()
+
+
+def test_hex_patch_equals_reload(tmp_path):
+    # 记录不按地址顺序、中间有空隙时，CRC 仍按文件顺序增量更新
+    rng = random.Random(2)
+    chunks = [(0x08001000, rng.randbytes(96)), (0x08000000, rng.randbytes(64)), (0x08000800, rng.randbytes(32))]
+    path = str(tmp_path / "app.hex")
+    write_hex(path, chunks)
+    patch = Patch(0x08000030, b"\x11" * 8)
+    image = load_image(path)
+    apply_patches(image, [patch])
+
+    chunks[1] = (0x08000000, patched_bytes(chunks[1][1], 0x30, patch))
+    write_hex(path, chunks)
+    assert_same_image(image, load_image(path))
+
+
+def test_patch_outside_file_data_is_rejected(tmp_path):
+    path = str(tmp_path / "app.hex")
+    write_hex(path, [(0x08000000, bytes(32))])
+    image = load_image(path)
+    crc = image.crc
+    with pytest.raises(ValueError, match="outside the file data"):
+        apply_patches(image, [Patch(0x0800001C, bytes(8))])
+    assert image.crc == crc
+
+
+def test_merged_patch_equals_merge_of_patched_files(tmp_path):
+    rng = random.Random(3)
+    app = tmp_path / "app.hex"
+    write_hex(str(app), [(0x08000000, rng.randbytes(256))])
+    sn = tmp_path / "sn.bin"
+    sn.write_bytes(b"\xFF" * 64)
+    parts = [str(app), f"{sn}@0800F800"]
+    patch = parse_patch("0800F810=str:SN-42")
+    image = merge_images(parts)
+    apply_patches(image, [patch])
+
+    sn.write_bytes(patched_bytes(b"\xFF" * 64, 0x10, patch))
+    assert_same_image(image, merge_images(parts))
@@ -0,0 +1,83 @@
+"""下载协议与模拟器的回归测试"""
+import sys
+import time
+import random
+import threading
+
+import pytest
+
+from iap_programmer.image import load_image
+from iap_programmer.protocol import Downloader, open_serial
+from iap_programmer.simulator import BootloaderSimulator
+
+BASE_ADDR = 0x08000000
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / "app.bin"
+    path.write_bytes(random.Random(0).randbytes(16 * 2048))
+    image = load_image(str(path))
+    yield image
+    image.close()
+
+
+def flash(image, window, baud=921600, downloader_options=None, **sim_options):
+    with BootloaderSimulator(baud_rate=baud, **sim_options) as sim:
+        ser = open_serial(sim.start_tcp(), baud)
+        try:
+            downloader = Downloader(ser, window=window, **(downloader_options or {}))
+            downloader.download(image, BASE_ADDR)
+        finally:
+            ser.close()
+    return sim, downloader
+
+
+def assert_written(sim, image):
+    for block in image.blocks:
+        assert sim.memory.get(BASE_ADDR + block.addr) == bytes(block.data), hex(BASE_ADDR + block.addr)
+
+
+@pytest.mark.parametrize("window", [1, 4])
+def test_download(image, window):
+    sim, _ = flash(image, window)
+    assert_written(sim, image)
+    assert sim.finishes == 1
+
+
+def test_pipelined_retry_with_slow_acks(image):
+    # 写 flash 比重新同步的等待时间更长：窗口内其余块的应答在重发后才到达
+    sim, downloader = flash(image, 4, program_latency=0.08, fail_blocks=(2, 12))
+    assert sim.naks == 2
+    assert downloader.retry_count == 2
+    assert_written(sim, image)
+
+
+def test_pipelined_retry_at_low_baud(image):
+    # 115200 波特率下一个数据包约 180ms，结束命令不能在最后一个窗口应答前发出
+    sim, downloader = flash(image, 4, baud=115200, fail_blocks=(5,))
+    assert downloader.retry_count == 1
+    assert_written(sim, image)
+    assert sim.finishes == 1
+
+
+def test_pipelined_lost_replies(image):
+    # 应答丢失后其后的应答都错位一块，必须从上次确认对应关系处重发
+    sim, downloader = flash(image, 4, program_latency=0.02, drop_rate=0.05, seed=1,
+                            downloader_options={"retries": 5, "timeouts": {"blocks": 0.3}})
+    assert sim.drops
+    assert_written(sim, image)
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="pty is POSIX only")
+def test_stop_with_pending_acks(monkeypatch):
+    # 应答尚未发出时停止模拟器，服务线程应正常结束
+    errors = []
+    monkeypatch.setattr(threading, "excepthook", errors.append)
+    sim = BootloaderSimulator(baud_rate=9600)
+    ser = open_serial(sim.start_pty(), 9600)
+    ser.write(b'\x5A\xA5' * 50)
+    time.sleep(0.1)
+    sim.stop()
+    ser.close()
+    assert not errors